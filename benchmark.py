@@ -2,20 +2,37 @@
 """
 Ollama Stress Test & Benchmark Suite
 Tests performance, resource usage, and scalability
+
+Scenarios run closed-loop (a fixed number of requests at a fixed
+concurrency) or open-loop (Poisson arrivals at a target rate, whatever the
+server's speed), streaming or not. Streaming scenarios measure time to first
+token and inter-token latency. Results are kept in log-linear histograms and
+written to benchmark_results_<timestamp>.json, which can be diffed against an
+earlier run with --compare.
+
+    python benchmark.py                                   # the six default scenarios
+    python benchmark.py --scenarios benchmark_scenarios.json --only chat-stream-open
+    python benchmark.py --scenarios benchmark_scenarios.json --only chat-stream-open \\
+        --find-rate --slo ttft_p99=2.0                    # highest rate that holds p99 TTFT under 2s
+    python benchmark.py --compare benchmark_results_20251008_184827.json
 """
 
+import argparse
 import asyncio
 import httpx
+import math
+import os
+import random
 import time
 import json
 import statistics
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import sys
 
 # Configuration
 BASE_URL = "http://localhost:8080/v1/chat/completions"
-API_KEY = "sk-oatisawesome-2024-ml-api"
+API_KEY = os.getenv("API_KEY", "sk-oatisawesome-2024-ml-api")
 MODEL = "llama3.1:8b"
 
 # Test prompts of varying sizes
@@ -35,169 +52,402 @@ PROMPTS = {
     Aim for about 300-400 words."""
 }
 
+# Settings a scenario inherits unless it overrides them
+SCENARIO_DEFAULTS = {
+    "prompt": "small",       # key of PROMPTS or literal prompt text
+    "mode": "closed",        # closed: `requests` at `concurrency`; open: Poisson arrivals at `rate` for `duration`
+    "requests": 10,
+    "concurrency": 1,
+    "rate": 1.0,             # requests/second (open loop)
+    "duration": 30.0,        # seconds of arrivals (open loop)
+    "stream": False,
+    "warmup": 0,             # requests sent first and left out of the results
+    "max_tokens": None,
+    "slo": {},               # e.g. {"ttft_p99": 2.0, "error_rate": 0.01}
+}
+
+# The original six tests, used when no scenario file is given
+DEFAULT_SCENARIOS = [
+    {"name": "Baseline - Single Request", "prompt": "small", "requests": 1, "concurrency": 1},
+    {"name": "Small Prompts - 5 Concurrent", "prompt": "small", "requests": 10, "concurrency": 5},
+    {"name": "Medium Prompts - 5 Concurrent", "prompt": "medium", "requests": 10, "concurrency": 5},
+    {"name": "Medium Prompts - 10 Concurrent", "prompt": "medium", "requests": 20, "concurrency": 10},
+    {"name": "Large Prompts - 3 Concurrent", "prompt": "large", "requests": 5, "concurrency": 3},
+    {"name": "Stress Test - 20 Concurrent", "prompt": "medium", "requests": 30, "concurrency": 20},
+]
+
+# Percentiles reported for every histogram
+PERCENTILES = (("p50", 0.50), ("p90", 0.90), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))
+
+# Compared by --compare; True where a higher value is better
+COMPARED_METRICS = {
+    "requests_per_second": True,
+    "tokens_per_second": True,
+    "error_rate": False,
+    "latency_p50": False,
+    "latency_p95": False,
+    "latency_p99": False,
+    "ttft_p50": False,
+    "ttft_p99": False,
+    "itl_p50": False,
+    "itl_p99": False,
+}
+
+# Changes smaller than this (seconds, or ratio for error_rate) are never regressions
+COMPARE_ABSOLUTE_FLOOR = 0.005
+
+
+class Histogram:
+    """Log-linear histogram of durations, in the style of HdrHistogram
+
+    Values are recorded in microseconds. Below 2**SIGNIFICANT_BITS each
+    microsecond has its own bucket; above, every power of two is split into
+    2**(SIGNIFICANT_BITS - 1) equal buckets, so any percentile is within
+    about 0.8% of the true value at every scale, in constant memory.
+    Buckets are plain counts, so histograms from several runs can be merged.
+    """
+
+    SIGNIFICANT_BITS = 8
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, micros: int) -> int:
+        shift = max(0, micros.bit_length() - self.SIGNIFICANT_BITS)
+        return (micros >> shift) << shift
+
+    def _width(self, bucket: int) -> int:
+        return 1 << max(0, bucket.bit_length() - self.SIGNIFICANT_BITS)
+
+    def record(self, seconds: float):
+        bucket = self._bucket(max(0, int(seconds * 1_000_000)))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "Histogram"):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                middle = (bucket + self._width(bucket) / 2) / 1_000_000
+                return min(max(middle, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        summary = {"count": self.count, "min": self.min, "mean": self.total / self.count}
+        for name, fraction in PERCENTILES:
+            summary[name] = self.percentile(fraction)
+        summary["max"] = self.max
+        summary["buckets_us"] = {str(bucket): count for bucket, count in sorted(self.counts.items())}
+        return summary
+
+
 class BenchmarkResults:
     """Store and analyze benchmark results"""
-    def __init__(self, test_name: str):
-        self.test_name = test_name
-        self.latencies: List[float] = []
+    def __init__(self, scenario: Dict[str, Any]):
+        self.scenario = scenario
+        self.test_name = scenario["name"]
+        self.latency = Histogram()
+        self.ttft = Histogram()
+        self.itl = Histogram()
         self.tokens_generated: List[int] = []
         self.tokens_per_second: List[float] = []
+        self.tokens_exact = True
+        self.successes = 0
         self.errors: List[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
         self.start_time: float = 0
         self.end_time: float = 0
 
-    def add_result(self, latency: float, tokens: int, error: str = None):
+    def add_result(self, result: Dict[str, Any]):
         """Add a single request result"""
-        if error:
-            self.errors.append(error)
-        else:
-            self.latencies.append(latency)
-            self.tokens_generated.append(tokens)
-            if latency > 0:
-                self.tokens_per_second.append(tokens / latency)
+        if result["error"]:
+            self.errors.append(result["error"])
+            return
+        self.successes += 1
+        self.latency.record(result["latency"])
+        if result["ttft"] is not None:
+            self.ttft.record(result["ttft"])
+        for gap in result["itl"]:
+            self.itl.record(gap)
+        if result["tokens"] is not None:
+            self.tokens_generated.append(result["tokens"])
+            self.tokens_exact = self.tokens_exact and result["tokens_exact"]
+            # Generation speed: tokens over the time after the first one arrived
+            generating = result["latency"] - (result["ttft"] or 0)
+            if generating > 0 and result["tokens"] > 1:
+                self.tokens_per_second.append(result["tokens"] / generating)
 
     def get_stats(self) -> Dict[str, Any]:
         """Calculate statistics from results"""
-        if not self.latencies:
-            return {"error": "No successful requests"}
-
         total_time = self.end_time - self.start_time
-        total_requests = len(self.latencies) + len(self.errors)
-        successful_requests = len(self.latencies)
-
-        sorted_latencies = sorted(self.latencies)
-
-        return {
+        total_requests = self.successes + len(self.errors)
+        stats = {
             "test_name": self.test_name,
+            "scenario": self.scenario,
             "total_requests": total_requests,
-            "successful_requests": successful_requests,
+            "successful_requests": self.successes,
             "failed_requests": len(self.errors),
-            "success_rate": f"{(successful_requests/total_requests)*100:.1f}%",
-            "total_time": f"{total_time:.2f}s",
-            "requests_per_second": f"{successful_requests/total_time:.2f}",
-            "latency": {
-                "min": f"{min(self.latencies):.2f}s",
-                "max": f"{max(self.latencies):.2f}s",
-                "mean": f"{statistics.mean(self.latencies):.2f}s",
-                "median": f"{statistics.median(self.latencies):.2f}s",
-                "p95": f"{sorted_latencies[int(len(sorted_latencies)*0.95)]:.2f}s" if len(sorted_latencies) > 1 else "N/A",
-                "p99": f"{sorted_latencies[int(len(sorted_latencies)*0.99)]:.2f}s" if len(sorted_latencies) > 1 else "N/A",
-            },
+            "error_rate": len(self.errors) / total_requests if total_requests else 0.0,
+            "total_time": total_time,
+            "requests_per_second": self.successes / total_time if total_time > 0 else 0.0,
+            "max_in_flight": self.max_in_flight,
+            "latency": self.latency.summary(),
             "tokens": {
                 "total": sum(self.tokens_generated),
-                "mean_per_request": f"{statistics.mean(self.tokens_generated):.0f}",
-                "tokens_per_second_mean": f"{statistics.mean(self.tokens_per_second):.1f}",
-                "tokens_per_second_max": f"{max(self.tokens_per_second):.1f}",
-            }
+                "exact": self.tokens_exact,
+                "mean_per_request": statistics.mean(self.tokens_generated) if self.tokens_generated else 0,
+                "tokens_per_second_mean": statistics.mean(self.tokens_per_second) if self.tokens_per_second else 0,
+                "tokens_per_second_max": max(self.tokens_per_second, default=0),
+            },
+            "errors": sorted(set(self.errors))[:10],
         }
-
-async def make_request(client: httpx.AsyncClient, prompt: str) -> Dict[str, Any]:
-    """Make a single API request and measure performance"""
-    start_time = time.time()
+        if self.scenario["stream"]:
+            stats["ttft"] = self.ttft.summary()
+            stats["itl"] = self.itl.summary()
+        stats["slo"] = check_slo(stats, self.scenario["slo"])
+        return stats
+
+
+def metric_value(stats: Dict[str, Any], name: str) -> Optional[float]:
+    """Look up "error_rate", "requests_per_second" or "<latency|ttft|itl>_<percentile>" in a stats dict"""
+    if name in ("error_rate", "requests_per_second"):
+        return stats.get(name)
+    if name == "tokens_per_second":
+        return stats.get("tokens", {}).get("tokens_per_second_mean")
+    histogram, _, percentile = name.partition("_")
+    return stats.get(histogram, {}).get(percentile)
+
+
+def check_slo(stats: Dict[str, Any], slo: Dict[str, float]) -> Dict[str, Any]:
+    """Compare stats with upper limits such as {"ttft_p99": 2.0}; requests_per_second is a lower limit"""
+    report = {}
+    for name, limit in slo.items():
+        actual = metric_value(stats, name)
+        if name == "requests_per_second":
+            passed = actual is not None and actual >= limit
+        else:
+            passed = actual is not None and actual <= limit
+        report[name] = {"limit": limit, "actual": actual, "pass": passed}
+    return report
+
+
+def chunk_content(chunk: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+    """Generated text and completion token count (final chunk only) of one stream chunk
+
+    Handles the proxy's OpenAI chunks and Ollama's native ones.
+    """
+    if "choices" in chunk:
+        choices = chunk["choices"] or [{}]
+        content = (choices[0].get("delta") or {}).get("content") or ""
+        usage = chunk.get("usage") or {}
+        return content, usage.get("completion_tokens")
+    content = (chunk.get("message") or {}).get("content") or chunk.get("response") or ""
+    return content, chunk.get("eval_count") if chunk.get("done") else None
+
+
+async def make_request(client: httpx.AsyncClient, url: str, prompt: str,
+                       scenario: Dict[str, Any], started: Optional[float] = None) -> Dict[str, Any]:
+    """Make a single API request and measure performance
+
+    `started` is when the request was due to be sent. Open-loop runs pass
+    their schedule time, so time spent waiting for a connection counts
+    against latency instead of being hidden (coordinated omission).
+    """
+    start_time = started if started is not None else time.perf_counter()
+    result = {"latency": 0.0, "ttft": None, "itl": [], "tokens": None, "tokens_exact": True, "error": None}
+    body = {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": scenario["stream"]
+    }
+    if scenario["max_tokens"]:
+        body["max_tokens"] = scenario["max_tokens"]
 
     try:
-        response = await client.post(
-            BASE_URL,
+        async with client.stream(
+            "POST",
+            url,
             headers={
                 "Authorization": f"Bearer {API_KEY}",
                 "Content-Type": "application/json"
             },
-            json={
-                "model": MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": False
-            },
+            json=body,
             timeout=300.0
-        )
-
-        elapsed = time.time() - start_time
-
-        if response.status_code == 200:
-            data = response.json()
-            # Handle both OpenAI and Ollama response formats
-            if "choices" in data:
-                content = data["choices"][0]["message"]["content"]
-                tokens = data.get("usage", {}).get("completion_tokens", len(content.split()))
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+            elif scenario["stream"]:
+                chunks = 0
+                last = None
+                async for line in response.aiter_lines():
+                    line = line.strip()
+                    if line.startswith("data:"):
+                        line = line[5:].strip()
+                    if not line or line == "[DONE]":
+                        continue
+                    content, tokens = chunk_content(json.loads(line))
+                    if tokens is not None:
+                        result["tokens"] = tokens
+                    if not content:
+                        continue
+                    now = time.perf_counter()
+                    if last is None:
+                        result["ttft"] = now - start_time
+                    else:
+                        result["itl"].append(now - last)
+                    last = now
+                    chunks += 1
+                if result["tokens"] is None:
+                    # No usage block: one streamed chunk is about one token
+                    result["tokens"] = chunks
+                    result["tokens_exact"] = False
             else:
-                content = data.get("message", {}).get("content", "")
-                tokens = len(content.split())  # Rough estimate
-
-            return {
-                "success": True,
-                "latency": elapsed,
-                "tokens": tokens,
-                "error": None
-            }
-        else:
-            return {
-                "success": False,
-                "latency": elapsed,
-                "tokens": 0,
-                "error": f"HTTP {response.status_code}"
-            }
-
+                data = json.loads(await response.aread())
+                # Handle both OpenAI and Ollama response formats
+                if "choices" in data:
+                    result["tokens"] = (data.get("usage") or {}).get("completion_tokens")
+                else:
+                    result["tokens"] = data.get("eval_count")
     except Exception as e:
-        elapsed = time.time() - start_time
-        return {
-            "success": False,
-            "latency": elapsed,
-            "tokens": 0,
-            "error": str(e)
-        }
-
-async def run_concurrent_test(
-    num_requests: int,
-    concurrency: int,
-    prompt: str,
-    test_name: str
-) -> BenchmarkResults:
-    """Run benchmark with specified concurrency"""
-    print(f"\n{'='*60}")
-    print(f"Running: {test_name}")
-    print(f"Requests: {num_requests} | Concurrency: {concurrency}")
-    print(f"{'='*60}")
-
-    results = BenchmarkResults(test_name)
-    results.start_time = time.time()
-
-    async with httpx.AsyncClient() as client:
-        # Create a semaphore to limit concurrency
-        semaphore = asyncio.Semaphore(concurrency)
-
-        async def bounded_request():
-            async with semaphore:
-                return await make_request(client, prompt)
+        result["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+    result["latency"] = time.perf_counter() - start_time
+    return result
+
+
+def prompt_text(scenario: Dict[str, Any]) -> str:
+    return PROMPTS.get(scenario["prompt"], scenario["prompt"])
+
+
+async def run_closed_loop(client: httpx.AsyncClient, url: str, scenario: Dict[str, Any],
+                          results: Optional[BenchmarkResults], num_requests: int):
+    """Send num_requests with at most scenario["concurrency"] in flight"""
+    semaphore = asyncio.Semaphore(scenario["concurrency"])
+    prompt = prompt_text(scenario)
+
+    async def bounded_request():
+        async with semaphore:
+            return await make_request(client, url, prompt, scenario)
+
+    tasks = [bounded_request() for _ in range(num_requests)]
+    completed = 0
+    for coro in asyncio.as_completed(tasks):
+        result = await coro
+        completed += 1
+        if results is None:
+            continue
+        results.add_result(result)
+        # Progress indicator
+        if completed % max(1, num_requests // 10) == 0 or completed == num_requests:
+            print(f"Progress: {completed}/{num_requests} requests completed...")
+
+
+async def run_open_loop(client: httpx.AsyncClient, url: str, scenario: Dict[str, Any],
+                        results: BenchmarkResults, rng: random.Random):
+    """Start requests at Poisson-distributed times, scenario["rate"] per second on average
+
+    Arrivals do not wait for earlier requests to finish, so a server that
+    falls behind builds up a backlog (reported as max_in_flight) exactly as
+    it would with independent real clients.
+    """
+    prompt = prompt_text(scenario)
+    rate, duration = scenario["rate"], scenario["duration"]
+    tasks = []
+
+    async def arrival(due: float):
+        results.in_flight += 1
+        results.max_in_flight = max(results.max_in_flight, results.in_flight)
+        try:
+            results.add_result(await make_request(client, url, prompt, scenario, started=due))
+        finally:
+            results.in_flight -= 1
+
+    start = time.perf_counter()
+    due = start
+    next_report = start + 10
+    while True:
+        due += rng.expovariate(rate)
+        if due - start > duration:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(arrival(due)))
+        if time.perf_counter() >= next_report:
+            print(f"Progress: {len(tasks)} sent, {results.successes + len(results.errors)} completed, "
+                  f"{results.in_flight} in flight...")
+            next_report += 10
+    await asyncio.gather(*tasks)
+
+
+async def run_scenario(url: str, scenario: Dict[str, Any], rng: random.Random, quiet: bool = False) -> BenchmarkResults:
+    """Run one scenario: warm-up requests first, then the measured load"""
+    if not quiet:
+        print(f"\n{'='*60}")
+        print(f"Running: {scenario['name']}")
+        if scenario["mode"] == "open":
+            print(f"Open loop: {scenario['rate']:g} req/s for {scenario['duration']:g}s | "
+                  f"Stream: {scenario['stream']} | Warm-up: {scenario['warmup']}")
+        else:
+            print(f"Requests: {scenario['requests']} | Concurrency: {scenario['concurrency']} | "
+                  f"Stream: {scenario['stream']} | Warm-up: {scenario['warmup']}")
+        print(f"{'='*60}")
+
+    results = BenchmarkResults(scenario)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+    async with httpx.AsyncClient(limits=limits) as client:
+        if scenario["warmup"]:
+            await run_closed_loop(client, url, scenario, None, scenario["warmup"])
+        results.start_time = time.perf_counter()
+        if scenario["mode"] == "open":
+            await run_open_loop(client, url, scenario, results, rng)
+        else:
+            await run_closed_loop(client, url, scenario, results, scenario["requests"])
+        results.end_time = time.perf_counter()
+    return results
 
-        # Create all tasks
-        tasks = [bounded_request() for _ in range(num_requests)]
 
-        # Run with progress indication
-        completed = 0
-        for coro in asyncio.as_completed(tasks):
-            result = await coro
-            completed += 1
+def format_seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "N/A"
+    return f"{value * 1000:.1f}ms" if value < 1 else f"{value:.2f}s"
 
-            results.add_result(
-                result["latency"],
-                result["tokens"],
-                result["error"]
-            )
 
-            # Progress indicator
-            if completed % max(1, num_requests // 10) == 0 or completed == num_requests:
-                print(f"Progress: {completed}/{num_requests} requests completed...")
+def print_histogram(label: str, summary: Dict[str, Any]):
+    if not summary.get("count"):
+        return
+    row = "  ".join(f"{name}={format_seconds(summary[name])}" for name, _ in PERCENTILES)
+    print(f"  {label:<20} min={format_seconds(summary['min'])}  {row}  max={format_seconds(summary['max'])}"
+          f"  (n={summary['count']})")
 
-    results.end_time = time.time()
-    return results
 
-def print_results(results: BenchmarkResults):
+def print_results(results: BenchmarkResults) -> Dict[str, Any]:
     """Pretty print benchmark results"""
     stats = results.get_stats()
 
-    if "error" in stats:
-        print(f"\n❌ {stats['error']}")
-        return
-
     print(f"\n{'='*60}")
     print(f"📊 Results: {stats['test_name']}")
     print(f"{'='*60}")
@@ -205,105 +455,288 @@ def print_results(results: BenchmarkResults):
     print(f"  Total Requests:      {stats['total_requests']}")
     print(f"  Successful:          {stats['successful_requests']}")
     print(f"  Failed:              {stats['failed_requests']}")
-    print(f"  Success Rate:        {stats['success_rate']}")
-    print(f"  Total Time:          {stats['total_time']}")
-    print(f"  Requests/Second:     {stats['requests_per_second']}")
-
-    print(f"\n⏱️  Latency (Response Time):")
-    print(f"  Min:                 {stats['latency']['min']}")
-    print(f"  Mean:                {stats['latency']['mean']}")
-    print(f"  Median:              {stats['latency']['median']}")
-    print(f"  95th percentile:     {stats['latency']['p95']}")
-    print(f"  99th percentile:     {stats['latency']['p99']}")
-    print(f"  Max:                 {stats['latency']['max']}")
-
-    print(f"\n🔤 Token Generation:")
-    print(f"  Total Tokens:        {stats['tokens']['total']}")
-    print(f"  Mean/Request:        {stats['tokens']['mean_per_request']}")
-    print(f"  Tokens/Second (avg): {stats['tokens']['tokens_per_second_mean']}")
-    print(f"  Tokens/Second (max): {stats['tokens']['tokens_per_second_max']}")
+    print(f"  Error Rate:          {stats['error_rate']:.1%}")
+    print(f"  Total Time:          {stats['total_time']:.2f}s")
+    print(f"  Requests/Second:     {stats['requests_per_second']:.2f}")
+    if results.scenario["mode"] == "open":
+        print(f"  Max In Flight:       {stats['max_in_flight']}")
+
+    if not stats["successful_requests"]:
+        print(f"\n❌ No successful requests")
+    else:
+        print(f"\n⏱️  Latency:")
+        print_histogram("Response time", stats["latency"])
+        if "ttft" in stats:
+            print_histogram("Time to first token", stats["ttft"])
+            print_histogram("Inter-token", stats["itl"])
+
+        print(f"\n🔤 Token Generation{'' if stats['tokens']['exact'] else ' (estimated from chunks)'}:")
+        print(f"  Total Tokens:        {stats['tokens']['total']}")
+        print(f"  Mean/Request:        {stats['tokens']['mean_per_request']:.0f}")
+        print(f"  Tokens/Second (avg): {stats['tokens']['tokens_per_second_mean']:.1f}")
+        print(f"  Tokens/Second (max): {stats['tokens']['tokens_per_second_max']:.1f}")
+
+    if stats["slo"]:
+        print(f"\n🎯 SLO:")
+        for name, check in stats["slo"].items():
+            actual = "N/A" if check["actual"] is None else f"{check['actual']:.3f}"
+            print(f"  {'✅' if check['pass'] else '❌'} {name}: {actual} (limit {check['limit']})")
 
     if results.errors:
         print(f"\n⚠️  Errors ({len(results.errors)}):")
-        for i, error in enumerate(results.errors[:5], 1):
+        for i, error in enumerate(stats["errors"][:5], 1):
             print(f"  {i}. {error}")
-        if len(results.errors) > 5:
-            print(f"  ... and {len(results.errors) - 5} more")
+        if len(stats["errors"]) > 5:
+            print(f"  ... and {len(stats['errors']) - 5} more kinds")
 
     print(f"\n{'='*60}\n")
 
     return stats
 
-async def main():
-    """Run complete benchmark suite"""
-    print("\n" + "="*60)
-    print("🚀 OLLAMA STRESS TEST & BENCHMARK SUITE")
-    print("="*60)
-    print(f"\nModel: {MODEL}")
-    print(f"Endpoint: {BASE_URL}")
-    print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-    all_results = []
+async def find_rate(url: str, scenario: Dict[str, Any], min_rate: float, max_rate: float,
+                    steps: int, rng: random.Random) -> Dict[str, Any]:
+    """Highest open-loop rate at which the scenario still meets its SLO
+
+    The rate doubles from min_rate until a run misses the SLO (or max_rate
+    is reached), then `steps` bisection runs narrow down the boundary.
+    """
+    probes = []
+
+    async def probe(rate: float) -> bool:
+        results = await run_scenario(url, dict(scenario, mode="open", rate=rate), rng, quiet=True)
+        stats = results.get_stats()
+        passed = bool(stats["slo"]) and all(check["pass"] for check in stats["slo"].values())
+        probes.append({
+            "rate": rate,
+            "pass": passed,
+            "requests_per_second": stats["requests_per_second"],
+            "error_rate": stats["error_rate"],
+            "max_in_flight": stats["max_in_flight"],
+            "slo": stats["slo"],
+        })
+        detail = ", ".join(
+            f"{name}={'N/A' if c['actual'] is None else format(c['actual'], '.3f')}" for name, c in stats["slo"].items()
+        )
+        print(f"  {rate:8.2f} req/s  {'✅ pass' if passed else '❌ fail'}  {detail}")
+        return passed
 
-    # Test 1: Baseline - Single request
-    print("\n" + "="*60)
-    print("TEST 1: BASELINE (Single Request)")
-    print("="*60)
-    result = await run_concurrent_test(1, 1, PROMPTS["small"], "Baseline - Single Request")
-    all_results.append(print_results(result))
+    print(f"\n{'='*60}")
+    print(f"Rate search: {scenario['name']}")
+    print(f"SLO: {', '.join(f'{k} <= {v}' for k, v in scenario['slo'].items())} | "
+          f"{scenario['duration']:g}s per probe")
+    print(f"{'='*60}")
 
-    # Test 2: Small prompts - Low concurrency
-    print("\n" + "="*60)
-    print("TEST 2: SMALL PROMPTS - LOW LOAD")
-    print("="*60)
-    result = await run_concurrent_test(10, 5, PROMPTS["small"], "Small Prompts - 5 Concurrent")
-    all_results.append(print_results(result))
+    best, worst = None, None
+    rate = min_rate
+    while rate <= max_rate:
+        if await probe(rate):
+            best = rate
+            rate *= 2
+        else:
+            worst = rate
+            break
+    if best is not None and worst is None and best < max_rate:
+        if await probe(max_rate):
+            best = max_rate
+        else:
+            worst = max_rate
+    if best is not None and worst is not None:
+        for _ in range(steps):
+            middle = (best + worst) / 2
+            if await probe(middle):
+                best = middle
+            else:
+                worst = middle
+
+    if best is None:
+        print(f"\n❌ SLO missed even at {min_rate:g} req/s")
+    else:
+        print(f"\n✅ Highest rate meeting the SLO: {best:.2f} req/s"
+              + (f" (fails at {worst:.2f})" if worst is not None else f" (max tested)"))
+    return {"test_name": scenario["name"], "scenario": scenario, "max_rate": best, "first_failing_rate": worst,
+            "probes": probes}
+
+
+def flatten_stats(stats: Dict[str, Any]) -> Dict[str, float]:
+    """COMPARED_METRICS of one scenario, from a v2 result or an original benchmark.py result"""
+    flat = {}
+    if "median" in stats.get("latency", {}):
+        # Original format: strings like "2.67s", "N/A", "100.0%"
+        def seconds(value):
+            return float(value[:-1]) if isinstance(value, str) and value.endswith("s") else None
+        latency = stats.get("latency", {})
+        flat["latency_p50"] = seconds(latency.get("median"))
+        flat["latency_p95"] = seconds(latency.get("p95"))
+        flat["latency_p99"] = seconds(latency.get("p99"))
+        flat["requests_per_second"] = float(stats["requests_per_second"]) if "requests_per_second" in stats else None
+        total = stats.get("total_requests") or 0
+        flat["error_rate"] = stats.get("failed_requests", 0) / total if total else None
+        tps = stats.get("tokens", {}).get("tokens_per_second_mean")
+        flat["tokens_per_second"] = float(tps) if tps and float(tps) > 0 else None
+    else:
+        for name in COMPARED_METRICS:
+            flat[name] = metric_value(stats, name)
+        if stats.get("scenario", {}).get("mode") == "open":
+            # Open-loop throughput is the offered load, not a measurement
+            flat.pop("requests_per_second")
+    return {name: value for name, value in flat.items() if value is not None}
+
+
+def compare_results(previous: Any, current: List[Dict[str, Any]], threshold: float) -> List[str]:
+    """Print a per-scenario diff against an earlier results file and return the regressions"""
+    previous_runs = previous.get("results", []) if isinstance(previous, dict) else previous
+    before = {stats["test_name"]: flatten_stats(stats) for stats in previous_runs if "test_name" in stats}
+    regressions = []
 
-    # Test 3: Medium prompts - Low concurrency
     print("\n" + "="*60)
-    print("TEST 3: MEDIUM PROMPTS - LOW LOAD")
+    print(f"🔍 COMPARISON (regression threshold {threshold:.0%})")
     print("="*60)
-    result = await run_concurrent_test(10, 5, PROMPTS["medium"], "Medium Prompts - 5 Concurrent")
-    all_results.append(print_results(result))
+    for stats in current:
+        name = stats["test_name"]
+        if name not in before or "latency" not in stats:
+            continue
+        now = flatten_stats(stats)
+        print(f"\n{name}")
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in now or metric not in before[name]:
+                continue
+            old, new = before[name][metric], now[metric]
+            change = (new - old) / old if old else (math.inf if new > old else 0.0)
+            worse = -change if higher_is_better else change
+            regressed = worse > threshold and abs(new - old) > COMPARE_ABSOLUTE_FLOOR
+            mark = "❌" if regressed else ("✅" if -worse > threshold else "  ")
+            print(f"  {mark} {metric:<20} {old:>10.3f} -> {new:>10.3f}  ({change:+.1%})")
+            if regressed:
+                regressions.append(f"{name}: {metric} {old:.3f} -> {new:.3f} ({change:+.1%})")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  - {regression}")
+    else:
+        print("\n✅ No regressions")
+    return regressions
+
+
+def load_scenarios(path: Optional[str], only: List[str], stream: Optional[bool],
+                   slo: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Scenarios from a JSON file (a list, or {"scenarios": [...]}) merged over SCENARIO_DEFAULTS"""
+    if path:
+        with open(path) as f:
+            data = json.load(f)
+        scenarios = data["scenarios"] if isinstance(data, dict) else data
+    else:
+        scenarios = DEFAULT_SCENARIOS
+    selected = []
+    for raw in scenarios:
+        scenario = dict(SCENARIO_DEFAULTS, **raw)
+        if only and scenario["name"] not in only:
+            continue
+        if scenario["mode"] not in ("closed", "open"):
+            raise ValueError(f"{scenario['name']}: mode must be 'closed' or 'open'")
+        if stream is not None:
+            scenario["stream"] = stream
+        scenario["slo"] = dict(scenario["slo"], **slo)
+        selected.append(scenario)
+    if only and len(selected) < len(only):
+        missing = set(only) - {s["name"] for s in selected}
+        raise ValueError(f"Unknown scenario(s): {', '.join(sorted(missing))}")
+    return selected
+
+
+def parse_slo(values: List[str]) -> Dict[str, float]:
+    slo = {}
+    for value in values:
+        name, _, limit = value.partition("=")
+        slo[name.strip()] = float(limit)
+    return slo
 
-    # Test 4: Medium prompts - Medium concurrency
-    print("\n" + "="*60)
-    print("TEST 4: MEDIUM PROMPTS - MEDIUM LOAD")
-    print("="*60)
-    result = await run_concurrent_test(20, 10, PROMPTS["medium"], "Medium Prompts - 10 Concurrent")
-    all_results.append(print_results(result))
 
-    # Test 5: Large prompts - Low concurrency
-    print("\n" + "="*60)
-    print("TEST 5: LARGE PROMPTS - LOW LOAD")
-    print("="*60)
-    result = await run_concurrent_test(5, 3, PROMPTS["large"], "Large Prompts - 3 Concurrent")
-    all_results.append(print_results(result))
+async def main():
+    """Run complete benchmark suite"""
+    global API_KEY, MODEL
+    parser = argparse.ArgumentParser(description="Ollama stress test & benchmark suite")
+    parser.add_argument("--url", default=BASE_URL, help="chat completions endpoint")
+    parser.add_argument("--api-key", default=API_KEY)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--scenarios", help="JSON scenario file (default: the six built-in tests)")
+    parser.add_argument("--only", action="append", default=[], help="run only this scenario (repeatable)")
+    stream = parser.add_mutually_exclusive_group()
+    stream.add_argument("--stream", dest="stream", action="store_true", default=None, help="force streaming")
+    stream.add_argument("--no-stream", dest="stream", action="store_false", help="force non-streaming")
+    parser.add_argument("--slo", action="append", default=[], metavar="METRIC=LIMIT",
+                        help="add an SLO to every scenario, e.g. ttft_p99=2.0 or error_rate=0.01")
+    parser.add_argument("--find-rate", action="store_true",
+                        help="search for the highest open-loop rate that meets each scenario's SLO")
+    parser.add_argument("--min-rate", type=float, default=0.25, help="first rate tried by --find-rate")
+    parser.add_argument("--max-rate", type=float, default=64.0, help="highest rate tried by --find-rate")
+    parser.add_argument("--search-steps", type=int, default=4, help="bisection runs after the doubling phase")
+    parser.add_argument("--seed", type=int, help="random seed for open-loop arrival times")
+    parser.add_argument("--output", help="results file (default: benchmark_results_<timestamp>.json)")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="diff against an earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative change counted as a regression by --compare (default 0.10)")
+    args = parser.parse_args()
+
+    API_KEY, MODEL = args.api_key, args.model
+    scenarios = load_scenarios(args.scenarios, args.only, args.stream, parse_slo(args.slo))
+    if args.find_rate:
+        missing = [s["name"] for s in scenarios if not s["slo"]]
+        if missing:
+            parser.error(f"--find-rate needs an SLO (scenario file or --slo) for: {', '.join(missing)}")
+    rng = random.Random(args.seed)
 
-    # Test 6: Stress test - High concurrency
     print("\n" + "="*60)
-    print("TEST 6: STRESS TEST - HIGH LOAD")
+    print("🚀 OLLAMA STRESS TEST & BENCHMARK SUITE")
     print("="*60)
-    result = await run_concurrent_test(30, 20, PROMPTS["medium"], "Stress Test - 20 Concurrent")
-    all_results.append(print_results(result))
+    print(f"\nModel: {MODEL}")
+    print(f"Endpoint: {args.url}")
+    print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    all_results = []
+    for scenario in scenarios:
+        if args.find_rate:
+            all_results.append(await find_rate(args.url, scenario, args.min_rate, args.max_rate, args.search_steps, rng))
+        else:
+            all_results.append(print_results(await run_scenario(args.url, scenario, rng)))
 
     # Summary
     print("\n" + "="*60)
     print("📋 BENCHMARK SUMMARY")
     print("="*60)
-    print("\nAll tests completed successfully!")
-    print(f"\nResults saved to benchmark_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    for stats in all_results:
+        if "max_rate" in stats:
+            rate = "none" if stats["max_rate"] is None else f"{stats['max_rate']:.2f} req/s"
+            print(f"  {stats['test_name']:<40} max rate within SLO: {rate}")
+            continue
+        slo = "" if not stats["slo"] else ("  SLO ✅" if all(c["pass"] for c in stats["slo"].values()) else "  SLO ❌")
+        p99 = stats["latency"].get("p99")
+        print(f"  {stats['test_name']:<40} {stats['requests_per_second']:7.2f} req/s  p99 {format_seconds(p99):>8}"
+              f"  errors {stats['error_rate']:.1%}{slo}")
 
     # Save detailed results to file
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    with open(f"benchmark_results_{timestamp}.json", "w") as f:
-        json.dump(all_results, f, indent=2)
-
-    return all_results
+    output = args.output or f"benchmark_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump({
+            "version": 2,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "endpoint": args.url,
+            "model": MODEL,
+            "results": all_results
+        }, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare_results(previous, all_results, args.threshold):
+            return 1
+    return 0
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        sys.exit(asyncio.run(main()))
     except KeyboardInterrupt:
         print("\n\n⚠️  Benchmark interrupted by user")
         sys.exit(1)
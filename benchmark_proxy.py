@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Proxy Overhead Benchmark
+Measures what the logger itself adds on top of Ollama. Runs fake_ollama.py
+in place of a model, so it needs no GPU, and sends every workload both
+straight to the fake server and through the logger. The difference is the
+gateway's own cost:
+
+- per request: non-streaming chat, embeddings, and time to first token of
+  streamed chat
+- per chunk: extra time per streamed chunk, from unpaced streams
+- max streams: the most concurrent paced streams the logger carries while
+  its added inter-token delay stays within budget
+
+Log rows go to an in-memory sink by default (LOG_SINK=memory). With
+--log-sink postgres they go to PostgreSQL, e.g. from
+`docker compose up -d postgres`.
+
+    python benchmark_proxy.py
+    python benchmark_proxy.py --output proxy_baseline.json
+    python benchmark_proxy.py --baseline proxy_baseline.json      # exits 1 on regression
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmark import PERCENTILES, Histogram, chunk_content, format_seconds
+from benchmark_workers import ROOT_DIR, process_tree_cpu, start_logger, wait_healthy
+
+MODEL = "llama3.1:8b"
+EMBED_MODEL = "nomic-embed-text"
+PROMPT = "Explain the concept of machine learning in 3-4 sentences."
+
+# Gate metrics: (higher is better, change below this absolute amount never counts)
+GATE_METRICS = {
+    "chat_overhead_p50_ms": (False, 0.5),
+    "chat_overhead_p99_ms": (False, 2.0),
+    "stream_ttft_overhead_p50_ms": (False, 0.5),
+    "stream_per_chunk_overhead_us": (False, 20.0),
+    "embeddings_overhead_p50_ms": (False, 0.5),
+    "max_streams": (True, 0),
+}
+
+
+def chat_body(stream: bool, tokens: int) -> dict:
+    return {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": PROMPT}],
+        "stream": stream,
+        "options": {"num_predict": tokens},
+    }
+
+
+async def timed_request(client: httpx.AsyncClient, url: str, body: dict, stream: bool,
+                        headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """One request: total latency, time to first content chunk and gaps between chunks"""
+    result = {"latency": None, "ttft": None, "gaps": [], "chunks": 0, "error": None}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", url, json=body, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            if not stream:
+                await response.aread()
+            else:
+                last = None
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    content, _ = chunk_content(json.loads(line))
+                    if not content:
+                        continue
+                    now = time.perf_counter()
+                    if last is None:
+                        result["ttft"] = now - started
+                    else:
+                        result["gaps"].append(now - last)
+                    last = now
+                    result["chunks"] += 1
+    except httpx.HTTPError as e:
+        result["error"] = type(e).__name__
+        return result
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+def milliseconds(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def percentile_overhead(direct: Histogram, proxied: Histogram) -> Dict[str, float]:
+    """Difference of matching percentiles, in milliseconds"""
+    return {
+        name: milliseconds(proxied.percentile(fraction) - direct.percentile(fraction))
+        for name, fraction in PERCENTILES
+        if direct.count and proxied.count
+    }
+
+
+async def measure_overhead(fake: str, proxy: str, requests: int, warmup: int,
+                           stream_tokens: int) -> Dict[str, Any]:
+    """Same requests, one at a time, alternately straight to the fake server and through the logger"""
+    workloads = {
+        "chat": ("/api/chat", "/api/chat", chat_body(False, 32), False),
+        "chat_stream": ("/api/chat", "/api/chat", chat_body(True, stream_tokens), True),
+        "embeddings": ("/api/embed", "/api/embeddings", {"model": EMBED_MODEL, "input": PROMPT}, False),
+    }
+    report = {}
+    async with httpx.AsyncClient(timeout=60) as client:
+        for name, (direct_path, proxy_path, body, stream) in workloads.items():
+            histograms = {side: {"latency": Histogram(), "ttft": Histogram(), "streaming": Histogram()}
+                          for side in ("direct", "proxied")}
+            chunks = []
+            errors = 0
+            for i in range(warmup + requests):
+                for side, url in (("direct", fake + direct_path), ("proxied", proxy + proxy_path)):
+                    result = await timed_request(client, url, body, stream)
+                    if i < warmup:
+                        continue
+                    if result["error"]:
+                        errors += 1
+                        continue
+                    histograms[side]["latency"].record(result["latency"])
+                    if result["ttft"] is not None:
+                        histograms[side]["ttft"].record(result["ttft"])
+                        # Time spent streaming after the first chunk
+                        histograms[side]["streaming"].record(result["latency"] - result["ttft"])
+                        chunks.append(result["chunks"])
+
+            direct, proxied = histograms["direct"], histograms["proxied"]
+            entry = {
+                "requests": requests,
+                "errors": errors,
+                "direct_latency": direct["latency"].summary(),
+                "proxied_latency": proxied["latency"].summary(),
+                "overhead_ms": percentile_overhead(direct["latency"], proxied["latency"]),
+            }
+            if stream and chunks:
+                per_stream = min(chunks)
+                entry["chunks_per_stream"] = per_stream
+                entry["ttft_overhead_ms"] = percentile_overhead(direct["ttft"], proxied["ttft"])
+                extra = proxied["streaming"].percentile(0.5) - direct["streaming"].percentile(0.5)
+                entry["per_chunk_overhead_us"] = round(extra / max(1, per_stream - 1) * 1_000_000, 2)
+            for histogram in ("direct_latency", "proxied_latency"):
+                entry[histogram].pop("buckets_us", None)
+            report[name] = entry
+    return report
+
+
+async def stream_load(url: str, concurrency: int, duration: float, tokens_per_second: float,
+                      tokens: int) -> Dict[str, list]:
+    """Keep `concurrency` paced streams open for `duration` seconds"""
+    ttfts: List[float] = []
+    gaps: List[float] = []
+    errors: List[str] = []
+    body = chat_body(True, tokens)
+    headers = {"X-Fake-Tokens-Per-Second": str(tokens_per_second), "X-Fake-Chunk-Tokens": "1"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def user(offset: float):
+            # Staggered starts, so chunks don't arrive in lockstep
+            await asyncio.sleep(offset)
+            while time.perf_counter() < deadline:
+                result = await timed_request(client, url, body, True, headers)
+                if result["error"]:
+                    errors.append(result["error"])
+                    continue
+                ttfts.append(result["ttft"])
+                gaps.extend(result["gaps"])
+
+        spread = tokens / tokens_per_second if tokens_per_second > 0 else 0
+        await asyncio.gather(*(user(spread * i / concurrency) for i in range(concurrency)))
+    return {"ttfts": ttfts, "gaps": gaps, "errors": errors}
+
+
+def stream_load_process(args: tuple) -> Dict[str, list]:
+    return asyncio.run(stream_load(*args))
+
+
+def run_streams(url: str, concurrency: int, args) -> Dict[str, Any]:
+    """Paced streams from several client processes; inter-token and TTFT histograms"""
+    clients = max(1, min(args.clients, concurrency))
+    shares = [concurrency // clients + (1 if i < concurrency % clients else 0) for i in range(clients)]
+    jobs = [(url, share, args.probe_seconds, args.stream_tps, args.stream_tokens) for share in shares]
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(stream_load_process, jobs)
+    ttft, itl = Histogram(), Histogram()
+    errors = []
+    for result in results:
+        for value in result["ttfts"]:
+            ttft.record(value)
+        for value in result["gaps"]:
+            itl.record(value)
+        errors.extend(result["errors"])
+    return {"ttft": ttft, "itl": itl, "errors": errors}
+
+
+def find_max_streams(fake: str, proxy: str, logger_pid: int, args) -> Dict[str, Any]:
+    """Double the number of paced streams until the logger's added delay exceeds its budget, then bisect
+
+    Each probe runs the same load straight against the fake server too. If
+    the direct run already misses the token pace, the load generator or the
+    fake server is the limit, and the search stops there instead of blaming
+    the proxy.
+    """
+    gap = 1 / args.stream_tps
+    probes = []
+
+    def probe(concurrency: int) -> Tuple[bool, bool]:
+        direct = run_streams(fake + "/api/chat", concurrency, args)
+        cpu_before = process_tree_cpu(logger_pid)
+        started = time.perf_counter()
+        proxied = run_streams(proxy + "/api/chat", concurrency, args)
+        cores = (process_tree_cpu(logger_pid) - cpu_before) / (time.perf_counter() - started)
+
+        direct_itl, proxied_itl = direct["itl"].percentile(0.99), proxied["itl"].percentile(0.99)
+        direct_ok = not direct["errors"] and direct_itl is not None and direct_itl <= gap + args.itl_budget_ms / 1000
+        added = None if direct_itl is None or proxied_itl is None else proxied_itl - direct_itl
+        passed = (direct_ok and not proxied["errors"] and added is not None
+                  and added <= args.itl_budget_ms / 1000)
+        probes.append({
+            "streams": concurrency,
+            "pass": passed,
+            "generator_limited": not direct_ok,
+            "direct_itl_p99_ms": milliseconds(direct_itl),
+            "proxied_itl_p99_ms": milliseconds(proxied_itl),
+            "added_itl_p99_ms": milliseconds(added),
+            "proxied_ttft_p99_ms": milliseconds(proxied["ttft"].percentile(0.99)),
+            "errors": len(proxied["errors"]),
+            "logger_cpu_cores": round(cores, 2),
+        })
+        status = "✅ pass" if passed else ("⚠️  generator limit" if not direct_ok else "❌ fail")
+        print(f"  {concurrency:6d} streams  {status}  ITL p99 direct {format_seconds(direct_itl)}, "
+              f"proxied {format_seconds(proxied_itl)}, errors {len(proxied['errors'])}, logger CPU {cores:.2f} cores")
+        return passed, direct_ok
+
+    print(f"\nMax sustainable streams: {args.stream_tps:g} tokens/s per stream, "
+          f"added ITL p99 budget {args.itl_budget_ms:g}ms, {args.probe_seconds:g}s per probe")
+    best, worst, limited = 0, None, False
+    streams = args.min_streams
+    while streams <= args.max_streams:
+        passed, direct_ok = probe(streams)
+        if passed:
+            best = streams
+            streams *= 2
+        else:
+            worst, limited = streams, not direct_ok
+            break
+    if worst is not None and not limited and best:
+        for _ in range(args.search_steps):
+            middle = (best + worst) // 2
+            if middle in (best, worst):
+                break
+            passed, direct_ok = probe(middle)
+            if passed:
+                best = middle
+            elif not direct_ok:
+                limited = True
+                break
+            else:
+                worst = middle
+    return {"max_streams": best, "first_failing": worst, "generator_limited": limited, "probes": probes}
+
+
+def gate_metrics(report: Dict[str, Any]) -> Dict[str, float]:
+    overhead = report.get("overhead", {})
+    metrics = {
+        "chat_overhead_p50_ms": overhead.get("chat", {}).get("overhead_ms", {}).get("p50"),
+        "chat_overhead_p99_ms": overhead.get("chat", {}).get("overhead_ms", {}).get("p99"),
+        "stream_ttft_overhead_p50_ms": overhead.get("chat_stream", {}).get("ttft_overhead_ms", {}).get("p50"),
+        "stream_per_chunk_overhead_us": overhead.get("chat_stream", {}).get("per_chunk_overhead_us"),
+        "embeddings_overhead_p50_ms": overhead.get("embeddings", {}).get("overhead_ms", {}).get("p50"),
+        "max_streams": report.get("streams", {}).get("max_streams"),
+    }
+    return {name: value for name, value in metrics.items() if value is not None}
+
+
+def check_gate(baseline: Dict[str, float], current: Dict[str, float], threshold: float) -> List[str]:
+    """Print the gate metrics next to the baseline and return the regressions"""
+    regressions = []
+    print(f"\n🔍 Against baseline (threshold {threshold:.0%}):")
+    for name, (higher_is_better, floor) in GATE_METRICS.items():
+        if name not in baseline or name not in current:
+            continue
+        old, new = baseline[name], current[name]
+        delta = new - old
+        worse = -delta if higher_is_better else delta
+        regressed = worse > abs(old) * threshold and worse > floor
+        print(f"  {'❌' if regressed else '  '} {name:<30} {old:>10.2f} -> {new:>10.2f}")
+        if regressed:
+            regressions.append(f"{name}: {old:.2f} -> {new:.2f}")
+    print(f"\n{'❌ ' + str(len(regressions)) + ' regression(s)' if regressions else '✅ No regressions'}")
+    return regressions
+
+
+def print_overhead(overhead: Dict[str, Any]):
+    print(f"\n{'workload':<14} {'direct p50':>11} {'proxied p50':>12} {'added p50':>10} {'added p99':>10} {'errors':>7}")
+    for name, entry in overhead.items():
+        direct, proxied = entry["direct_latency"], entry["proxied_latency"]
+        print(f"{name:<14} {format_seconds(direct.get('p50')):>11} {format_seconds(proxied.get('p50')):>12} "
+              f"{entry['overhead_ms'].get('p50', 0):>8.2f}ms {entry['overhead_ms'].get('p99', 0):>8.2f}ms "
+              f"{entry['errors']:>7}")
+    stream = overhead.get("chat_stream", {})
+    if "per_chunk_overhead_us" in stream:
+        print(f"\nStreaming: first token {stream['ttft_overhead_ms'].get('p50', 0):+.2f}ms (p50), "
+              f"{stream['per_chunk_overhead_us']:+.1f}µs per chunk over {stream['chunks_per_stream']} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logger overhead against a fake Ollama")
+    parser.add_argument("--requests", type=int, default=200, help="requests per workload for the overhead runs")
+    parser.add_argument("--warmup", type=int, default=20, help="requests per workload before measuring")
+    parser.add_argument("--stream-tokens", type=int, default=128, help="chunks per stream in the overhead runs")
+    parser.add_argument("--stream-tps", type=float, default=20, help="tokens/s of each paced stream (max streams)")
+    parser.add_argument("--probe-seconds", type=float, default=8, help="seconds per max-streams probe")
+    parser.add_argument("--itl-budget-ms", type=float, default=25, help="inter-token delay the logger may add at p99")
+    parser.add_argument("--min-streams", type=int, default=8)
+    parser.add_argument("--max-streams", type=int, default=1024)
+    parser.add_argument("--search-steps", type=int, default=3)
+    parser.add_argument("--skip-streams", action="store_true", help="only measure per-request and per-chunk overhead")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="load generator processes")
+    parser.add_argument("--workers", type=int, default=1, help="logger worker processes")
+    parser.add_argument("--log-sink", choices=("memory", "postgres"), default="memory", help="where log rows go")
+    parser.add_argument("--port", type=int, default=8100, help="port for the logger under test")
+    parser.add_argument("--fake-port", type=int, default=11500, help="port for the fake Ollama")
+    parser.add_argument("--fake-workers", type=int, default=1,
+                        help="worker processes for the fake Ollama (raise on many-core machines if the stream search is generator-limited)")
+    parser.add_argument("--output", help="results file (default: benchmark_proxy_<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to gate against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    fake = f"http://127.0.0.1:{args.fake_port}"
+    proxy = f"http://127.0.0.1:{args.port}"
+    # Enough upstream connections that the pool never limits the stream search
+    os.environ.setdefault("UPSTREAM_MAX_CONNECTIONS", str(max(args.max_streams, 32)))
+    os.environ.setdefault("UPSTREAM_MAX_KEEPALIVE", str(max(args.max_streams, 16)))
+
+    print("\n" + "="*60)
+    print("🔬 LOGGER PROXY OVERHEAD BENCHMARK")
+    print("="*60)
+    print(f"Logger workers: {args.workers} | Log sink: {args.log_sink} | CPUs: {os.cpu_count()}")
+
+    fake_server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_ollama:app", "--host", "127.0.0.1", "--port", str(args.fake_port),
+         "--workers", str(args.fake_workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT_DIR,
+        env=dict(os.environ, FAKE_MODELS=f"{MODEL},{EMBED_MODEL}", FAKE_TOKENS_PER_SECOND="0")
+    )
+    report: Dict[str, Any] = {
+        "version": 1,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "baseline")},
+    }
+    try:
+        with tempfile.TemporaryDirectory() as shared_dir:
+            wait_healthy(f"{fake}/api/tags")
+            logger = start_logger(args.workers, args.port, fake, shared_dir, args.log_sink)
+            try:
+                wait_healthy(f"{proxy}/health")
+                time.sleep(1)
+                report["overhead"] = asyncio.run(
+                    measure_overhead(fake, proxy, args.requests, args.warmup, args.stream_tokens)
+                )
+                print_overhead(report["overhead"])
+                if not args.skip_streams:
+                    report["streams"] = find_max_streams(fake, proxy, logger.pid, args)
+                    streams = report["streams"]
+                    note = " (load generator or fake server limit reached first)" if streams["generator_limited"] else ""
+                    print(f"\nMax sustainable streams: {streams['max_streams']}{note}")
+            finally:
+                logger.terminate()
+                logger.wait(timeout=30)
+    finally:
+        fake_server.terminate()
+        fake_server.wait(timeout=30)
+
+    report["gate"] = gate_metrics(report)
+    output = args.output or f"benchmark_proxy_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if check_gate(baseline.get("gate") or gate_metrics(baseline), report["gate"], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
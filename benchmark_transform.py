@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Streaming Transform Micro-Benchmark
+Measures the per-chunk CPU cost of turning Ollama stream chunks into
+OpenAI chunk lines, comparing the original per-chunk dict + json.dumps
+approach with the per-stream OpenAIStreamTransformer in logger/streaming.py
+"""
+
+import json
+import os
+import sys
+import time
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "logger"))
+
+import streaming  # noqa: E402
+from streaming import OpenAIStreamTransformer  # noqa: E402
+
+MODEL = "llama3.1:8b"
+CHUNKS = 20000
+REPEATS = 5
+
+# Typical token deltas, including non-ASCII and characters that need escaping
+TOKENS = [" the", " model", ",", " \"quoted\"", " café", "\n", " 日本", " 🙂", " end", "."]
+
+
+def legacy_transform_line(ollama_chunk: dict, model: str) -> bytes:
+    """Original implementation: new id, timestamp and dict for every chunk"""
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+
+    content = ""
+    finish_reason = None
+
+    if "message" in ollama_chunk:
+        content = ollama_chunk["message"].get("content", "")
+    elif "response" in ollama_chunk:
+        content = ollama_chunk.get("response", "")
+
+    if ollama_chunk.get("done", False):
+        finish_reason = "stop"
+
+    openai_chunk = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"content": content} if content else {},
+                "finish_reason": finish_reason
+            }
+        ]
+    }
+    return (json.dumps(openai_chunk) + "\n").encode("utf-8")
+
+
+def make_chunks(count: int) -> list:
+    """Build a list of Ollama chat stream chunks"""
+    chunks = [
+        {"model": MODEL, "message": {"role": "assistant", "content": TOKENS[i % len(TOKENS)]}, "done": False}
+        for i in range(count - 1)
+    ]
+    chunks.append({"model": MODEL, "message": {"role": "assistant", "content": ""}, "done": True})
+    return chunks
+
+
+def bench(label: str, fn, chunks: list) -> float:
+    """Return the best per-chunk time in microseconds over REPEATS runs"""
+    best = min(timeit.repeat(lambda: fn(chunks), number=1, repeat=REPEATS))
+    per_chunk_us = best / len(chunks) * 1e6
+    print(f"  {label:<40} {per_chunk_us:8.3f} µs/chunk")
+    return per_chunk_us
+
+
+def run_legacy(chunks: list):
+    for chunk in chunks:
+        legacy_transform_line(chunk, MODEL)
+
+
+def run_transformer(chunks: list):
+    transformer = OpenAIStreamTransformer(MODEL)
+    for chunk in chunks:
+        transformer.transform(chunk)
+
+
+def main():
+    chunks = make_chunks(CHUNKS)
+
+    # Both implementations must describe the same chunks
+    transformer = OpenAIStreamTransformer(MODEL)
+    for chunk in chunks[-3:]:
+        old = json.loads(legacy_transform_line(chunk, MODEL))
+        new = json.loads(transformer.transform(chunk))
+        assert old["choices"] == new["choices"] and old["model"] == new["model"]
+
+    print(f"\nPer-chunk transform cost ({CHUNKS} chunks, best of {REPEATS})")
+    legacy = bench("legacy dict + json.dumps", run_legacy, chunks)
+
+    results = {"legacy": legacy}
+    if streaming.orjson is not None:
+        results["transformer_orjson"] = bench("OpenAIStreamTransformer (orjson)", run_transformer, chunks)
+        saved, streaming.orjson = streaming.orjson, None
+        try:
+            results["transformer_json"] = bench("OpenAIStreamTransformer (json)", run_transformer, chunks)
+        finally:
+            streaming.orjson = saved
+    else:
+        results["transformer_json"] = bench("OpenAIStreamTransformer (json)", run_transformer, chunks)
+
+    for label, value in results.items():
+        if label != "legacy":
+            print(f"  {label}: {legacy / value:.1f}x faster than legacy")
+
+
+if __name__ == "__main__":
+    main()
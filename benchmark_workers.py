@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Logger Worker Scaling Benchmark
+Runs the logger with 1, 2, 4... uvicorn workers in front of fake_ollama.py
+answering instantly, so the proxy's own CPU work (JSON parsing, format
+translation, streaming, logging) is the bottleneck, and reports throughput,
+latency and logger CPU for each worker count.
+
+Log rows are kept in memory by default (LOG_SINK=memory). With
+--log-sink postgres they are written to PostgreSQL, e.g. from
+`docker compose up -d postgres` (DB_HOST/DB_PORT default to the compose port
+on localhost).
+
+    python benchmark_workers.py --workers 1,2,4 --duration 15 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+MODEL = "llama3.1:8b"
+STUB_TOKENS = 20
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGGER_DIR = os.path.join(ROOT_DIR, "logger")
+
+
+def process_tree_cpu(root: int) -> float:
+    """CPU seconds used so far by a process and all its descendants (Linux /proc only)
+
+    uvicorn's workers are children of a multiprocessing spawner, so the whole
+    tree is walked rather than just the root's direct children. Descendants
+    that have already exited and been waited for are included through their
+    parent's cutime/cstime.
+    """
+    ticks = os.sysconf("SC_CLK_TCK")
+    children: Dict[int, List[int]] = {}
+    cpu: Dict[int, float] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # fields[1] is ppid; fields[11]-[14] are utime, stime, cutime and cstime
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        cpu[pid] = sum(int(value) for value in fields[11:15]) / ticks
+
+    total = 0.0
+    pending = [root]
+    while pending:
+        pid = pending.pop()
+        total += cpu.get(pid, 0.0)
+        pending.extend(children.get(pid, ()))
+    return total
+
+
+async def load(url: str, stream: bool, concurrency: int, duration: float) -> Dict[str, list]:
+    """Keep `concurrency` requests in flight for `duration` seconds"""
+    latencies: List[float] = []
+    errors: List[str] = []
+    body = {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": "What is 2+2? Reply with just the number."}],
+        "stream": stream,
+    }
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    async with client.stream("POST", url, json=body) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                    if response.status_code != 200:
+                        errors.append(f"HTTP {response.status_code}")
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError as e:
+                    errors.append(type(e).__name__)
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def load_process(args: tuple) -> Dict[str, list]:
+    return asyncio.run(load(*args))
+
+
+def wait_healthy(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not become healthy within {timeout:.0f}s")
+
+
+def start_logger(workers: int, port: int, stub_url: str, shared_dir: str, log_sink: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("DB_HOST", "localhost")
+    env.setdefault("DB_PORT", "5433")
+    env.update({
+        "WEB_CONCURRENCY": str(workers),
+        "LOG_SINK": log_sink,
+        "LOGGER_SHARED_DIR": shared_dir,
+        "OLLAMA_URL": stub_url,
+        "OLLAMA_URLS": stub_url,
+        # Every request does the full proxy work: no cache hits, no coalescing, no queueing
+        "RESPONSE_CACHE_ENABLED": "false",
+        "EMBED_CACHE_MAX_MB": "0",
+        "COALESCE_MODE": "off",
+        "UPSTREAM_CONCURRENCY": "0",
+        "WARMUP_MODELS": "",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=LOGGER_DIR, env=env
+    )
+
+
+def run(workers: int, args, stub_url: str) -> Optional[dict]:
+    base = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory() as shared_dir:
+        logger = start_logger(workers, args.port, stub_url, shared_dir, args.log_sink)
+        try:
+            wait_healthy(f"{base}/health")
+            # Give the remaining workers a moment to finish their own startup
+            time.sleep(1 + 0.25 * workers)
+            per_client = max(1, args.concurrency // args.clients)
+            jobs = [(f"{base}/api/chat", args.stream, per_client, args.duration)] * args.clients
+
+            cpu_before = process_tree_cpu(logger.pid)
+            started = time.perf_counter()
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(load_process, jobs)
+            elapsed = time.perf_counter() - started
+            cpu_used = process_tree_cpu(logger.pid) - cpu_before
+        finally:
+            logger.terminate()
+            logger.wait(timeout=30)
+
+    latencies = sorted(l for r in results for l in r["latencies"])
+    errors = [e for r in results for e in r["errors"]]
+    if not latencies:
+        print(f"  {workers} workers: no successful requests ({len(errors)} errors: {errors[:3]})")
+        return None
+    return {
+        "workers": workers,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "errors": len(errors),
+        "cpu_cores": cpu_used / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logger throughput vs. worker count")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to test")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load per worker count")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                        help="load generator processes")
+    parser.add_argument("--stream", action="store_true", help="streamed completions instead of single responses")
+    parser.add_argument("--port", type=int, default=8100, help="port for the logger under test")
+    parser.add_argument("--stub-port", type=int, default=11500, help="port for the fake Ollama")
+    parser.add_argument("--stub-workers", type=int, default=2, help="worker processes for the fake Ollama")
+    parser.add_argument("--log-sink", choices=("memory", "postgres"), default="memory", help="where log rows go")
+    args = parser.parse_args()
+    counts = [int(n) for n in args.workers.split(",")]
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_ollama:app", "--host", "127.0.0.1",
+         "--port", str(args.stub_port), "--workers", str(args.stub_workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT_DIR,
+        env=dict(os.environ, FAKE_MODELS=MODEL, FAKE_TOKENS_PER_SECOND="0", FAKE_RESPONSE_TOKENS=str(STUB_TOKENS))
+    )
+    print(f"Logger worker scaling: {args.concurrency} in flight, {args.duration:.0f}s each, "
+          f"{'streaming' if args.stream else 'non-streaming'}, log sink {args.log_sink}, {os.cpu_count()} CPUs")
+    results = []
+    try:
+        wait_healthy(f"{stub_url}/api/tags")
+        for workers in counts:
+            print(f"  running {workers} worker(s)...")
+            result = run(workers, args, stub_url)
+            if result:
+                results.append(result)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=30)
+
+    if not results:
+        return
+    baseline = results[0]["rps"] / results[0]["workers"]
+    print()
+    print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'CPU cores':>10} {'req/s/core':>11} {'scaling':>8}")
+    for r in results:
+        per_core = r["rps"] / r["cpu_cores"] if r["cpu_cores"] else 0
+        print(f"{r['workers']:>8} {r['rps']:>9.0f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7} "
+              f"{r['cpu_cores']:>10.2f} {per_core:>11.0f} {r['rps'] / baseline / r['workers']:>7.0%}")
+    print("\nscaling = throughput per worker relative to the first run; near 100% means CPU-bound proxy work scales with cores")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
-from fastapi import FastAPI, Query
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import asyncpg
+import hashlib
+import json
 import os
+import re
+import time
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
-from typing import Optional
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
 
 app = FastAPI()
 
@@ -26,6 +31,21 @@ DB_NAME = os.getenv("DB_NAME", "ollama_logs")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 
+# Result cache configuration
+CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "5"))  # Seconds a stats/logs payload is reused (0 disables)
+CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "256"))  # Distinct endpoint+params kept
+
+# Live feed configuration
+LIVE_CHANNEL = "request_logs"  # NOTIFY channel the logger signals after each flush
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", "5"))  # Tail check when no NOTIFY arrives (seconds)
+LIVE_MIN_INTERVAL = float(os.getenv("LIVE_MIN_INTERVAL", "0.5"))  # Minimum gap between pushes; bursts are merged
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))  # Keep-alive comment interval for idle streams
+LIVE_MAX_ROWS = 200  # New rows fetched per push
+LIVE_SETTLE_SECONDS = float(os.getenv("LIVE_SETTLE_SECONDS", "30"))  # How long ids skipped by the tail are rechecked for late commits
+
+# Search configuration
+SEARCH_MAX_BODIES = int(os.getenv("SEARCH_MAX_BODIES", "2000"))  # Best-ranked matching bodies mapped back to log rows
+
 # Timezone configuration
 PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
 
@@ -44,6 +64,368 @@ def format_timestamp(dt: datetime) -> str:
     pacific_dt = utc_to_pacific(dt)
     return pacific_dt.isoformat()
 
+# Successful requests since $5, read from the rollup tables plus raw rows.
+# Day rows cover [$3, now), hour rows [$2, $3) and minute rows [$1, $2), so
+# each query only touches a handful of pre-aggregated rows however large
+# request_logs grows. Raw rows fill in the partial bucket [$5, $1) before the
+# first whole bucket, and everything above the rollup watermark $4.
+ROLLUP_SOURCES = '''
+    SELECT bucket, requests, total_tokens, duration_seconds, power_wh, cost_dollars, errors
+    FROM request_rollup_day
+    WHERE http_status = 200 AND bucket >= $3
+    UNION ALL
+    SELECT bucket, requests, total_tokens, duration_seconds, power_wh, cost_dollars, errors
+    FROM request_rollup_hour
+    WHERE http_status = 200 AND bucket >= $2 AND bucket < $3
+    UNION ALL
+    SELECT bucket, requests, total_tokens, duration_seconds, power_wh, cost_dollars, errors
+    FROM request_rollup_minute
+    WHERE http_status = 200 AND bucket >= $1 AND bucket < $2
+    UNION ALL
+    SELECT timestamp, 1, COALESCE(total_tokens, 0), duration_seconds, power_wh, cost_dollars,
+           CASE WHEN error_message IS NOT NULL THEN 1 ELSE 0 END
+    FROM request_logs
+    WHERE http_status = 200 AND timestamp >= $5
+      AND (id > $4 OR timestamp < $1)
+'''
+
+# Columns of a /api/logs/recent row
+RECENT_LOGS_SELECT = '''
+    SELECT
+        id, timestamp, ip_address, api_key, model,
+        prompt_preview, response_preview,
+        prompt_tokens, completion_tokens, total_tokens,
+        duration_seconds, power_wh, cost_dollars,
+        http_status, error_message
+    FROM request_logs
+'''
+
+# Upper bound that leaves the day tier empty, for per-hour queries
+NO_DAY_ROLLUPS = datetime(9999, 1, 1)
+
+# Ranges starting further back than this skip the minute rollups (see rollup_bounds)
+MINUTE_ROLLUP_HORIZON = timedelta(days=7)
+
+# Start of time for totals over the whole table
+ALL_TIME = datetime(2000, 1, 1)
+
+async def rollup_watermark(conn) -> int:
+    """Last request_logs id folded into the rollups (0 before the first run)
+
+    Read it in the same REPEATABLE READ transaction as the rollups, so a
+    rollup run committing in between can't count rows twice.
+    """
+    return await conn.fetchval("SELECT last_id FROM rollup_state WHERE name = 'request_logs'") or 0
+
+def rollup_bounds(start: datetime) -> tuple[datetime, datetime, datetime]:
+    """(minute, hour, day) boundaries for ROLLUP_SOURCES
+
+    Each is the first whole bucket of its size at or after start: minutes
+    from the start's next minute, then whole hours and whole days as soon as
+    they begin. Starts older than MINUTE_ROLLUP_HORIZON go straight to the
+    next whole hour, since minute rollups are only kept for
+    ROLLUP_MINUTE_RETENTION_DAYS. The stretch between start and the first
+    bucket comes from raw rows, so totals are exact either way.
+    """
+    minute = start.replace(second=0, microsecond=0)
+    if minute < start:
+        minute += timedelta(minutes=1)
+    hour = minute.replace(minute=0)
+    if hour < minute:
+        hour += timedelta(hours=1)
+    if datetime.utcnow() - start > MINUTE_ROLLUP_HORIZON:
+        minute = hour
+    day = hour.replace(hour=0)
+    if day < hour:
+        day += timedelta(days=1)
+    return minute, hour, day
+
+class ResultCache:
+    """Short-TTL cache of serialized endpoint payloads with single-flight
+
+    Every open dashboard tab polls the same endpoints. A payload is computed
+    once per key and TTL, serialized once, and shared; concurrent misses for
+    the same key wait for one query instead of each running their own. The
+    query runs in its own task, so a tab closing mid-request doesn't cancel
+    it for the others.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, body, etag)
+        self._entries: Dict[str, Tuple[float, bytes, str]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[bytes, str]:
+        """(JSON body, ETag) for key, computing it at most once per TTL"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1], entry[2]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._load(key, compute))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[bytes, str]:
+        payload = await compute()
+        # Same settings as FastAPI's JSONResponse
+        body = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.ttl > 0:
+            now = time.monotonic()
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                while len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (now + self.ttl, body, etag)
+        return body, etag
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+result_cache = ResultCache(CACHE_TTL, CACHE_MAX_ENTRIES)
+
+async def cached_json(request: Request, key: str, compute: Callable[[], Awaitable[dict]]) -> Response:
+    """Serve compute()'s payload through result_cache, answering 304 if the client's copy is current"""
+    body, etag = await result_cache.get(key, compute)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    client_tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def format_log_row(row) -> dict:
+    """A RECENT_LOGS_SELECT row as returned by /api/logs/recent and /api/live"""
+    return {
+        "id": row["id"],
+        "timestamp": format_timestamp(row["timestamp"]),
+        "ip_address": row["ip_address"],
+        "api_key": row["api_key"][:20] + "..." if row["api_key"] else None,
+        "model": row["model"],
+        "prompt_preview": row["prompt_preview"],
+        "response_preview": row["response_preview"],
+        "prompt_tokens": row["prompt_tokens"],
+        "completion_tokens": row["completion_tokens"],
+        "total_tokens": row["total_tokens"],
+        "duration_seconds": round(float(row["duration_seconds"]), 2),
+        "power_wh": round(float(row["power_wh"]), 4),
+        "cost_dollars": round(float(row["cost_dollars"]), 6),
+        "http_status": row["http_status"],
+        "error": row["error_message"],
+        # Pages after this row start here (see /api/logs/recent)
+        "cursor": encode_cursor(row["timestamp"], row["id"])
+    }
+
+def encode_cursor(timestamp: datetime, log_id: int) -> str:
+    """Opaque keyset cursor for the log row (timestamp, id)"""
+    return f"{timestamp.isoformat()}_{log_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, log_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def search_query(q: str) -> Optional[str]:
+    """to_tsquery text matching every word of q as a prefix ("hel wor" finds "hello world")
+
+    Only the start of a word matches: unlike the ILIKE '%q%' search this
+    replaced, "ello" does not find "hello". Everything but letters and digits
+    separates words, so tsquery operators in q (& | ! : * ( ) ') are never
+    passed through. Returns None if q has no words.
+    """
+    # PostgreSQL's parser splits words on underscores too
+    words = re.findall(r"[^\W_]+", q.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+def to_utc_naive(dt: Optional[datetime]) -> Optional[datetime]:
+    """Query parameter datetime as naive UTC, like the timestamp column"""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+class LiveFeed:
+    """Pushes new successful log rows to every /api/live client
+
+    One task per process tails request_logs by id and fans each batch out to
+    all subscribers, so the database work is O(new rows) however many
+    dashboards are open. The task wakes on the logger's NOTIFY after each
+    flush, and also every LIVE_POLL_INTERVAL seconds in case a notification
+    was missed. Each batch is serialized once. A client too slow to keep up
+    has its backlog replaced by a single resync event. The task and its
+    LISTEN connection only run while someone is subscribed.
+
+    Logger processes COPY concurrently, so a lower id can commit after a
+    higher one has been pushed. Ids the tail skips over are remembered as
+    gaps and looked up again on every pass for settle_seconds.
+    """
+
+    def __init__(self, poll_interval: float = 5.0, min_interval: float = 0.5,
+                 max_rows: int = 200, client_queue: int = 64, settle_seconds: float = 30.0,
+                 max_gaps: int = 10000):
+        self.poll_interval = poll_interval
+        self.min_interval = min_interval
+        self.max_rows = max_rows
+        self.client_queue = client_queue
+        self.settle_seconds = settle_seconds
+        self.max_gaps = max_gaps
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.last_id: Optional[int] = None
+        # Ids below last_id not seen yet -> when the tail first skipped them
+        self._gaps: Dict[int, float] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.pushes = 0
+        self.rows = 0
+        self.late_rows = 0
+        self.resyncs = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.client_queue)
+        self.subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self._task is not None:
+            # Nobody is watching: release the LISTEN connection; the next subscriber starts from the tip
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _notified(self, connection, pid, channel, payload):
+        self._wake.set()
+
+    async def _run(self):
+        self.last_id = None
+        self._gaps.clear()
+        listener = None
+        try:
+            try:
+                listener = await asyncpg.connect(
+                    host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD
+                )
+                await listener.add_listener(LIVE_CHANNEL, self._notified)
+            except Exception as e:
+                print(f"LISTEN {LIVE_CHANNEL} failed, polling every {self.poll_interval}s instead: {e}")
+            while True:
+                try:
+                    await self._publish()
+                except Exception as e:
+                    print(f"Live feed query failed: {e}")
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                # Let a burst of flushes land before querying once for all of them
+                await asyncio.sleep(self.min_interval)
+                self._wake.clear()
+        finally:
+            if listener is not None:
+                await listener.close()
+
+    async def _publish(self):
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            if self.last_id is None:
+                self.last_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM request_logs")
+                return
+            now = time.monotonic()
+            for row_id in [row_id for row_id, skipped in self._gaps.items() if now - skipped > self.settle_seconds]:
+                # Rolled back (a failed batch) or committed too late to show
+                del self._gaps[row_id]
+            # Every status, so error rows close their gaps; only successes are pushed
+            rows = await conn.fetch(f'''
+                {RECENT_LOGS_SELECT}
+                WHERE id > $1 OR id = ANY($2::INTEGER[])
+                ORDER BY id
+                LIMIT $3
+            ''', self.last_id, list(self._gaps), self.max_rows)
+        if not rows:
+            return
+        if len(rows) == self.max_rows:
+            self._wake.set()
+
+        for row in rows:
+            row_id = row["id"]
+            if self._gaps.pop(row_id, None) is not None:
+                self.late_rows += 1
+            elif row_id > self.last_id:
+                if row_id - self.last_id - 1 <= self.max_gaps - len(self._gaps):
+                    self._gaps.update(dict.fromkeys(range(self.last_id + 1, row_id), now))
+                self.last_id = row_id
+        rows = [row for row in rows if row["http_status"] == 200]
+        if not rows:
+            return
+
+        totals = {
+            "requests": len(rows),
+            "total_tokens": sum(row["total_tokens"] or 0 for row in rows),
+            "duration_seconds": sum(row["duration_seconds"] or 0 for row in rows),
+            "power_wh": sum(row["power_wh"] or 0 for row in rows),
+            "cost_dollars": sum(row["cost_dollars"] or 0 for row in rows),
+            "errors": sum(1 for row in rows if row["error_message"] is not None),
+        }
+        payload = {"logs": [format_log_row(row) for row in reversed(rows)], "totals": totals}
+        self._broadcast(b"event: logs\ndata: " + json.dumps(payload, separators=(",", ":")).encode() + b"\n\n")
+        self.pushes += 1
+        self.rows += len(rows)
+
+    def _broadcast(self, event: bytes):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Its backlog is useless now; tell it to reload instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(b"event: resync\ndata: {}\n\n")
+                self.resyncs += 1
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "last_id": self.last_id,
+            "pushes": self.pushes,
+            "rows": self.rows,
+            "late_rows": self.late_rows,
+            "pending_gaps": len(self._gaps),
+            "resyncs": self.resyncs,
+        }
+
+live_feed = LiveFeed(LIVE_POLL_INTERVAL, LIVE_MIN_INTERVAL, LIVE_MAX_ROWS, settle_seconds=LIVE_SETTLE_SECONDS)
+
 async def get_db_pool():
     """Get or create database connection pool"""
     global db_pool
@@ -69,6 +451,7 @@ async def startup():
 async def shutdown():
     """Close database connection on shutdown"""
     global db_pool
+    await live_feed.stop()
     if db_pool:
         await db_pool.close()
 
@@ -79,6 +462,7 @@ async def read_root():
 
 @app.get("/api/stats/overview")
 async def get_overview_stats(
+    request: Request,
     period: str = Query("today", regex="^(today|week|month|year|all)$")
 ):
     """Get overview statistics for a given period"""
@@ -101,119 +485,127 @@ async def get_overview_stats(
         start_date = now_utc - timedelta(days=365)
         start_date = start_date.replace(tzinfo=None)
     else:  # all
-        start_date = datetime(2000, 1, 1)
-
-    async with pool.acquire() as conn:
-        stats = await conn.fetchrow('''
-            SELECT
-                COUNT(*) as total_requests,
-                SUM(total_tokens) as total_tokens,
-                SUM(duration_seconds) as total_duration_seconds,
-                SUM(power_wh) as total_power_wh,
-                SUM(cost_dollars) as total_cost_dollars,
-                AVG(duration_seconds) as avg_duration_seconds,
-                AVG(total_tokens) as avg_tokens,
-                AVG(cost_dollars) as avg_cost_dollars,
-                COUNT(CASE WHEN error_message IS NOT NULL THEN 1 END) as total_errors
-            FROM request_logs
-            WHERE timestamp >= $1 AND http_status = 200
-        ''', start_date)
-
-        return {
-            "period": period,
-            "total_requests": stats["total_requests"] or 0,
-            "total_tokens": int(stats["total_tokens"] or 0),
-            "total_power_wh": round(float(stats["total_power_wh"] or 0), 4),
-            "total_power_kwh": round(float(stats["total_power_wh"] or 0) / 1000, 6),
-            "total_cost_dollars": round(float(stats["total_cost_dollars"] or 0), 6),
-            "avg_duration_seconds": round(float(stats["avg_duration_seconds"] or 0), 2),
-            "avg_tokens": round(float(stats["avg_tokens"] or 0), 0),
-            "avg_cost_dollars": round(float(stats["avg_cost_dollars"] or 0), 8),
-            "total_errors": stats["total_errors"] or 0
-        }
+        start_date = ALL_TIME
+
+    async def load():
+        async with pool.acquire() as conn, conn.transaction(isolation="repeatable_read", readonly=True):
+            stats = await conn.fetchrow(f'''
+                SELECT
+                    SUM(requests)::BIGINT as total_requests,
+                    SUM(total_tokens) as total_tokens,
+                    SUM(duration_seconds) as total_duration_seconds,
+                    SUM(power_wh) as total_power_wh,
+                    SUM(cost_dollars) as total_cost_dollars,
+                    SUM(duration_seconds) / NULLIF(SUM(requests), 0) as avg_duration_seconds,
+                    SUM(total_tokens) / NULLIF(SUM(requests), 0) as avg_tokens,
+                    SUM(cost_dollars) / NULLIF(SUM(requests), 0) as avg_cost_dollars,
+                    SUM(errors)::BIGINT as total_errors
+                FROM ({ROLLUP_SOURCES}) sources
+            ''', *rollup_bounds(start_date), await rollup_watermark(conn), start_date)
+
+            return {
+                "period": period,
+                "total_requests": stats["total_requests"] or 0,
+                "total_tokens": int(stats["total_tokens"] or 0),
+                "total_power_wh": round(float(stats["total_power_wh"] or 0), 4),
+                "total_power_kwh": round(float(stats["total_power_wh"] or 0) / 1000, 6),
+                "total_cost_dollars": round(float(stats["total_cost_dollars"] or 0), 6),
+                "avg_duration_seconds": round(float(stats["avg_duration_seconds"] or 0), 2),
+                "avg_tokens": round(float(stats["avg_tokens"] or 0), 0),
+                "avg_cost_dollars": round(float(stats["avg_cost_dollars"] or 0), 8),
+                "total_errors": stats["total_errors"] or 0
+            }
+
+    return await cached_json(request, f"overview:{period}", load)
 
 @app.get("/api/stats/hourly")
-async def get_hourly_stats(hours: int = 24):
+async def get_hourly_stats(request: Request, hours: int = 24):
     """Get hourly statistics for the last N hours"""
     pool = await get_db_pool()
 
     now_utc = datetime.now(timezone.utc)
     start_time = (now_utc - timedelta(hours=hours)).replace(tzinfo=None)
 
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT
-                DATE_TRUNC('hour', timestamp) as hour,
-                COUNT(*) as total_requests,
-                SUM(total_tokens) as total_tokens,
-                SUM(power_wh) as total_power_wh,
-                SUM(cost_dollars) as total_cost_dollars
-            FROM request_logs
-            WHERE timestamp >= $1 AND http_status = 200
-            GROUP BY DATE_TRUNC('hour', timestamp)
-            ORDER BY hour ASC
-        ''', start_time)
-
-        return {
-            "hours": [
-                {
-                    "hour": format_timestamp(row["hour"]),
-                    "requests": row["total_requests"],
-                    "tokens": int(row["total_tokens"] or 0),
-                    "power_wh": round(float(row["total_power_wh"] or 0), 4),
-                    "cost_dollars": round(float(row["total_cost_dollars"] or 0), 6)
-                }
-                for row in rows
-            ]
-        }
+    async def load():
+        async with pool.acquire() as conn, conn.transaction(isolation="repeatable_read", readonly=True):
+            minute, hour, _ = rollup_bounds(start_time)
+            rows = await conn.fetch(f'''
+                SELECT
+                    DATE_TRUNC('hour', bucket) as hour,
+                    SUM(requests)::BIGINT as total_requests,
+                    SUM(total_tokens) as total_tokens,
+                    SUM(power_wh) as total_power_wh,
+                    SUM(cost_dollars) as total_cost_dollars
+                FROM ({ROLLUP_SOURCES}) sources
+                GROUP BY DATE_TRUNC('hour', bucket)
+                ORDER BY hour ASC
+            ''', minute, hour, NO_DAY_ROLLUPS, await rollup_watermark(conn), start_time)
+
+            return {
+                "hours": [
+                    {
+                        "hour": format_timestamp(row["hour"]),
+                        "requests": row["total_requests"],
+                        "tokens": int(row["total_tokens"] or 0),
+                        "power_wh": round(float(row["total_power_wh"] or 0), 4),
+                        "cost_dollars": round(float(row["total_cost_dollars"] or 0), 6)
+                    }
+                    for row in rows
+                ]
+            }
+
+    return await cached_json(request, f"hourly:{hours}", load)
 
 @app.get("/api/logs/recent")
-async def get_recent_logs(limit: int = 50, offset: int = 0):
-    """Get recent request logs"""
-    pool = await get_db_pool()
-
-    async with pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT
-                id, timestamp, ip_address, api_key, model,
-                LEFT(prompt, 100) as prompt_preview,
-                LEFT(response, 100) as response_preview,
-                prompt_tokens, completion_tokens, total_tokens,
-                duration_seconds, power_wh, cost_dollars,
-                http_status, error_message
-            FROM request_logs
-            WHERE http_status = 200
-            ORDER BY timestamp DESC
-            LIMIT $1 OFFSET $2
-        ''', limit, offset)
-
-        total_count = await conn.fetchval('SELECT COUNT(*) FROM request_logs WHERE http_status = 200')
+async def get_recent_logs(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0)
+):
+    """Get recent request logs, newest first
 
-        return {
-            "total": total_count,
-            "limit": limit,
-            "offset": offset,
-            "logs": [
-                {
-                    "id": row["id"],
-                    "timestamp": format_timestamp(row["timestamp"]),
-                    "ip_address": row["ip_address"],
-                    "api_key": row["api_key"][:20] + "..." if row["api_key"] else None,
-                    "model": row["model"],
-                    "prompt_preview": row["prompt_preview"],
-                    "response_preview": row["response_preview"],
-                    "prompt_tokens": row["prompt_tokens"],
-                    "completion_tokens": row["completion_tokens"],
-                    "total_tokens": row["total_tokens"],
-                    "duration_seconds": round(float(row["duration_seconds"]), 2),
-                    "power_wh": round(float(row["power_wh"]), 4),
-                    "cost_dollars": round(float(row["cost_dollars"]), 6),
-                    "http_status": row["http_status"],
-                    "error": row["error_message"]
-                }
-                for row in rows
-            ]
-        }
+    Pass the previous page's next_cursor to get the following page; each page
+    is an index range scan on (timestamp, id), however deep it is. offset is
+    still accepted for old clients but costs O(offset).
+    """
+    pool = await get_db_pool()
+    after = decode_cursor(cursor) if cursor else None
+
+    async def load():
+        async with pool.acquire() as conn, conn.transaction(isolation="repeatable_read", readonly=True):
+            # One extra row tells whether there is a next page
+            if after:
+                rows = await conn.fetch(f'''
+                    {RECENT_LOGS_SELECT}
+                    WHERE http_status = 200 AND (timestamp, id) < ($2, $3)
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT $1
+                ''', limit + 1, *after)
+            else:
+                rows = await conn.fetch(f'''
+                    {RECENT_LOGS_SELECT}
+                    WHERE http_status = 200
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT $1 OFFSET $2
+                ''', limit + 1, offset)
+
+            # Maintained by the rollups, so no COUNT(*) over request_logs
+            total_count = await conn.fetchval(f'''
+                SELECT COALESCE(SUM(requests), 0)::BIGINT FROM ({ROLLUP_SOURCES}) sources
+            ''', *rollup_bounds(ALL_TIME), await rollup_watermark(conn), ALL_TIME)
+
+            page = rows[:limit]
+            return {
+                "total": total_count,
+                "limit": limit,
+                "offset": offset,
+                "cursor": cursor,
+                "next_cursor": encode_cursor(page[-1]["timestamp"], page[-1]["id"]) if len(rows) > limit else None,
+                "logs": [format_log_row(row) for row in page]
+            }
+
+    return await cached_json(request, f"recent:{limit}:{cursor or ''}:{offset}", load)
 
 @app.get("/api/logs/{log_id}")
 async def get_log_detail(log_id: int):
@@ -221,8 +613,13 @@ async def get_log_detail(log_id: int):
     pool = await get_db_pool()
 
     async with pool.acquire() as conn:
+        # The only endpoint that needs the full texts, so the only one that joins them
         row = await conn.fetchrow('''
-            SELECT * FROM request_logs WHERE id = $1
+            SELECT l.*, p.body as prompt, r.body as response
+            FROM request_logs l
+            LEFT JOIN request_bodies p ON p.hash = l.prompt_hash
+            LEFT JOIN request_bodies r ON r.hash = l.response_hash
+            WHERE l.id = $1
         ''', log_id)
 
         if not row:
@@ -248,22 +645,68 @@ async def get_log_detail(log_id: int):
         }
 
 @app.get("/api/search")
-async def search_logs(q: str, limit: int = 50):
-    """Search logs by prompt or response content"""
+async def search_logs(
+    q: str,
+    limit: int = Query(50, ge=1, le=500),
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Search logs by prompt or response content
+
+    Uses the GIN index on request_bodies.search_vector: every word of q must
+    appear (as a word prefix) in the prompt or in the response. The
+    SEARCH_MAX_BODIES best-ranked matching bodies are mapped back to their
+    log rows through the hash indexes, with the model, API key and time
+    filters applied in that join. Results are ranked by relevance, newest
+    first among equals. A very common word can match more bodies than the
+    cap; the best-ranked ones win.
+    """
+    query = search_query(q)
+    if query is None:
+        return {"query": q, "results": []}
+
     pool = await get_db_pool()
 
     async with pool.acquire() as conn:
         rows = await conn.fetch('''
+            WITH matches AS MATERIALIZED (
+                SELECT hash, ts_rank_cd(search_vector, query) as rank
+                FROM request_bodies, to_tsquery('simple', $1) query
+                WHERE search_vector @@ query
+                ORDER BY rank DESC
+                LIMIT $7
+            ), hits AS (
+                SELECT l.id, l.timestamp, m.rank
+                FROM matches m JOIN request_logs l ON l.prompt_hash = m.hash
+                WHERE ($3::TEXT IS NULL OR l.model = $3)
+                  AND ($4::TEXT IS NULL OR l.api_key = $4)
+                  AND ($5::TIMESTAMP IS NULL OR l.timestamp >= $5)
+                  AND ($6::TIMESTAMP IS NULL OR l.timestamp < $6)
+                UNION ALL
+                SELECT l.id, l.timestamp, m.rank
+                FROM matches m JOIN request_logs l ON l.response_hash = m.hash
+                WHERE ($3::TEXT IS NULL OR l.model = $3)
+                  AND ($4::TEXT IS NULL OR l.api_key = $4)
+                  AND ($5::TIMESTAMP IS NULL OR l.timestamp >= $5)
+                  AND ($6::TIMESTAMP IS NULL OR l.timestamp < $6)
+            ), ranked AS (
+                SELECT id, timestamp, MAX(rank) as rank
+                FROM hits
+                GROUP BY id, timestamp
+                ORDER BY rank DESC, timestamp DESC
+                LIMIT $2
+            )
             SELECT
-                id, timestamp, model,
-                LEFT(prompt, 100) as prompt_preview,
-                LEFT(response, 100) as response_preview,
-                total_tokens, cost_dollars
-            FROM request_logs
-            WHERE prompt ILIKE $1 OR response ILIKE $1
-            ORDER BY timestamp DESC
-            LIMIT $2
-        ''', f"%{q}%", limit)
+                l.id, l.timestamp, l.model,
+                l.prompt_preview, l.response_preview,
+                l.total_tokens, l.cost_dollars,
+                ranked.rank
+            FROM ranked
+            JOIN request_logs l ON l.id = ranked.id AND l.timestamp = ranked.timestamp
+            ORDER BY ranked.rank DESC, l.timestamp DESC
+        ''', query, limit, model, api_key, to_utc_naive(start), to_utc_naive(end), SEARCH_MAX_BODIES)
 
         return {
             "query": q,
@@ -275,13 +718,36 @@ async def search_logs(q: str, limit: int = 50):
                     "prompt_preview": row["prompt_preview"],
                     "response_preview": row["response_preview"],
                     "total_tokens": row["total_tokens"],
-                    "cost_dollars": round(float(row["cost_dollars"]), 6)
+                    "cost_dollars": round(float(row["cost_dollars"]), 6),
+                    "rank": round(float(row["rank"]), 4)
                 }
                 for row in rows
             ]
         }
 
+@app.get("/api/live")
+async def live(request: Request):
+    """Server-Sent Events: a `logs` event with new rows and counter deltas as they are logged"""
+    queue = live_feed.subscribe()
+
+    async def events():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            live_feed.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "ollama-dashboard"}
+    return {"status": "healthy", "service": "ollama-dashboard", "cache": result_cache.stats(), "live": live_feed.stats()}
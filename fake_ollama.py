@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Fake Ollama Server
+A stand-in for Ollama that generates filler text at a configurable speed,
+so the logger can be benchmarked and tested without a model or a GPU.
+
+Serves /api/chat, /api/generate (streamed NDJSON or single JSON),
+/api/embed, /api/embeddings, /api/tags, /api/ps and /api/version. Final
+chunks carry the usual eval_count / *_duration fields, consistent with the
+configured speed.
+
+    python fake_ollama.py --port 11434 --tokens-per-second 40 --chunk-tokens 1
+    uvicorn fake_ollama:app --port 11434 --workers 2     # configured through FAKE_* variables
+
+Per request, the X-Fake-Tokens-Per-Second, X-Fake-Chunk-Tokens and
+X-Fake-TTFT-Ms headers override the defaults (the logger forwards them), and
+options.num_predict sets the response length. FAKE_FAIL_STATUS and
+FAKE_DROP_AFTER_CHUNKS make a server that fails, for routing and retry tests.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import uvicorn
+
+# Configuration
+MODELS = [m.strip() for m in os.getenv("FAKE_MODELS", "llama3.1:8b,nomic-embed-text").split(",") if m.strip()]
+TOKENS_PER_SECOND = float(os.getenv("FAKE_TOKENS_PER_SECOND", "0"))  # Generation speed (0 = as fast as possible)
+CHUNK_TOKENS = int(os.getenv("FAKE_CHUNK_TOKENS", "1"))  # Tokens per streamed chunk
+RESPONSE_TOKENS = int(os.getenv("FAKE_RESPONSE_TOKENS", "128"))  # Tokens generated when num_predict is not set
+TTFT_MS = float(os.getenv("FAKE_TTFT_MS", "0"))  # Prompt processing time before the first token
+EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", "384"))  # Embedding vector length
+FAIL_STATUS = int(os.getenv("FAKE_FAIL_STATUS", "0"))  # Answer every generate/embed request with this status (0 = off)
+DROP_AFTER_CHUNKS = int(os.getenv("FAKE_DROP_AFTER_CHUNKS", "0"))  # Cut streams off after this many chunks (0 = off)
+
+# Filler text, one word per token
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit",
+         "sed", "do", "eiusmod", "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna")
+
+NS = 1_000_000_000
+
+
+def count_tokens(text: str) -> int:
+    """Rough prompt token count: about four characters per token"""
+    return max(1, len(text) // 4)
+
+
+def prompt_text(body: dict) -> str:
+    if "messages" in body:
+        return "\n".join(str(m.get("content") or "") for m in body["messages"] if isinstance(m, dict))
+    return str(body.get("prompt") or "")
+
+
+def fake_vector(text: str) -> List[float]:
+    """Deterministic unit-length vector derived from the text"""
+    seed = hashlib.sha256(text.encode()).digest()
+    values = [(seed[i % len(seed)] - 127.5) / 127.5 + i * 1e-6 for i in range(EMBED_DIM)]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [round(v / norm, 6) for v in values]
+
+
+class Generation:
+    """Timing and text of one fake completion"""
+
+    def __init__(self, body: dict, headers: Dict[str, str]):
+        options = body.get("options") or {}
+        self.model = body.get("model") or MODELS[0]
+        self.chat = "messages" in body
+        self.tokens = int(options.get("num_predict") or RESPONSE_TOKENS)
+        if self.tokens < 0:
+            self.tokens = RESPONSE_TOKENS
+        self.prompt_tokens = count_tokens(prompt_text(body))
+        self.tokens_per_second = float(headers.get("x-fake-tokens-per-second", TOKENS_PER_SECOND))
+        self.chunk_tokens = max(1, int(headers.get("x-fake-chunk-tokens", CHUNK_TOKENS)))
+        self.ttft = float(headers.get("x-fake-ttft-ms", TTFT_MS)) / 1000
+        self.started = time.perf_counter()
+
+    def text(self, first: int, count: int) -> str:
+        return "".join(f" {WORDS[i % len(WORDS)]}" for i in range(first, first + count))
+
+    async def pace(self, tokens_done: int):
+        """Sleep until `tokens_done` tokens are due, on an absolute schedule so delays don't accumulate"""
+        due = self.ttft
+        if self.tokens_per_second > 0:
+            due += tokens_done / self.tokens_per_second
+        delay = self.started + due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def chunk(self, content: str, done: bool) -> dict:
+        chunk = {"model": self.model, "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")}
+        if self.chat:
+            chunk["message"] = {"role": "assistant", "content": content}
+        else:
+            chunk["response"] = content
+        chunk["done"] = done
+        if done:
+            elapsed = time.perf_counter() - self.started
+            prompt_eval = min(self.ttft, elapsed)
+            chunk.update({
+                "done_reason": "stop",
+                "total_duration": int(elapsed * NS),
+                "load_duration": 0,
+                "prompt_eval_count": self.prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval * NS),
+                "eval_count": self.tokens,
+                "eval_duration": max(1, int((elapsed - prompt_eval) * NS)),
+            })
+        return chunk
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, payload, status: int = 200):
+    body = json.dumps(payload).encode()
+    # With a length, the whole response goes out in one write instead of waiting on Nagle and delayed ACKs
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def generate(send, receive, body: dict, headers: Dict[str, str]):
+    """/api/chat and /api/generate"""
+    generation = Generation(body, headers)
+    if not generation.chat and not body.get("prompt"):
+        # Empty prompt: Ollama's preload request
+        await send_json(send, {"model": generation.model, "created_at": generation.chunk("", False)["created_at"],
+                               "response": "", "done": True, "done_reason": "load"})
+        return
+
+    if not body.get("stream", True):
+        await generation.pace(generation.tokens)
+        final = generation.chunk(generation.text(0, generation.tokens), True)
+        await send_json(send, final)
+        return
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/x-ndjson")]})
+    # Like Ollama, stop generating once the client has gone
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        done = 0
+        while done < generation.tokens:
+            count = min(generation.chunk_tokens, generation.tokens - done)
+            await generation.pace(done + count)
+            if disconnected.done():
+                return
+            line = json.dumps(generation.chunk(generation.text(done, count), False)).encode() + b"\n"
+            done += count
+            await send({"type": "http.response.body", "body": line, "more_body": True})
+            if DROP_AFTER_CHUNKS and done >= DROP_AFTER_CHUNKS * generation.chunk_tokens:
+                # Dies mid-response, as Ollama does when it crashes: the server closes the connection
+                raise ConnectionAbortedError("FAKE_DROP_AFTER_CHUNKS reached")
+        final = json.dumps(generation.chunk("", True)).encode() + b"\n"
+        await send({"type": "http.response.body", "body": final})
+    finally:
+        disconnected.cancel()
+
+
+def model_entry(name: str) -> dict:
+    return {
+        "name": name,
+        "model": name,
+        "modified_at": "2025-01-01T00:00:00.000000000Z",
+        "size": 4920753328,
+        "digest": hashlib.sha256(name.encode()).hexdigest(),
+        "details": {"format": "gguf", "family": "fake", "parameter_size": "8B", "quantization_level": "Q4_K_M"},
+    }
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    headers = {name.decode().lower(): value.decode() for name, value in scope["headers"]}
+    raw = await read_body(receive)
+    try:
+        body = json.loads(raw) if raw else {}
+    except ValueError:
+        await send_json(send, {"error": "invalid JSON body"}, 400)
+        return
+
+    if FAIL_STATUS and method == "POST" and path.startswith("/api/"):
+        await send_json(send, {"error": f"fake failure ({FAIL_STATUS})"}, FAIL_STATUS)
+    elif method == "GET" and path == "/":
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Ollama is running"})
+    elif method == "GET" and path == "/api/version":
+        await send_json(send, {"version": "0.0.0-fake"})
+    elif method == "GET" and path == "/api/tags":
+        await send_json(send, {"models": [model_entry(name) for name in MODELS]})
+    elif method == "GET" and path == "/api/ps":
+        expires = "2099-01-01T00:00:00Z"
+        await send_json(send, {"models": [dict(model_entry(name), expires_at=expires) for name in MODELS]})
+    elif method == "POST" and path in ("/api/chat", "/api/generate"):
+        await generate(send, receive, body, headers)
+    elif method == "POST" and path == "/api/embed":
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        await send_json(send, {
+            "model": body.get("model") or MODELS[0],
+            "embeddings": [fake_vector(str(text)) for text in inputs],
+            "prompt_eval_count": sum(count_tokens(str(text)) for text in inputs),
+        })
+    elif method == "POST" and path == "/api/embeddings":
+        await send_json(send, {"embedding": fake_vector(str(body.get("prompt") or ""))})
+    else:
+        await send_json(send, {"error": f"{method} {path} not found"}, 404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks and tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--response-tokens", type=int, default=RESPONSE_TOKENS)
+    parser.add_argument("--ttft-ms", type=float, default=TTFT_MS)
+    parser.add_argument("--models", default=",".join(MODELS))
+    args = parser.parse_args()
+
+    # Workers import this module afresh, so settings travel through the environment
+    os.environ.update({
+        "FAKE_TOKENS_PER_SECOND": str(args.tokens_per_second),
+        "FAKE_CHUNK_TOKENS": str(args.chunk_tokens),
+        "FAKE_RESPONSE_TOKENS": str(args.response_tokens),
+        "FAKE_TTFT_MS": str(args.ttft_ms),
+        "FAKE_MODELS": args.models,
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    uvicorn.run("fake_ollama:app", host=args.host, port=args.port, workers=args.workers,
+                log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
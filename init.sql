@@ -1,18 +1,22 @@
 -- Create database if it doesn't exist
-CREATE DATABASE IF NOT EXISTS ollama_logs;
+SELECT 'CREATE DATABASE ollama_logs'
+WHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'ollama_logs')\gexec
 
 -- Connect to the database
 \c ollama_logs
 
--- Create request_logs table
+-- Create request_logs table, range-partitioned by month on timestamp (see
+-- create_request_log_partitions below); the primary key has to include it
 CREATE TABLE IF NOT EXISTS request_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMP NOT NULL,
     ip_address VARCHAR(45),
     api_key VARCHAR(255),
     model VARCHAR(100),
-    prompt TEXT,
-    response TEXT,
+    prompt_hash CHAR(64),                      -- request_bodies.hash of the full prompt (NULL if empty)
+    response_hash CHAR(64),                    -- request_bodies.hash of the logged response (NULL if empty)
+    prompt_preview VARCHAR(100),               -- first 100 characters, for lists without a join
+    response_preview VARCHAR(100),
     prompt_tokens INTEGER DEFAULT 0,
     completion_tokens INTEGER DEFAULT 0,
     total_tokens INTEGER DEFAULT 0,
@@ -21,14 +25,165 @@ CREATE TABLE IF NOT EXISTS request_logs (
     cost_dollars REAL DEFAULT 0,
     http_status INTEGER DEFAULT 200,
     error_message TEXT,
+    response_chars INTEGER DEFAULT 0,          -- full response length before truncation
+    response_truncated BOOLEAN DEFAULT FALSE,  -- response longer than LOG_MAX_RESPONSE_CHARS
+    tokens_estimated BOOLEAN DEFAULT TRUE,     -- token counts are len/4 estimates, not Ollama's counts
+    load_duration_ms REAL,                     -- Ollama model load time
+    prompt_eval_duration_ms REAL,              -- Ollama prompt processing time
+    eval_duration_ms REAL,                     -- Ollama decode time
+    time_to_first_token_ms REAL,               -- model-side TTFT: load + prompt processing
+    tokens_per_second REAL,                    -- decode throughput: eval_count / eval_duration
+    upstream_connect_ms REAL,                  -- logger: until the request went out on an upstream connection
+    first_byte_ms REAL,                        -- logger: until upstream response headers arrived
+    first_token_ms REAL,                       -- logger: until the first generated token arrived
+    inter_token_p50_ms REAL,                   -- logger: median gap between streamed tokens
+    inter_token_p99_ms REAL,                   -- logger: p99 gap between streamed tokens
+    cache_hit BOOLEAN DEFAULT FALSE,           -- answered from the response cache, no inference
+    coalesced BOOLEAN DEFAULT FALSE,           -- shared an identical in-flight generation, no extra inference
+    cold_start BOOLEAN DEFAULT FALSE,          -- waited for a model load (load_duration above COLD_START_MS)
+    cancelled BOOLEAN DEFAULT FALSE,           -- client disconnected; upstream aborted (http_status 499)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Columns added since the first release. No-ops on a new table; they bring
+-- a request_logs created by an earlier init.sql up to date (see migrate.sql)
+ALTER TABLE request_logs
+    ADD COLUMN IF NOT EXISTS prompt_hash CHAR(64),
+    ADD COLUMN IF NOT EXISTS response_hash CHAR(64),
+    ADD COLUMN IF NOT EXISTS prompt_preview VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS response_preview VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS response_chars INTEGER DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS response_truncated BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS tokens_estimated BOOLEAN DEFAULT TRUE,
+    ADD COLUMN IF NOT EXISTS load_duration_ms REAL,
+    ADD COLUMN IF NOT EXISTS prompt_eval_duration_ms REAL,
+    ADD COLUMN IF NOT EXISTS eval_duration_ms REAL,
+    ADD COLUMN IF NOT EXISTS time_to_first_token_ms REAL,
+    ADD COLUMN IF NOT EXISTS tokens_per_second REAL,
+    ADD COLUMN IF NOT EXISTS upstream_connect_ms REAL,
+    ADD COLUMN IF NOT EXISTS first_byte_ms REAL,
+    ADD COLUMN IF NOT EXISTS first_token_ms REAL,
+    ADD COLUMN IF NOT EXISTS inter_token_p50_ms REAL,
+    ADD COLUMN IF NOT EXISTS inter_token_p99_ms REAL,
+    ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS coalesced BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS cold_start BOOLEAN DEFAULT FALSE,
+    ADD COLUMN IF NOT EXISTS cancelled BOOLEAN DEFAULT FALSE;
+
+-- Prompt and response texts, stored once per distinct content (repeated
+-- prompts and canned answers share a row) and loaded only for log details
+-- and search. Large values are TOASTed with lz4, which is faster than pglz.
+CREATE TABLE IF NOT EXISTS request_bodies (
+    hash CHAR(64) PRIMARY KEY,                 -- sha256 of body
+    body TEXT COMPRESSION lz4 NOT NULL,
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        to_tsvector('simple', LEFT(body, 100000))
+    ) STORED,                                  -- /api/search: words of the body (first 100k chars)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Full-text search; fastupdate (the default) queues new entries so inserts stay cheap
+CREATE INDEX IF NOT EXISTS idx_request_bodies_search ON request_bodies USING GIN (search_vector);
+
+-- request_logs with its bodies joined back in, for ad-hoc queries. Dropped
+-- first: l.* changes whenever request_logs gains a column
+DROP VIEW IF EXISTS request_logs_full;
+CREATE VIEW request_logs_full AS
+SELECT l.*, p.body AS prompt, r.body AS response
+FROM request_logs l
+LEFT JOIN request_bodies p ON p.hash = l.prompt_hash
+LEFT JOIN request_bodies r ON r.hash = l.response_hash;
+
+-- Shared tier of the logger's response cache (RESPONSE_CACHE_POSTGRES=true)
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key CHAR(64) PRIMARY KEY,            -- sha256 of the canonical request
+    model VARCHAR(100),
+    content TEXT NOT NULL,
+    metrics TEXT,                              -- Ollama token counts/timings as JSON
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache(expires_at);
+
 -- Create indexes for faster queries
-CREATE INDEX idx_timestamp ON request_logs(timestamp);
-CREATE INDEX idx_api_key ON request_logs(api_key);
-CREATE INDEX idx_model ON request_logs(model);
-CREATE INDEX idx_created_at ON request_logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_timestamp ON request_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_api_key ON request_logs(api_key);
+CREATE INDEX IF NOT EXISTS idx_model ON request_logs(model);
+CREATE INDEX IF NOT EXISTS idx_created_at ON request_logs(created_at);
+-- Keyset pagination of the dashboard's log list (successful requests, newest first)
+CREATE INDEX IF NOT EXISTS idx_request_logs_ok_recent ON request_logs(timestamp DESC, id DESC) WHERE http_status = 200;
+-- Map search hits in request_bodies back to their log rows
+CREATE INDEX IF NOT EXISTS idx_request_logs_prompt_hash ON request_logs(prompt_hash);
+CREATE INDEX IF NOT EXISTS idx_request_logs_response_hash ON request_logs(response_hash);
+
+-- Monthly partitions are named request_logs_YYYY_MM. The logger calls
+-- create_request_log_partitions() hourly so the next months always exist;
+-- the default partition only catches rows outside every monthly range.
+CREATE TABLE IF NOT EXISTS request_logs_default PARTITION OF request_logs DEFAULT;
+
+-- Create the partitions for the current month and the next months_ahead
+-- months. Returns the number created.
+CREATE OR REPLACE FUNCTION create_request_log_partitions(months_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (DATE_TRUNC('month', LOCALTIMESTAMP) + make_interval(months => i))::DATE;
+        partition_name := 'request_logs_' || TO_CHAR(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF request_logs FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_start + INTERVAL '1 month'
+                );
+                created := created + 1;
+            EXCEPTION WHEN check_violation THEN
+                -- Rows for this month already landed in the default partition
+                RAISE WARNING 'request_logs_default has rows for %; move them out to create %',
+                    TO_CHAR(month_start, 'YYYY-MM'), partition_name;
+            END;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Monthly partitions that end more than keep_months months before the
+-- current month, oldest first
+CREATE OR REPLACE FUNCTION expired_request_log_partitions(keep_months INTEGER)
+RETURNS TABLE (partition_name TEXT) AS $$
+    SELECT child.relname::TEXT
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = 'request_logs'
+      AND child.relname ~ '^request_logs_[0-9]{4}_[0-9]{2}$'
+      AND TO_DATE(RIGHT(child.relname, 7), 'YYYY_MM')
+          < DATE_TRUNC('month', LOCALTIMESTAMP) - make_interval(months => keep_months)
+    ORDER BY child.relname;
+$$ LANGUAGE sql STABLE;
+
+-- Delete bodies that no log row references any more, once old partitions
+-- have been retired. Bodies younger than a day are left alone so a row
+-- still being written can't lose its body. Returns the number deleted.
+CREATE OR REPLACE FUNCTION prune_request_bodies()
+RETURNS BIGINT AS $$
+    WITH deleted AS (
+        DELETE FROM request_bodies b
+        WHERE b.created_at < LOCALTIMESTAMP - INTERVAL '1 day'
+          AND NOT EXISTS (SELECT 1 FROM request_logs l WHERE l.prompt_hash = b.hash)
+          AND NOT EXISTS (SELECT 1 FROM request_logs l WHERE l.response_hash = b.hash)
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM deleted;
+$$ LANGUAGE sql;
+
+SELECT create_request_log_partitions(2);
 
 -- Create a view for daily statistics
 CREATE OR REPLACE VIEW daily_stats AS
@@ -72,3 +227,119 @@ FROM request_logs
 WHERE error_message IS NULL
 GROUP BY model
 ORDER BY total_requests DESC;
+
+-- Pre-aggregated request counts for the dashboard, maintained incrementally by
+-- rollup_request_logs(). One row per (bucket, model, api_key, http_status);
+-- NULL model/api_key are stored as '' so they can be part of the key.
+CREATE TABLE IF NOT EXISTS request_rollup_minute (
+    bucket TIMESTAMP NOT NULL,                 -- start of the minute (UTC)
+    model VARCHAR(100) NOT NULL,
+    api_key VARCHAR(255) NOT NULL,
+    http_status INTEGER NOT NULL,
+    requests BIGINT NOT NULL,
+    total_tokens BIGINT NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    power_wh DOUBLE PRECISION NOT NULL,
+    cost_dollars DOUBLE PRECISION NOT NULL,
+    errors BIGINT NOT NULL,                    -- rows with an error_message
+    PRIMARY KEY (bucket, model, api_key, http_status)
+);
+
+CREATE TABLE IF NOT EXISTS request_rollup_hour (LIKE request_rollup_minute INCLUDING ALL);
+CREATE TABLE IF NOT EXISTS request_rollup_day (LIKE request_rollup_minute INCLUDING ALL);
+
+-- Highest request_logs.id already folded into the rollups
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO rollup_state (name, last_id) VALUES ('request_logs', 0) ON CONFLICT DO NOTHING;
+
+-- Fold new request_logs rows into the minute/hour/day rollups.
+-- Rows newer than `settle` are left for the next run: ids are assigned at
+-- insert time, so a batch that commits late could otherwise slip in below
+-- the watermark. Returns the number of ids covered (0 if another session
+-- holds the lock or nothing is ready).
+CREATE OR REPLACE FUNCTION rollup_request_logs(max_rows INTEGER DEFAULT 200000,
+                                               settle INTERVAL DEFAULT '30 seconds')
+RETURNS BIGINT AS $$
+DECLARE
+    from_id BIGINT;
+    to_id BIGINT;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('rollup_request_logs')) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT last_id INTO from_id FROM rollup_state WHERE name = 'request_logs' FOR UPDATE;
+    -- The next max_rows rows by id, however far apart their ids are
+    -- (a failed batch or a sequence jump can leave wide gaps)
+    SELECT MAX(id) INTO to_id
+    FROM (
+        SELECT id FROM request_logs
+        WHERE id > from_id AND created_at < LOCALTIMESTAMP - settle
+        ORDER BY id
+        LIMIT max_rows
+    ) ready;
+    IF to_id IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    WITH delta AS (
+        SELECT
+            DATE_TRUNC('minute', timestamp) AS bucket,
+            COALESCE(model, '') AS model,
+            COALESCE(api_key, '') AS api_key,
+            COALESCE(http_status, 0) AS http_status,
+            COUNT(*) AS requests,
+            COALESCE(SUM(total_tokens), 0) AS total_tokens,
+            COALESCE(SUM(duration_seconds), 0) AS duration_seconds,
+            COALESCE(SUM(power_wh), 0) AS power_wh,
+            COALESCE(SUM(cost_dollars), 0) AS cost_dollars,
+            COUNT(*) FILTER (WHERE error_message IS NOT NULL) AS errors
+        FROM request_logs
+        WHERE id > from_id AND id <= to_id
+        GROUP BY 1, 2, 3, 4
+    ), minute_rows AS (
+        INSERT INTO request_rollup_minute AS r
+        SELECT * FROM delta
+        ON CONFLICT (bucket, model, api_key, http_status) DO UPDATE SET
+            requests = r.requests + EXCLUDED.requests,
+            total_tokens = r.total_tokens + EXCLUDED.total_tokens,
+            duration_seconds = r.duration_seconds + EXCLUDED.duration_seconds,
+            power_wh = r.power_wh + EXCLUDED.power_wh,
+            cost_dollars = r.cost_dollars + EXCLUDED.cost_dollars,
+            errors = r.errors + EXCLUDED.errors
+    ), hour_rows AS (
+        INSERT INTO request_rollup_hour AS r
+        SELECT DATE_TRUNC('hour', bucket), model, api_key, http_status, SUM(requests), SUM(total_tokens),
+               SUM(duration_seconds), SUM(power_wh), SUM(cost_dollars), SUM(errors)
+        FROM delta
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (bucket, model, api_key, http_status) DO UPDATE SET
+            requests = r.requests + EXCLUDED.requests,
+            total_tokens = r.total_tokens + EXCLUDED.total_tokens,
+            duration_seconds = r.duration_seconds + EXCLUDED.duration_seconds,
+            power_wh = r.power_wh + EXCLUDED.power_wh,
+            cost_dollars = r.cost_dollars + EXCLUDED.cost_dollars,
+            errors = r.errors + EXCLUDED.errors
+    )
+    INSERT INTO request_rollup_day AS r
+    SELECT DATE_TRUNC('day', bucket), model, api_key, http_status, SUM(requests), SUM(total_tokens),
+           SUM(duration_seconds), SUM(power_wh), SUM(cost_dollars), SUM(errors)
+    FROM delta
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (bucket, model, api_key, http_status) DO UPDATE SET
+        requests = r.requests + EXCLUDED.requests,
+        total_tokens = r.total_tokens + EXCLUDED.total_tokens,
+        duration_seconds = r.duration_seconds + EXCLUDED.duration_seconds,
+        power_wh = r.power_wh + EXCLUDED.power_wh,
+        cost_dollars = r.cost_dollars + EXCLUDED.cost_dollars,
+        errors = r.errors + EXCLUDED.errors;
+
+    UPDATE rollup_state SET last_id = to_id, updated_at = CURRENT_TIMESTAMP WHERE name = 'request_logs';
+    RETURN to_id - from_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,48 +1,314 @@
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import StreamingResponse
-import httpx
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 import time
 import json
 import os
 import asyncpg
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 import asyncio
+import hashlib
+import tempfile
+import uuid
 
-app = FastAPI()
+from backends import RETRYABLE_ERRORS, RETRYABLE_STATUSES, BackendPool
+from cache import CACHEABLE_PATHS, PostgresCacheTier, ResponseCache, is_deterministic, request_key
+from catalog import ModelCatalog, model_created
+from coalesce import Flight, SingleFlight
+from embeddings import EMBED_PARAMS, EmbeddingBatcher, EmbeddingError, VectorCache, encode_vector, parse_inputs
+from log_writer import LogWriter, MemoryLogWriter
+from maintenance import MaintenanceLoop
+from metrics import Registry, RequestTimer, SharedMetrics
+from partitions import PartitionMaintenance
+from scheduler import FairScheduler, QueueFull
+from streaming import OpenAIStreamTransformer, ResponseCollector, aiter_ndjson, dumps_bytes, replay_chunks
+from upstream import UpstreamClient, classify_error, filter_request_headers, filter_response_headers
+from warmup import ModelWarmer
+from workers import LeaderLock, worker_share
 
-# Persistent HTTP client for proxying
-http_client = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Runs in every worker process, so each one builds its own pools and clients"""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Pooled HTTP client for proxying to Ollama
+upstream: Optional[UpstreamClient] = None
+
+# Ollama servers requests are balanced across
+backend_pool: Optional[BackendPool] = None
+
+# Preloads configured models and keeps them resident
+model_warmer: Optional[ModelWarmer] = None
+
+# Model list served for /v1/models without calling Ollama
+model_catalog: Optional[ModelCatalog] = None
+
+# Micro-batches OpenAI-style embedding inputs into /api/embed calls
+embedding_batcher: Optional[EmbeddingBatcher] = None
+
+# Periodic database housekeeping (rollups, cache expiry)
+maintenance: Optional[MaintenanceLoop] = None
+partition_maintenance: Optional[PartitionMaintenance] = None
+partition_loop: Optional[MaintenanceLoop] = None
+
+# Background writer that batches request logs into PostgreSQL
+log_writer: Optional[LogWriter] = None
+
+# Exact-match cache for deterministic completions
+response_cache: Optional[ResponseCache] = None
+
+# Shares one upstream generation between identical in-flight requests
+single_flight = SingleFlight()
+
+# Admission control in front of Ollama's parallel slots
+scheduler: Optional[FairScheduler] = None
+
+# Held by the one worker that runs warm-up and maintenance
+leader_lock: Optional[LeaderLock] = None
+
+# Combines /metrics across worker processes (WEB_CONCURRENCY > 1)
+shared_metrics: Optional[SharedMetrics] = None
 
 # Configuration
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))  # Worker processes (read by uvicorn --workers and gunicorn)
+LOGGER_SHARED_DIR = os.getenv("LOGGER_SHARED_DIR", os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "ollama-logger"))  # Metrics snapshots and leader lock shared by the workers
+METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))  # Seconds between a worker's metrics snapshots
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
+OLLAMA_URLS = [u.strip() for u in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if u.strip()]  # Backend pool, comma-separated
+OLLAMA_MAX_LOADED_MODELS = int(os.getenv("OLLAMA_MAX_LOADED_MODELS", "1"))  # Models each backend keeps in memory
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", "10"))  # Seconds between /api/ps polls (0 = off)
+BACKEND_EJECT_AFTER = int(os.getenv("BACKEND_EJECT_AFTER", "2"))  # Consecutive failures before a backend is ejected
+BACKEND_EJECT_SECONDS = float(os.getenv("BACKEND_EJECT_SECONDS", "30"))  # How long an ejected backend is skipped
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))  # Other backends tried when one fails before the first byte
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "").split(",") if m.strip()]  # Models preloaded at startup
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE", "30m")  # keep_alive sent with warm-up pings
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "240"))  # Seconds between keep-alive pings (0 = preload only)
+COLD_START_MS = float(os.getenv("COLD_START_MS", "1000"))  # load_duration above which a request counts as a cold start
+SCHEDULER_MODEL_AFFINITY = os.getenv("SCHEDULER_MODEL_AFFINITY", "true").lower() == "true"  # Admit queued requests for loaded models first
+MODEL_CATALOG_INTERVAL = float(os.getenv("MODEL_CATALOG_INTERVAL", "30"))  # Seconds between model list refreshes (0 = proxy every call)
+LOG_MODEL_LISTING = os.getenv("LOG_MODEL_LISTING", "false").lower() == "true"  # Write a log row for each /v1/models call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))  # Inputs per /api/embed call
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))  # How long small requests wait to share a batch
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "64"))  # Vector cache memory budget (0 = off)
+EMBED_MAX_INPUTS = int(os.getenv("EMBED_MAX_INPUTS", "2048"))  # Inputs accepted in one embeddings request
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "30"))  # Seconds between rollup/cleanup runs (0 = off)
+ROLLUP_SETTLE_SECONDS = float(os.getenv("ROLLUP_SETTLE_SECONDS", "30"))  # Age a log row needs before it is rolled up
+ROLLUP_MINUTE_RETENTION_DAYS = int(os.getenv("ROLLUP_MINUTE_RETENTION_DAYS", "14"))  # Minute rollups kept (hour/day are kept forever)
+PARTITION_INTERVAL = float(os.getenv("PARTITION_INTERVAL", "3600"))  # Seconds between partition create/retention runs (0 = off)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))  # Monthly request_logs partitions created in advance
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "0"))  # Full months of logs kept besides the current one (0 = forever)
+LOG_RETENTION_ACTION = os.getenv("LOG_RETENTION_ACTION", "drop")  # What happens to expired partitions: drop or detach
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "")  # Export expired partitions here as .jsonl.gz first ('' = no export)
 DB_HOST = os.getenv("DB_HOST", "postgres")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "ollama_logs")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))  # PostgreSQL connections for the whole logger, split across workers
 ELECTRICITY_RATE = float(os.getenv("ELECTRICITY_RATE", "0.383"))  # San Diego SDG&E rate $/kWh
 M4_MAX_POWER_WATTS = float(os.getenv("M4_MAX_POWER_WATTS", "80"))  # Average power during AI inference
+LOG_SINK = os.getenv("LOG_SINK", "postgres")  # Where log rows go: postgres, or memory (benchmarks; no database needed)
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))  # Rows per COPY batch
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))  # Max seconds a row waits in the buffer
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "10000"))  # Rows buffered before new ones are dropped
+LOG_MAX_RESPONSE_CHARS = int(os.getenv("LOG_MAX_RESPONSE_CHARS", "131072"))  # Response text kept per log row (0 = unlimited)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"  # Cache temperature-0 / seeded completions
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # Seconds a cached answer stays valid
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))  # Memory budget for the in-process tier
+RESPONSE_CACHE_POSTGRES = os.getenv("RESPONSE_CACHE_POSTGRES", "false").lower() == "true"  # Shared tier in response_cache table
+COALESCE_MODE = os.getenv("COALESCE_MODE", "deterministic")  # Share identical in-flight requests: deterministic | all | off
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", "4")))  # Requests sent to each backend at once (0 = unlimited)
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))  # Requests waiting for a slot before 429s
+SCHEDULER_MAX_QUEUE_PER_KEY = int(os.getenv("SCHEDULER_MAX_QUEUE_PER_KEY", "16"))  # Per API key queue cap (0 = none)
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "120"))  # Seconds a request may wait for a slot
+SCHEDULER_KEY_WEIGHTS = os.getenv("SCHEDULER_KEY_WEIGHTS", "")  # Fair-share weights, e.g. "sk-a:2,sk-b:1"
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32"))  # Open connections to Ollama, per pool
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "16"))  # Idle connections kept for reuse
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))  # Seconds an idle connection is kept
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))  # Seconds to open a TCP connection
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "300"))  # Max seconds between bytes (covers model load)
+UPSTREAM_WRITE_TIMEOUT = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "30"))  # Seconds to send the request body
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "10"))  # Seconds to wait for a free pooled connection
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"  # HTTP/2 to the upstream (needs h2 installed)
+UPSTREAM_POOL_PER_BACKEND = os.getenv("UPSTREAM_POOL_PER_BACKEND", "false").lower() == "true"  # Separate pool per Ollama host
+
+# Column order of the records handed to the log writer
+LOG_COLUMNS = (
+    "timestamp", "ip_address", "api_key", "model",
+    "prompt_hash", "response_hash", "prompt_preview", "response_preview",
+    "prompt_tokens", "completion_tokens", "total_tokens",
+    "duration_seconds", "power_wh", "cost_dollars",
+    "http_status", "error_message",
+    "response_chars", "response_truncated",
+    "tokens_estimated", "load_duration_ms", "prompt_eval_duration_ms",
+    "eval_duration_ms", "time_to_first_token_ms", "tokens_per_second",
+)
+
+# Characters of prompt/response kept inline in request_logs for list views
+BODY_PREVIEW_CHARS = 100
+
+# request_logs column widths for client-supplied values; longer ones are cut rather than failing the row
+API_KEY_MAX_CHARS = 255
+MODEL_MAX_CHARS = 100
+
+# Timing fields reported by Ollama, stored alongside each log row
+OLLAMA_METRIC_COLUMNS = (
+    "load_duration_ms", "prompt_eval_duration_ms",
+    "eval_duration_ms", "time_to_first_token_ms", "tokens_per_second",
+)
+
+# Request phases measured by the logger itself (see RequestTimer)
+TIMING_COLUMNS = (
+    "upstream_connect_ms", "first_byte_ms", "first_token_ms",
+    "inter_token_p50_ms", "inter_token_p99_ms",
+)
+LOG_COLUMNS += TIMING_COLUMNS + ("cache_hit", "coalesced", "cold_start", "cancelled")
+
+# Housekeeping run only by the worker holding the leader lock; across logger containers the rollup function still serializes itself with an advisory lock
+MAINTENANCE_JOBS = [
+    ("rollup_request_logs",
+     f"SELECT rollup_request_logs(200000, make_interval(secs => {ROLLUP_SETTLE_SECONDS}))"),
+    ("expire_rollup_minutes",
+     f'''WITH deleted AS (
+            DELETE FROM request_rollup_minute
+            WHERE bucket < LOCALTIMESTAMP - make_interval(days => {ROLLUP_MINUTE_RETENTION_DAYS})
+            RETURNING 1
+        ) SELECT COUNT(*) FROM deleted'''),
+    ("expire_response_cache",
+     '''WITH deleted AS (
+            DELETE FROM response_cache WHERE expires_at < NOW() RETURNING 1
+        ) SELECT COUNT(*) FROM deleted'''),
+]
+
+# Endpoints that occupy an Ollama slot and go through the scheduler
+SCHEDULED_PATHS = {"api/chat", "api/generate", "api/embeddings", "api/embed"}
+
+# Endpoints reported as their own metric label; everything else is "other"
+METRIC_PATHS = {"api/chat", "api/generate", "api/embeddings", "api/embed", "api/tags", "api/show", "api/ps"}
+
+# Prometheus metrics served on /metrics
+metrics_registry = Registry()
+REQUESTS_TOTAL = metrics_registry.counter(
+    "logger_requests_total", "Proxied requests by endpoint and HTTP status", ("path", "status"))
+REQUEST_DURATION = metrics_registry.histogram(
+    "logger_request_duration_seconds", "End-to-end proxied request duration", ("path",))
+UPSTREAM_CONNECT = metrics_registry.histogram(
+    "logger_upstream_connect_seconds", "Time until the request was sent on an upstream connection")
+FIRST_BYTE = metrics_registry.histogram(
+    "logger_time_to_first_byte_seconds", "Time until upstream response headers arrived", ("model",))
+FIRST_TOKEN = metrics_registry.histogram(
+    "logger_time_to_first_token_seconds", "Time until the first generated token was received", ("model",))
+INTER_TOKEN = metrics_registry.histogram(
+    "logger_inter_token_seconds", "Gap between consecutive streamed tokens", ("model",))
+REQUESTS_IN_FLIGHT = metrics_registry.gauge(
+    "logger_requests_in_flight", "Requests currently being proxied")
+STREAMS_IN_FLIGHT = metrics_registry.gauge(
+    "logger_streams_in_flight", "Streaming responses currently open")
+REQUESTS_CANCELLED = metrics_registry.counter(
+    "logger_requests_cancelled_total", "Requests abandoned by the client, by stage (waiting or streaming)", ("stage",))
+UPSTREAM_POOL_WAIT = metrics_registry.histogram(
+    "logger_upstream_pool_wait_seconds", "Time spent waiting for a pooled upstream connection")
+UPSTREAM_CONNECTIONS = metrics_registry.counter(
+    "logger_upstream_connections_total", "Upstream requests by connection state (new or reused)", ("state",))
+UPSTREAM_ERRORS = metrics_registry.counter(
+    "logger_upstream_errors_total", "Failed upstream calls by kind", ("kind",))
+metrics_registry.gauge(
+    "logger_upstream_connection_reuse_ratio", "Share of upstream requests sent on a reused connection",
+    callback=lambda: upstream.reuse_rate() if upstream else 0, aggregate="mean")
+BACKEND_REQUESTS = metrics_registry.counter(
+    "logger_backend_requests_total", "Upstream attempts by Ollama backend", ("backend",))
+BACKEND_OUTSTANDING = metrics_registry.gauge(
+    "logger_backend_outstanding", "Requests currently running on each Ollama backend", ("backend",))
+metrics_registry.counter(
+    "logger_upstream_retries_total", "Requests retried on another backend before the first byte",
+    callback=lambda: backend_pool.retries if backend_pool else 0)
+metrics_registry.counter(
+    "logger_backend_ejections_total", "Times a failing backend was taken out of rotation",
+    callback=lambda: sum(b.ejections for b in backend_pool.backends) if backend_pool else 0)
+metrics_registry.gauge(
+    "logger_backends_available", "Ollama backends that are healthy and not ejected",
+    callback=lambda: sum(b.available(time.monotonic()) for b in backend_pool.backends) if backend_pool else 0,
+    aggregate="min")
+MODEL_LOADS = metrics_registry.counter(
+    "logger_model_loads_total", "Model loads seen by the logger, by model and cause (request or warmup)", ("model", "source"))
+MODEL_LOAD_SECONDS = metrics_registry.histogram(
+    "logger_model_load_seconds", "Time Ollama spent loading a model", ("model",))
+EMBED_BATCH_INPUTS = metrics_registry.histogram(
+    "logger_embedding_batch_inputs", "Inputs per /api/embed call", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+metrics_registry.counter(
+    "logger_embedding_cache_hits_total", "Embedding inputs answered from the vector cache",
+    callback=lambda: embedding_batcher.cache.hits if embedding_batcher and embedding_batcher.cache else 0)
+metrics_registry.counter(
+    "logger_embedding_cache_misses_total", "Embedding inputs that had to be computed",
+    callback=lambda: embedding_batcher.cache.misses if embedding_batcher and embedding_batcher.cache else 0)
+metrics_registry.gauge(
+    "logger_log_buffer_rows", "Log rows waiting to be written",
+    callback=lambda: log_writer.queue.qsize() if log_writer else 0)
+metrics_registry.counter(
+    "logger_log_rows_dropped_total", "Log rows dropped because the buffer was full",
+    callback=lambda: log_writer.dropped if log_writer else 0)
+metrics_registry.counter(
+    "logger_log_rows_failed_total", "Log rows lost to database write errors",
+    callback=lambda: log_writer.failed if log_writer else 0)
+metrics_registry.counter(
+    "logger_cache_hits_total", "Completions answered from the response cache",
+    callback=lambda: response_cache.hits if response_cache else 0)
+metrics_registry.counter(
+    "logger_cache_misses_total", "Cacheable completions that had to be generated",
+    callback=lambda: response_cache.misses if response_cache else 0)
+metrics_registry.counter(
+    "logger_cache_evictions_total", "Entries evicted to stay within the cache memory budget",
+    callback=lambda: response_cache.evictions if response_cache else 0)
+metrics_registry.counter(
+    "logger_coalesced_requests_total", "Requests that joined an identical in-flight upstream generation",
+    callback=lambda: single_flight.coalesced)
+metrics_registry.gauge(
+    "logger_coalesce_flights", "Upstream generations currently shared through single-flight",
+    callback=lambda: single_flight.in_flight())
+metrics_registry.gauge(
+    "logger_scheduler_active_slots", "Upstream slots currently in use",
+    callback=lambda: scheduler.active if scheduler else 0)
+metrics_registry.gauge(
+    "logger_scheduler_queue_depth", "Requests waiting for an upstream slot",
+    callback=lambda: scheduler.waiting if scheduler else 0)
+metrics_registry.counter(
+    "logger_scheduler_rejected_total", "Requests answered with 429 because the queue was full or timed out",
+    callback=lambda: scheduler.rejected if scheduler else 0)
+QUEUE_WAIT = metrics_registry.histogram(
+    "logger_scheduler_queue_wait_seconds", "Time requests spent waiting for an upstream slot")
+metrics_registry.gauge(
+    "logger_cache_bytes", "Approximate memory used by the in-process response cache",
+    callback=lambda: response_cache.bytes if response_cache else 0)
+metrics_registry.gauge(
+    "logger_workers", "Worker processes reporting metrics",
+    callback=lambda: shared_metrics.workers if shared_metrics else 1, aggregate="max")
 
 # Database connection pool
 db_pool: Optional[asyncpg.Pool] = None
 
-async def get_db_pool():
-    """Get or create database connection pool"""
-    global db_pool
-    if db_pool is None:
-        db_pool = await asyncpg.create_pool(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            min_size=2,
-            max_size=10
-        )
-    return db_pool
+async def create_db_pool() -> asyncpg.Pool:
+    """This worker's database connection pool"""
+    max_size = worker_share(DB_POOL_MAX_SIZE, WEB_CONCURRENCY)
+    return await asyncpg.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        min_size=min(2, max_size),
+        max_size=max_size
+    )
 
-async def log_request(
+def log_request(
     timestamp: datetime,
     ip_address: str,
     api_key: str,
@@ -56,25 +322,127 @@ async def log_request(
     power_wh: float,
     cost_dollars: float,
     http_status: int,
-    error_message: Optional[str] = None
+    error_message: Optional[str] = None,
+    response_chars: Optional[int] = None,
+    response_truncated: bool = False,
+    tokens_estimated: bool = True,
+    ollama_metrics: Optional[dict] = None,
+    timing: Optional[dict] = None,
+    cache_hit: bool = False,
+    coalesced: bool = False,
+    cold_start: Optional[bool] = None,
+    cancelled: bool = False
 ):
-    """Log request to PostgreSQL database"""
+    """Queue a request log row; the background writer batches it into PostgreSQL
+
+    Never raises: it runs on the response path, and a row that can't be
+    built must not turn a served request into an error.
+    """
     try:
-        pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO request_logs (
-                    timestamp, ip_address, api_key, model, prompt, response,
-                    prompt_tokens, completion_tokens, total_tokens,
-                    duration_seconds, power_wh, cost_dollars,
-                    http_status, error_message
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
-            ''', timestamp, ip_address, api_key, model, prompt, response_text,
-                 prompt_tokens, completion_tokens, total_tokens,
-                 duration_seconds, power_wh, cost_dollars,
-                 http_status, error_message)
+        prompt = message_text(prompt)
+        response_text = message_text(response_text)
+        api_key = str(api_key or "")[:API_KEY_MAX_CHARS]
+        model = message_text(model)[:MODEL_MAX_CHARS]
+        if cold_start is None:
+            # A request that had to wait for a model load carries a large load_duration
+            load_ms = (ollama_metrics or {}).get("load_duration_ms") or 0
+            cold_start = load_ms >= COLD_START_MS
+            if cold_start and not coalesced:
+                note_model_load(model, load_ms / 1000, "request")
+        if log_writer is None:
+            print("Log writer not running - dropping request log")
+            return
+        prompt_hash = body_hash(prompt)
+        response_hash = body_hash(response_text)
+        bodies = [(h, text) for h, text in ((prompt_hash, prompt), (response_hash, response_text)) if h]
+        log_writer.submit((
+            timestamp, ip_address, api_key, model,
+            prompt_hash, response_hash, prompt[:BODY_PREVIEW_CHARS], response_text[:BODY_PREVIEW_CHARS],
+            prompt_tokens, completion_tokens, total_tokens,
+            duration_seconds, power_wh, cost_dollars,
+            http_status, error_message,
+            len(response_text) if response_chars is None else response_chars,
+            response_truncated, tokens_estimated,
+            *(ollama_metrics.get(column) if ollama_metrics else None for column in OLLAMA_METRIC_COLUMNS),
+            *(timing.get(column) if timing else None for column in TIMING_COLUMNS),
+            cache_hit, coalesced, cold_start, cancelled
+        ), bodies)
     except Exception as e:
-        print(f"Error logging to database: {e}")
+        print(f"Error queueing request log: {e}")
+
+def message_text(content: Any) -> str:
+    """Loggable text of a prompt or message content
+
+    OpenAI multi-part content (`[{"type": "text", "text": ...}, ...]`) keeps
+    its text parts; other non-string values are logged as JSON.
+    """
+    if isinstance(content, str):
+        return content
+    if content is None:
+        return ""
+    if isinstance(content, list):
+        return "\n".join(
+            part["text"] for part in content
+            if isinstance(part, dict) and isinstance(part.get("text"), str)
+        )
+    return json.dumps(content, default=str)
+
+def body_hash(text: str) -> Optional[str]:
+    """request_bodies key for a prompt or response (None for empty text, which isn't stored)"""
+    if not text:
+        return None
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+def note_model_load(model: str, seconds: float, source: str):
+    """Count a model load in the Prometheus metrics"""
+    MODEL_LOADS.inc(model=model, source=source)
+    MODEL_LOAD_SECONDS.observe(seconds, model=model)
+
+async def log_model_load(backend, model: str, http_status: int, seconds: float, error: Optional[str],
+                         load_duration_ms: Optional[float] = None):
+    """Log a warm-up load as its own row so its cost isn't charged to a user request
+
+    load_duration_ms is Ollama's own load time; the ping's wall-clock time
+    stands in for it when Ollama didn't report one.
+    """
+    if load_duration_ms is None:
+        load_duration_ms = seconds * 1000
+    if error is None:
+        note_model_load(model, load_duration_ms / 1000, "warmup")
+    power_wh, cost_dollars = calculate_cost(seconds)
+    log_request(
+        timestamp=datetime.utcnow(),
+        ip_address="",
+        api_key="system:warmup",
+        model=model,
+        prompt="",
+        response_text="",
+        prompt_tokens=0,
+        completion_tokens=0,
+        total_tokens=0,
+        duration_seconds=seconds,
+        power_wh=power_wh,
+        cost_dollars=cost_dollars,
+        http_status=http_status or 502,
+        error_message=f"{backend.url}: {error}" if error else None,
+        tokens_estimated=False,
+        ollama_metrics={"load_duration_ms": load_duration_ms},
+        cold_start=error is None
+    )
+
+def observe_request(path: str, model: str, http_status: int, duration_seconds: float, timer: RequestTimer):
+    """Record a finished request in the Prometheus metrics"""
+    path_label = path if path in METRIC_PATHS else "other"
+    REQUESTS_TOTAL.inc(path=path_label, status=http_status)
+    REQUEST_DURATION.observe(duration_seconds, path=path_label)
+    if timer.connected is not None:
+        UPSTREAM_CONNECT.observe(timer.connected - timer.start)
+    if timer.first_byte is not None:
+        FIRST_BYTE.observe(timer.first_byte - timer.start, model=model)
+    if timer.first_token is not None:
+        FIRST_TOKEN.observe(timer.first_token - timer.start, model=model)
+    for gap in timer.token_gaps:
+        INTER_TOKEN.observe(gap, model=model)
 
 def calculate_cost(duration_seconds: float) -> tuple[float, float]:
     """Calculate power consumption (Wh) and cost ($) based on duration"""
@@ -85,43 +453,50 @@ def calculate_cost(duration_seconds: float) -> tuple[float, float]:
     cost_dollars = power_kwh * ELECTRICITY_RATE
     return power_wh, cost_dollars
 
-def transform_ollama_to_openai_streaming(ollama_chunk: dict, model: str) -> dict:
-    """Transform Ollama streaming chunk to OpenAI format"""
-    import uuid
-    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
-
-    # Extract content from Ollama format
-    content = ""
-    finish_reason = None
+def parse_ollama_metrics(ollama_response) -> dict:
+    """Extract token counts and timings from a final Ollama response or done chunk
 
-    if "message" in ollama_chunk:
-        content = ollama_chunk["message"].get("content", "")
-    elif "response" in ollama_chunk:
-        content = ollama_chunk.get("response", "")
+    Ollama reports durations in nanoseconds; they are converted to
+    milliseconds. Returns an empty dict when the response carries no counts.
+    """
+    if not isinstance(ollama_response, dict):
+        return {}
+    if "eval_count" not in ollama_response and "prompt_eval_count" not in ollama_response:
+        return {}
 
-    if ollama_chunk.get("done", False):
-        finish_reason = "stop"
+    load_ns = ollama_response.get("load_duration") or 0
+    prompt_eval_ns = ollama_response.get("prompt_eval_duration") or 0
+    eval_ns = ollama_response.get("eval_duration") or 0
+    eval_count = ollama_response.get("eval_count")
 
-    # Build OpenAI streaming format
-    openai_chunk = {
-        "id": chunk_id,
-        "object": "chat.completion.chunk",
-        "created": int(time.time()),
-        "model": model,
-        "choices": [
-            {
-                "index": 0,
-                "delta": {"content": content} if content else {},
-                "finish_reason": finish_reason
-            }
-        ]
+    return {
+        # prompt_eval_count is omitted when Ollama reuses a cached prompt
+        "prompt_tokens": ollama_response.get("prompt_eval_count"),
+        "completion_tokens": eval_count,
+        "load_duration_ms": load_ns / 1e6,
+        "prompt_eval_duration_ms": prompt_eval_ns / 1e6,
+        "eval_duration_ms": eval_ns / 1e6,
+        # Model-side time to first token: load plus prompt processing
+        "time_to_first_token_ms": (load_ns + prompt_eval_ns) / 1e6,
+        "tokens_per_second": eval_count / (eval_ns / 1e9) if eval_count and eval_ns else None,
     }
 
-    return openai_chunk
+def resolve_token_counts(prompt: str, response_chars: int, metrics: dict) -> tuple[int, int, bool]:
+    """Use Ollama's token counts when present, else estimate (1 token ≈ 4 chars)
+
+    Returns (prompt_tokens, completion_tokens, estimated).
+    """
+    prompt_tokens = metrics.get("prompt_tokens")
+    completion_tokens = metrics.get("completion_tokens")
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = len(prompt) // 4
+    if completion_tokens is None:
+        completion_tokens = response_chars // 4
+    return prompt_tokens, completion_tokens, estimated
 
 def transform_ollama_to_openai_complete(ollama_response: dict, model: str, prompt_tokens: int, completion_tokens: int) -> dict:
     """Transform Ollama complete response to OpenAI format"""
-    import uuid
     completion_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
 
     # Extract content from Ollama format
@@ -156,6 +531,244 @@ def transform_ollama_to_openai_complete(ollama_response: dict, model: str, promp
 
     return openai_response
 
+def should_coalesce(body_json: dict) -> bool:
+    """Whether identical concurrent copies of this request may share one generation"""
+    if COALESCE_MODE == "all":
+        return True
+    if COALESCE_MODE == "deterministic":
+        return is_deterministic(body_json)
+    return False
+
+def parse_key_weights(spec: str) -> dict:
+    """Parse "key:weight,key:weight" into a dict of fair-share weights"""
+    weights = {}
+    for item in spec.split(","):
+        key, _, weight = item.strip().rpartition(":")
+        if key and weight:
+            weights[key] = float(weight)
+            if not weights[key] > 0:
+                raise ValueError(f"SCHEDULER_KEY_WEIGHTS: weight for {key!r} must be positive, got {weight}")
+    return weights
+
+class ClientDisconnected(Exception):
+    """The client went away before its response was ready"""
+
+async def wait_for_disconnect(request: Request):
+    # Once the body has been read, the next ASGI message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def until_disconnected(request: Request, awaitable):
+    """Await awaitable, but cancel it and raise ClientDisconnected if the client leaves first"""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task.done():
+        return task.result()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    raise ClientDisconnected()
+
+def model_is_loaded(model: str) -> bool:
+    """True if some backend has model loaded (requests without a model never need a swap)"""
+    return not model or any(model in backend.loaded_models for backend in backend_pool.backends)
+
+@asynccontextmanager
+async def upstream_slot(path: str, api_key: str, model: str = ""):
+    """Hold one scheduler slot for the duration of an upstream generation"""
+    if scheduler is None or path not in SCHEDULED_PATHS:
+        yield
+        return
+    waited = await scheduler.acquire(api_key or "anonymous", model)
+    QUEUE_WAIT.observe(waited)
+    held_from = time.monotonic()
+    try:
+        yield
+    finally:
+        scheduler.release(time.monotonic() - held_from)
+
+@asynccontextmanager
+async def routed_upstream(method: str, path: str, headers: dict, body: bytes, timer: RequestTimer, model: str = ""):
+    """Open a streaming upstream response on the best backend for model
+
+    Connection failures and 502/503 answers are retried on another backend,
+    but only until response headers have been handed to the caller.
+    """
+    tried = []
+    while True:
+        backend = backend_pool.pick(model, exclude=tried)
+        tried.append(backend)
+        last_try = len(tried) > UPSTREAM_RETRIES or len(tried) >= len(backend_pool)
+        BACKEND_REQUESTS.inc(backend=backend.url)
+
+        async with backend_pool.use(backend, model):
+            BACKEND_OUTSTANDING.set(backend.outstanding, backend=backend.url)
+            started = False
+            try:
+                async with upstream.stream(method, f"{backend.url}/{path}", headers, body, timer) as response:
+                    if response.status_code in RETRYABLE_STATUSES and not last_try:
+                        backend_pool.report_failure(backend, f"HTTP {response.status_code}")
+                        backend_pool.retries += 1
+                        timer.reset_upstream()
+                        continue
+                    started = True
+                    yield response
+            except RETRYABLE_ERRORS as e:
+                backend_pool.report_failure(backend, repr(e))
+                if started or last_try:
+                    raise
+                backend_pool.retries += 1
+                timer.reset_upstream()
+                continue
+            finally:
+                BACKEND_OUTSTANDING.set(backend.outstanding - 1, backend=backend.url)
+
+        backend_pool.report_success(backend)
+        return
+
+async def stream_upstream(flight: Flight, method: str, path: str, headers: dict, body: bytes,
+                          timer: RequestTimer, api_key: str, model: str):
+    """Run one streaming Ollama request and publish its chunks to every subscriber"""
+    async with upstream_slot(path, api_key, model):
+        async with routed_upstream(method, path, headers, body, timer, model) as response:
+            flight.start(response.status_code)
+
+            if response.status_code >= 400:
+                # Upstream errors aren't NDJSON token streams - pass them through as-is
+                async for chunk in response.aiter_bytes():
+                    flight.publish(chunk)
+            else:
+                # Frame complete NDJSON lines across chunk boundaries
+                async for ollama_chunk in aiter_ndjson(response.aiter_bytes()):
+                    flight.publish(ollama_chunk)
+
+async def send_embedding_batch(params: dict, texts: list, api_key: str):
+    """Embed one micro-batch with Ollama's /api/embed; returns (vectors, prompt_tokens, upstream seconds)"""
+    EMBED_BATCH_INPUTS.observe(len(texts))
+    body = dumps_bytes({**params, "input": texts})
+    timer = RequestTimer()
+    async with upstream_slot("api/embed", api_key, params["model"]):
+        started = time.perf_counter()
+        async with routed_upstream("POST", "api/embed", {"Content-Type": "application/json"}, body, timer,
+                                   params["model"]) as response:
+            await response.aread()
+        seconds = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise EmbeddingError(response.status_code, response.text[:1000])
+    data = response.json()
+    return data.get("embeddings") or [], data.get("prompt_eval_count") or 0, seconds
+
+async def forward_embeddings(body_json: dict, model: str, api_key: str, ip_address: str, timestamp: datetime,
+                             start_time: float, timer: RequestTimer, path: str) -> Response:
+    """Answer an OpenAI embeddings request through the batcher and log it as one row"""
+    texts = parse_inputs(body_json.get("input"))
+    if texts is None or not texts or len(texts) > EMBED_MAX_INPUTS:
+        message = f"input must be a string or a list of 1-{EMBED_MAX_INPUTS} strings"
+        return Response(
+            content=json.dumps({"error": {"message": message, "type": "invalid_request_error"}}),
+            status_code=400,
+            media_type="application/json"
+        )
+
+    # The inputs are the prompt; long indexing jobs are capped like responses
+    prompt_log = ResponseCollector(LOG_MAX_RESPONSE_CHARS)
+    prompt_log.append("\n".join(texts))
+    params = {name: body_json[name] for name in EMBED_PARAMS if body_json.get(name) is not None}
+
+    try:
+        results = await embedding_batcher.embed(params, texts, api_key)
+    except EmbeddingError as e:
+        duration_seconds = time.time() - start_time
+        log_request(
+            timestamp=timestamp,
+            ip_address=ip_address,
+            api_key=api_key,
+            model=model,
+            prompt=prompt_log.text(),
+            response_text="",
+            prompt_tokens=0,
+            completion_tokens=0,
+            total_tokens=0,
+            duration_seconds=duration_seconds,
+            power_wh=0.0,
+            cost_dollars=0.0,
+            http_status=e.status,
+            error_message=str(e),
+            timing=timer.phases()
+        )
+        observe_request(path, model, e.status, duration_seconds, timer)
+        return Response(content=json.dumps({"error": str(e)}), status_code=e.status, media_type="application/json")
+
+    # Charge this request its share of each batch's upstream time, nothing for cached vectors
+    duration_seconds = time.time() - start_time
+    prompt_tokens = round(sum(result.tokens for result in results))
+    power_wh, cost_dollars = calculate_cost(sum(result.seconds for result in results))
+    encoding_format = body_json.get("encoding_format", "float")
+
+    log_request(
+        timestamp=timestamp,
+        ip_address=ip_address,
+        api_key=api_key,
+        model=model,
+        prompt=prompt_log.text(),
+        response_text="",
+        prompt_tokens=prompt_tokens,
+        completion_tokens=0,
+        total_tokens=prompt_tokens,
+        duration_seconds=duration_seconds,
+        power_wh=power_wh,
+        cost_dollars=cost_dollars,
+        http_status=200,
+        response_chars=0,
+        tokens_estimated=False,
+        timing=timer.phases(),
+        cache_hit=all(result.cached for result in results)
+    )
+    observe_request(path, model, 200, duration_seconds, timer)
+
+    return Response(
+        content=dumps_bytes({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": index, "embedding": encode_vector(result.vector, encoding_format)}
+                for index, result in enumerate(results)
+            ],
+            "model": model,
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+        }),
+        media_type="application/json"
+    )
+
+def cached_response(entry, path: str, model: str, stream: bool) -> Response:
+    """Answer a request from a cache entry, as an OpenAI stream or completion"""
+    prompt_tokens, completion_tokens, _ = resolve_token_counts("", len(entry.content), entry.metrics)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+    chat = path == "api/chat"
+
+    if stream:
+        # Replay as a synthetic stream; the whole body is ready so send it in one go
+        transformer = OpenAIStreamTransformer(model)
+        chunks = replay_chunks(entry.content, chat)
+        lines = [transformer.transform(chunk) for chunk in chunks[:-1]]
+        lines.append(transformer.transform(chunks[-1], usage=usage))
+        return Response(content=b"".join(lines), media_type="application/json")
+
+    ollama_response = {"message": {"role": "assistant", "content": entry.content}} if chat else {"response": entry.content}
+    openai_response = transform_ollama_to_openai_complete(ollama_response, model, prompt_tokens, completion_tokens)
+    return Response(content=json.dumps(openai_response), media_type="application/json")
+
 def transform_models_response(ollama_models: dict) -> dict:
     """Transform Ollama models list to OpenAI format"""
     models_list = []
@@ -165,7 +778,7 @@ def transform_models_response(ollama_models: dict) -> dict:
             models_list.append({
                 "id": model.get("name", "unknown"),
                 "object": "model",
-                "created": int(time.time()),
+                "created": model_created(model),
                 "owned_by": "ollama"
             })
 
@@ -174,39 +787,230 @@ def transform_models_response(ollama_models: dict) -> dict:
         "data": models_list
     }
 
-@app.on_event("startup")
 async def startup():
-    """Initialize database connection and HTTP client on startup"""
-    global http_client
-    http_client = httpx.AsyncClient(timeout=300.0)
-    await get_db_pool()
-    print(f"Logger started - forwarding to {OLLAMA_URL}")
+    """Initialize this worker's database pool, log writer, response cache and HTTP client
+
+    Limits configured for the whole logger (connections, scheduler slots,
+    buffers, cache memory) are split across WEB_CONCURRENCY workers. Warm-up
+    and maintenance run only in the worker holding the leader lock.
+    """
+    global db_pool, upstream, backend_pool, model_warmer, model_catalog, embedding_batcher, maintenance, partition_maintenance, partition_loop
+    global log_writer, response_cache, scheduler, leader_lock, shared_metrics
+    leader_lock = LeaderLock(os.path.join(LOGGER_SHARED_DIR, "leader.lock"))
+    leader = leader_lock.acquire()
+    if WEB_CONCURRENCY > 1:
+        shared_metrics = SharedMetrics(metrics_registry, os.path.join(LOGGER_SHARED_DIR, "metrics"), METRICS_SYNC_INTERVAL)
+        shared_metrics.start()
+    upstream = UpstreamClient(
+        max_connections=worker_share(UPSTREAM_MAX_CONNECTIONS, WEB_CONCURRENCY),
+        max_keepalive=worker_share(UPSTREAM_MAX_KEEPALIVE, WEB_CONCURRENCY),
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout=UPSTREAM_READ_TIMEOUT,
+        write_timeout=UPSTREAM_WRITE_TIMEOUT,
+        pool_timeout=UPSTREAM_POOL_TIMEOUT,
+        http2=UPSTREAM_HTTP2,
+        pool_per_backend=UPSTREAM_POOL_PER_BACKEND,
+        pool_wait=UPSTREAM_POOL_WAIT,
+        connections=UPSTREAM_CONNECTIONS
+    )
+    backend_pool = BackendPool(
+        OLLAMA_URLS,
+        max_loaded_models=OLLAMA_MAX_LOADED_MODELS,
+        health_interval=BACKEND_HEALTH_INTERVAL,
+        eject_after=BACKEND_EJECT_AFTER,
+        eject_seconds=BACKEND_EJECT_SECONDS
+    )
+    backend_pool.start()
+    log_settings = dict(
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        max_buffer=worker_share(LOG_BUFFER_SIZE, WEB_CONCURRENCY)
+    )
+    if LOG_SINK == "memory":
+        # No database at all: rows are buffered and batched as usual, then kept in memory
+        log_writer = MemoryLogWriter("request_logs", LOG_COLUMNS, **log_settings)
+    elif LOG_SINK == "postgres":
+        db_pool = await create_db_pool()
+        log_writer = LogWriter(
+            db_pool,
+            "request_logs",
+            LOG_COLUMNS,
+            body_table="request_bodies",
+            notify_channel="request_logs",
+            **log_settings
+        )
+        await log_writer.check_schema()
+    else:
+        raise ValueError(f"Unknown LOG_SINK: {LOG_SINK}")
+    log_writer.start()
+    if db_pool is not None:
+        maintenance = MaintenanceLoop(db_pool, MAINTENANCE_JOBS, interval=MAINTENANCE_INTERVAL)
+        partition_maintenance = PartitionMaintenance(
+            months_ahead=PARTITION_MONTHS_AHEAD,
+            retention_months=LOG_RETENTION_MONTHS,
+            action=LOG_RETENTION_ACTION,
+            archive_dir=LOG_ARCHIVE_DIR
+        )
+        partition_loop = MaintenanceLoop(db_pool, [("request_log_partitions", partition_maintenance)], interval=PARTITION_INTERVAL)
+        if leader:
+            maintenance.start()
+            partition_loop.start()
+    if RESPONSE_CACHE_ENABLED:
+        response_cache = ResponseCache(
+            ttl_seconds=RESPONSE_CACHE_TTL,
+            max_bytes=int(worker_share(RESPONSE_CACHE_MAX_MB, WEB_CONCURRENCY) * 1024 * 1024),
+            backend=PostgresCacheTier(db_pool) if RESPONSE_CACHE_POSTGRES and db_pool else None
+        )
+    if UPSTREAM_CONCURRENCY > 0:
+        # Slots scale with the pool: each backend runs UPSTREAM_CONCURRENCY requests,
+        # shared out between the workers. Queue caps stay per worker, since
+        # connections are not spread perfectly evenly.
+        scheduler = FairScheduler(
+            worker_share(UPSTREAM_CONCURRENCY * len(backend_pool), WEB_CONCURRENCY),
+            max_queue=SCHEDULER_MAX_QUEUE,
+            max_queue_per_key=SCHEDULER_MAX_QUEUE_PER_KEY,
+            queue_timeout=SCHEDULER_QUEUE_TIMEOUT,
+            weights=parse_key_weights(SCHEDULER_KEY_WEIGHTS),
+            is_warm=model_is_loaded if SCHEDULER_MODEL_AFFINITY else None
+        )
+    model_warmer = ModelWarmer(
+        backend_pool,
+        upstream,
+        WARMUP_MODELS,
+        keep_alive=MODEL_KEEP_ALIVE,
+        interval=WARMUP_INTERVAL,
+        max_loaded_models=OLLAMA_MAX_LOADED_MODELS,
+        on_load=log_model_load
+    )
+    if leader:
+        model_warmer.start()
+    if MODEL_CATALOG_INTERVAL > 0:
+        model_catalog = ModelCatalog(backend_pool, upstream, interval=MODEL_CATALOG_INTERVAL)
+        model_catalog.start()
+    embedding_batcher = EmbeddingBatcher(
+        send_embedding_batch,
+        max_batch=EMBED_BATCH_SIZE,
+        window=EMBED_BATCH_WINDOW_MS / 1000,
+        cache=VectorCache(int(worker_share(EMBED_CACHE_MAX_MB, WEB_CONCURRENCY) * 1024 * 1024)) if EMBED_CACHE_MAX_MB > 0 else None
+    )
+    print(f"Logger worker {os.getpid()} started{' (leader)' if leader else ''} - forwarding to {', '.join(OLLAMA_URLS)}")
     print(f"Electricity rate: ${ELECTRICITY_RATE}/kWh (San Diego SDG&E)")
     print(f"M4 Max power consumption: {M4_MAX_POWER_WATTS}W during inference")
 
-@app.on_event("shutdown")
 async def shutdown():
-    """Close database connection and HTTP client on shutdown"""
-    global db_pool, http_client
-    if http_client:
-        await http_client.aclose()
+    """Drain buffered logs, then close HTTP client and database connection on shutdown"""
+    global db_pool, upstream, backend_pool, model_warmer, model_catalog, maintenance, partition_loop, log_writer
+    global leader_lock, shared_metrics
+    if partition_loop:
+        await partition_loop.stop()
+    if maintenance:
+        await maintenance.stop()
+    if model_catalog:
+        await model_catalog.stop()
+    if model_warmer:
+        await model_warmer.stop()
+    if backend_pool:
+        await backend_pool.stop()
+    if upstream:
+        await upstream.aclose()
+    if log_writer:
+        await log_writer.stop()
+        print(f"Log writer drained: {log_writer.stats()}")
+        log_writer = None
     if db_pool:
         await db_pool.close()
+        db_pool = None
+    if shared_metrics:
+        await shared_metrics.stop()
+        shared_metrics = None
+    if leader_lock:
+        leader_lock.release()
+        leader_lock = None
 
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "ollama-logger"}
+    return {
+        "status": "healthy",
+        "service": "ollama-logger",
+        "worker": {
+            "pid": os.getpid(),
+            "workers": WEB_CONCURRENCY,
+            "leader": leader_lock.held if leader_lock else False
+        },
+        "log_writer": log_writer.stats() if log_writer else None,
+        "backends": backend_pool.stats() if backend_pool else None,
+        "warmup": model_warmer.stats() if model_warmer else None,
+        "models": model_catalog.stats() if model_catalog else None,
+        "embeddings": embedding_batcher.stats() if embedding_batcher else None,
+        "maintenance": maintenance.stats() if maintenance else None,
+        "partitions": dict(partition_maintenance.stats(), **partition_loop.stats()) if partition_loop else None
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: latency histograms, in-flight gauges and log writer counters, combined over all workers"""
+    body = shared_metrics.render() if shared_metrics else metrics_registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy(request: Request, path: str):
     """Proxy all requests to Ollama and log everything"""
+    REQUESTS_IN_FLIGHT.inc()
+    response = None
+    try:
+        response = await forward_request(request, path)
+        return response
+    finally:
+        # Streaming responses release their in-flight slot when the stream ends
+        if not isinstance(response, StreamingResponse):
+            REQUESTS_IN_FLIGHT.dec()
+
+def serve_model_catalog(request: Request, timestamp: datetime, ip_address: str, api_key: str) -> Response:
+    """/v1/models from model_catalog, 304 if the client's ETag is current"""
+    started = time.perf_counter()
+    headers = {"ETag": model_catalog.etag, "Cache-Control": "no-cache"}
+    if model_catalog.matches(request.headers.get("if-none-match", "")):
+        model_catalog.not_modified += 1
+        response = Response(status_code=304, headers=headers)
+    else:
+        model_catalog.served += 1
+        response = Response(content=model_catalog.body, media_type="application/json", headers=headers)
+    duration_seconds = time.perf_counter() - started
+    observe_request("api/tags", "", response.status_code, duration_seconds, RequestTimer())
+    if LOG_MODEL_LISTING:
+        log_request(
+            timestamp=timestamp,
+            ip_address=ip_address,
+            api_key=api_key,
+            model="",
+            prompt="",
+            response_text="",
+            prompt_tokens=0,
+            completion_tokens=0,
+            total_tokens=0,
+            duration_seconds=duration_seconds,
+            power_wh=0.0,
+            cost_dollars=0.0,
+            http_status=response.status_code,
+            tokens_estimated=False,
+            cache_hit=True
+        )
+    return response
+
+async def forward_request(request: Request, path: str):
+    """Forward one request to Ollama, transform the response and queue its log row"""
 
     # Get request details
     timestamp = datetime.utcnow()
     ip_address = request.client.host
     api_key = request.headers.get("Authorization", "").replace("Bearer ", "")
 
+    # Model listings are answered from memory: no upstream call, no log row by default
+    if path == "api/tags" and request.method == "GET" and model_catalog is not None and model_catalog.ready:
+        return serve_model_catalog(request, timestamp, ip_address, api_key)
+
     # Read request body
     body = await request.body()
     body_json = {}
@@ -223,104 +1027,216 @@ async def proxy(request: Request, path: str):
                 # Chat completion format
                 messages = body_json["messages"]
                 if messages and isinstance(messages, list):
-                    prompt = messages[-1].get("content", "")
+                    prompt = message_text(messages[-1].get("content", ""))
             elif "prompt" in body_json:
                 # Completion format
-                prompt = body_json["prompt"]
+                prompt = message_text(body_json["prompt"])
     except:
         pass
 
     # Start timing
     start_time = time.time()
-
-    # Forward request to Ollama
-    url = f"{OLLAMA_URL}/{path}"
+    timer = RequestTimer()
 
     try:
+        # OpenAI-style embeddings (`input` string or array) are batched into /api/embed
+        if (embedding_batcher is not None and path == "api/embeddings" and request.method == "POST"
+                and "input" in body_json):
+            return await forward_embeddings(body_json, model, api_key, ip_address, timestamp, start_time, timer, path)
+
         # Check if streaming is enabled (GET requests are never streaming)
         is_streaming = body_json.get("stream", True) if body_json and request.method == "POST" else False
 
+        # Serve repeated deterministic completions from the response cache
+        cache_key = None
+        if (response_cache is not None and request.method == "POST" and path in CACHEABLE_PATHS
+                and body_json and is_deterministic(body_json)):
+            cache_key = request_key(path, body_json)
+            entry = await response_cache.get(cache_key)
+            if entry is not None:
+                cached = cached_response(entry, path, model, is_streaming)
+                duration_seconds = time.time() - start_time
+                prompt_tokens, completion_tokens, tokens_estimated = resolve_token_counts(
+                    prompt, len(entry.content), entry.metrics
+                )
+                collector = ResponseCollector(LOG_MAX_RESPONSE_CHARS)
+                collector.append(entry.content)
+
+                # No inference ran, so no power or cost is charged
+                log_request(
+                    timestamp=timestamp,
+                    ip_address=ip_address,
+                    api_key=api_key,
+                    model=model,
+                    prompt=prompt,
+                    response_text=collector.text(),
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    total_tokens=prompt_tokens + completion_tokens,
+                    duration_seconds=duration_seconds,
+                    power_wh=0.0,
+                    cost_dollars=0.0,
+                    http_status=200,
+                    response_chars=collector.total_chars,
+                    response_truncated=collector.truncated,
+                    tokens_estimated=tokens_estimated,
+                    cache_hit=True
+                )
+                observe_request(path, model, 200, duration_seconds, timer)
+                return cached
+
+        # Identical concurrent requests share one upstream generation
+        flight_key = None
+        if request.method == "POST" and path in CACHEABLE_PATHS and body_json and should_coalesce(body_json):
+            flight_key = f"{'stream' if is_streaming else 'block'}:{request_key(path, body_json)}"
+        headers = filter_request_headers(request.headers)
+
         if is_streaming:
             # Handle streaming response
-            async def stream_and_collect():
-                full_response = ""
-                response_status = 200
-
-                async with http_client.stream(
-                    method=request.method,
-                    url=url,
-                    headers=dict(request.headers),
-                    content=body
-                ) as response:
-                    response_status = response.status_code
-
-                    async for chunk in response.aiter_bytes():
-                        # Collect response text and transform to OpenAI format
-                        try:
-                            chunk_str = chunk.decode('utf-8')
-                            for line in chunk_str.split('\n'):
-                                if line.strip():
-                                    ollama_chunk = json.loads(line)
-
-                                    # Collect content for logging
-                                    if "message" in ollama_chunk:
-                                        full_response += ollama_chunk["message"].get("content", "")
-                                    elif "response" in ollama_chunk:
-                                        full_response += ollama_chunk.get("response", "")
-
-                                    # Transform to OpenAI format
-                                    openai_chunk = transform_ollama_to_openai_streaming(ollama_chunk, model)
-                                    transformed_line = json.dumps(openai_chunk) + "\n"
-                                    yield transformed_line.encode('utf-8')
-                        except Exception as e:
-                            # If transformation fails, pass through original chunk
-                            print(f"Chunk transformation error: {e}")
-                            yield chunk
-
-                # Calculate metrics
+            flight, coalesced = single_flight.stream(
+                flight_key,
+                lambda flight: stream_upstream(flight, request.method, path, headers, body, timer, api_key, model)
+            )
+
+            # Wait for a scheduler slot and the upstream headers before answering;
+            # a client that leaves meanwhile gives up its share of the flight
+            try:
+                await until_disconnected(request, flight.wait_started())
+                if flight.status is None and flight.error is not None:
+                    raise flight.error
+            except BaseException:
+                flight.release()
+                raise
+
+            STREAMS_IN_FLIGHT.inc()
+            collector = ResponseCollector(LOG_MAX_RESPONSE_CHARS)
+            stream_metrics = {}
+            finished = False
+
+            def finish_stream(http_status: int, error_message: Optional[str] = None, cancelled: bool = False):
+                """Release the flight and log the stream exactly once, however it ended"""
+                nonlocal finished
+                if finished:
+                    return
+                finished = True
+                flight.release()
+                STREAMS_IN_FLIGHT.dec()
+                REQUESTS_IN_FLIGHT.dec()
+                if cancelled:
+                    REQUESTS_CANCELLED.inc(stage="streaming")
+
+                # Calculate metrics; coalesced followers didn't cost any extra inference
                 end_time = time.time()
                 duration_seconds = end_time - start_time
-                power_wh, cost_dollars = calculate_cost(duration_seconds)
+                power_wh, cost_dollars = (0.0, 0.0) if coalesced else calculate_cost(duration_seconds)
 
-                # Estimate tokens (rough approximation: 1 token ≈ 4 chars)
-                prompt_tokens = len(prompt) // 4
-                completion_tokens = len(full_response) // 4
+                # Token counts from Ollama's done chunk, estimated if it never arrived
+                prompt_tokens, completion_tokens, tokens_estimated = resolve_token_counts(
+                    prompt, collector.total_chars, stream_metrics
+                )
                 total_tokens = prompt_tokens + completion_tokens
 
-                # Log to database
-                asyncio.create_task(log_request(
+                # Cache complete answers (done chunk seen, nothing cut by the log cap)
+                if (cache_key and not coalesced and http_status == 200
+                        and stream_metrics and not collector.truncated):
+                    response_cache.put(cache_key, model, collector.text(), stream_metrics)
+
+                # Queue log row for the background writer
+                log_request(
                     timestamp=timestamp,
                     ip_address=ip_address,
                     api_key=api_key,
                     model=model,
                     prompt=prompt,
-                    response_text=full_response,
+                    response_text=collector.text(),
                     prompt_tokens=prompt_tokens,
                     completion_tokens=completion_tokens,
                     total_tokens=total_tokens,
                     duration_seconds=duration_seconds,
                     power_wh=power_wh,
                     cost_dollars=cost_dollars,
-                    http_status=response_status
-                ))
+                    http_status=http_status,
+                    error_message=error_message,
+                    response_chars=collector.total_chars,
+                    response_truncated=collector.truncated,
+                    tokens_estimated=tokens_estimated,
+                    ollama_metrics=stream_metrics,
+                    timing=timer.phases(),
+                    coalesced=coalesced,
+                    cancelled=cancelled
+                )
+                observe_request(path, model, http_status, duration_seconds, timer)
+
+            async def stream_and_collect():
+                # One transformer per client: id, created and envelope are built once
+                transformer = OpenAIStreamTransformer(model)
+                try:
+                    async for item in flight.subscribe():
+                        if isinstance(item, bytes):
+                            # Upstream error body, passed through as-is
+                            collector.append(item.decode("utf-8", errors="replace"))
+                            yield item
+                            continue
+
+                        # Collect content for logging
+                        content = ""
+                        if "message" in item:
+                            content = item["message"].get("content", "")
+                        elif "response" in item:
+                            content = item.get("response", "")
+                        if content:
+                            timer.mark_token()
+                            collector.append(content)
+
+                        # Transform to OpenAI format; the done chunk carries real token counts
+                        if item.get("done", False):
+                            stream_metrics.update(parse_ollama_metrics(item))
+                            prompt_tokens, completion_tokens, _ = resolve_token_counts(
+                                prompt, collector.total_chars, stream_metrics
+                            )
+                            yield transformer.transform(item, usage={
+                                "prompt_tokens": prompt_tokens,
+                                "completion_tokens": completion_tokens,
+                                "total_tokens": prompt_tokens + completion_tokens
+                            })
+                        else:
+                            yield transformer.transform(item)
+                except (asyncio.CancelledError, GeneratorExit):
+                    # The client disconnected mid-stream: log what it got and stop the generation
+                    finish_stream(499, "client disconnected", cancelled=True)
+                    raise
+                except Exception as e:
+                    error_status, error_kind = classify_error(e)
+                    UPSTREAM_ERRORS.inc(kind=error_kind)
+                    finish_stream(error_status, f"{error_kind}: {e}")
+                    raise
+                finish_stream(flight.status or 200)
+
+            async def finish_unstarted_stream():
+                # Runs after the response either way; only matters if the client left
+                # before the first chunk, when the generator never ran at all
+                finish_stream(499, "client disconnected", cancelled=True)
 
             return StreamingResponse(
                 stream_and_collect(),
-                media_type="application/json"
+                status_code=flight.status,
+                media_type="application/json",
+                background=BackgroundTask(finish_unstarted_stream)
             )
 
         else:
             # Handle non-streaming response
-            response = await http_client.request(
-                method=request.method,
-                url=url,
-                headers=dict(request.headers),
-                content=body
-            )
+            async def fetch():
+                async with upstream_slot(path, api_key, model):
+                    async with routed_upstream(request.method, path, headers, body, timer, model) as upstream_response:
+                        await upstream_response.aread()
+                        return upstream_response
+
+            response, coalesced = await until_disconnected(request, single_flight.call(flight_key, fetch))
 
             end_time = time.time()
             duration_seconds = end_time - start_time
-            power_wh, cost_dollars = calculate_cost(duration_seconds)
+            power_wh, cost_dollars = (0.0, 0.0) if coalesced else calculate_cost(duration_seconds)
 
             # Parse response
             response_json = {}
@@ -334,27 +1250,43 @@ async def proxy(request: Request, path: str):
             except:
                 pass
 
-            # Estimate tokens
-            prompt_tokens = len(prompt) // 4
-            completion_tokens = len(response_text) // 4
+            # Token counts reported by Ollama, estimated for other endpoints
+            metrics = parse_ollama_metrics(response_json)
+            prompt_tokens, completion_tokens, tokens_estimated = resolve_token_counts(
+                prompt, len(response_text), metrics
+            )
             total_tokens = prompt_tokens + completion_tokens
 
-            # Log to database
-            await log_request(
+            # Cap the copy of the response kept for logging
+            collector = ResponseCollector(LOG_MAX_RESPONSE_CHARS)
+            collector.append(response_text)
+
+            if cache_key and not coalesced and response.status_code == 200 and metrics:
+                response_cache.put(cache_key, model, response_text, metrics)
+
+            # Queue log row for the background writer
+            log_request(
                 timestamp=timestamp,
                 ip_address=ip_address,
                 api_key=api_key,
                 model=model,
                 prompt=prompt,
-                response_text=response_text,
+                response_text=collector.text(),
                 prompt_tokens=prompt_tokens,
                 completion_tokens=completion_tokens,
                 total_tokens=total_tokens,
                 duration_seconds=duration_seconds,
                 power_wh=power_wh,
                 cost_dollars=cost_dollars,
-                http_status=response.status_code
+                http_status=response.status_code,
+                response_chars=collector.total_chars,
+                response_truncated=collector.truncated,
+                tokens_estimated=tokens_estimated,
+                ollama_metrics=metrics,
+                timing=timer.phases(),
+                coalesced=coalesced
             )
+            observe_request(path, model, response.status_code, duration_seconds, timer)
 
             # Transform to OpenAI format based on endpoint
             if path in ["api/chat", "api/generate"]:
@@ -385,16 +1317,75 @@ async def proxy(request: Request, path: str):
             return Response(
                 content=response.content,
                 status_code=response.status_code,
-                headers=dict(response.headers)
+                headers=filter_response_headers(response.headers)
             )
 
+    except ClientDisconnected:
+        # Nobody is left to answer; the upstream call was cancelled and its slot freed
+        REQUESTS_CANCELLED.inc(stage="waiting")
+        duration_seconds = time.time() - start_time
+        # Charge inference only if the request had reached Ollama
+        power_wh, cost_dollars = calculate_cost(duration_seconds) if timer.connected is not None else (0.0, 0.0)
+        log_request(
+            timestamp=timestamp,
+            ip_address=ip_address,
+            api_key=api_key,
+            model=model,
+            prompt=prompt,
+            response_text="",
+            prompt_tokens=0,
+            completion_tokens=0,
+            total_tokens=0,
+            duration_seconds=duration_seconds,
+            power_wh=power_wh,
+            cost_dollars=cost_dollars,
+            http_status=499,
+            error_message="client disconnected before the response started",
+            timing=timer.phases(),
+            cancelled=True
+        )
+        observe_request(path, model, 499, duration_seconds, timer)
+        return Response(status_code=499)
+
+    except QueueFull as e:
+        # Shed load quickly instead of letting requests pile up inside Ollama
+        duration_seconds = time.time() - start_time
+        log_request(
+            timestamp=timestamp,
+            ip_address=ip_address,
+            api_key=api_key,
+            model=model,
+            prompt=prompt,
+            response_text="",
+            prompt_tokens=0,
+            completion_tokens=0,
+            total_tokens=0,
+            duration_seconds=duration_seconds,
+            power_wh=0.0,
+            cost_dollars=0.0,
+            http_status=429,
+            error_message=str(e),
+            timing=timer.phases()
+        )
+        observe_request(path, model, 429, duration_seconds, timer)
+
+        return Response(
+            content=json.dumps({"error": {"message": str(e), "type": "rate_limit_error", "code": "queue_full"}}),
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            media_type="application/json"
+        )
+
     except Exception as e:
-        # Log error
+        # Log error; pool and connection failures get their own status instead of a generic 500
         end_time = time.time()
         duration_seconds = end_time - start_time
         power_wh, cost_dollars = calculate_cost(duration_seconds)
+        error_status, error_kind = classify_error(e)
+        UPSTREAM_ERRORS.inc(kind=error_kind)
+        error_message = f"{error_kind}: {e}" if error_kind != "internal" else str(e)
 
-        await log_request(
+        log_request(
             timestamp=timestamp,
             ip_address=ip_address,
             api_key=api_key,
@@ -407,12 +1398,14 @@ async def proxy(request: Request, path: str):
             duration_seconds=duration_seconds,
             power_wh=power_wh,
             cost_dollars=cost_dollars,
-            http_status=500,
-            error_message=str(e)
+            http_status=error_status,
+            error_message=error_message,
+            timing=timer.phases()
         )
+        observe_request(path, model, error_status, duration_seconds, timer)
 
         return Response(
-            content=json.dumps({"error": str(e)}),
-            status_code=500,
+            content=json.dumps({"error": error_message}),
+            status_code=error_status,
             media_type="application/json"
         )
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Collection, List, Optional, Set
+
+import httpx
+
+# Failures that happen before Ollama has sent anything back, so the request can
+# safely be tried again on another backend
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+# Upstream statuses worth retrying elsewhere: Ollama answers 503 when its own queue is full
+RETRYABLE_STATUSES = {502, 503}
+
+
+class Backend:
+    """One Ollama server and what the router knows about it"""
+
+    def __init__(self, url: str, max_loaded_models: int = 1):
+        self.url = url.rstrip("/")
+        self.max_loaded_models = max_loaded_models
+        self.outstanding = 0
+        self.loaded_models: Set[str] = set()
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and self.ejected_until <= now
+
+    def note_model(self, model: str):
+        """Remember that model is (about to be) loaded here"""
+        if not model or model in self.loaded_models:
+            return
+        if len(self.loaded_models) >= self.max_loaded_models:
+            # Ollama evicts a loaded model to make room; we can't know which, so forget them all
+            self.loaded_models.clear()
+        self.loaded_models.add(model)
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected": self.ejected_until > time.monotonic(),
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded_models),
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class BackendPool:
+    """Routes requests across several Ollama servers
+
+    A request for a model goes to the least busy backend that already has the
+    model loaded; if none has it, to the least busy backend overall (an idle
+    backend is preferred so a busy one doesn't have to swap its model out).
+    A background task polls /api/ps on every backend to learn which models are
+    loaded and to mark unreachable ones unhealthy. Backends that fail
+    eject_after times in a row are ejected for eject_seconds.
+    """
+
+    def __init__(self, urls: List[str], max_loaded_models: int = 1, health_interval: float = 10.0,
+                 health_timeout: float = 2.0, eject_after: int = 2, eject_seconds: float = 30.0):
+        self.backends = [Backend(url, max_loaded_models) for url in urls]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._next = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.retries = 0
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def start(self):
+        if len(self.backends) > 1 and self.health_interval > 0:
+            self._client = httpx.AsyncClient(timeout=self.health_timeout)
+            self._task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def pick(self, model: str = "", exclude: Collection[Backend] = ()) -> Optional[Backend]:
+        """Choose a backend for model, or None if every candidate has been excluded"""
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        # With every backend down, still try one rather than failing outright
+        candidates = [b for b in candidates if b.available(now)] or candidates
+
+        if model:
+            warm = [b for b in candidates if model in b.loaded_models]
+            if warm:
+                candidates = warm
+
+        # Least outstanding requests; rotate the starting point so ties spread out
+        self._next = (self._next + 1) % len(self.backends)
+        order = self.backends[self._next:] + self.backends[:self._next]
+        return min(candidates, key=lambda b: (b.outstanding, order.index(b)))
+
+    @asynccontextmanager
+    async def use(self, backend: Backend, model: str = "") -> AsyncIterator[Backend]:
+        """Count a request as outstanding on backend while it runs"""
+        backend.outstanding += 1
+        backend.requests += 1
+        backend.note_model(model)
+        try:
+            yield backend
+        finally:
+            backend.outstanding -= 1
+
+    def report_success(self, backend: Backend):
+        backend.consecutive_failures = 0
+
+    def report_failure(self, backend: Backend, reason: str = ""):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.eject_after and backend.ejected_until <= time.monotonic():
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            backend.ejections += 1
+            print(f"Ejected Ollama backend {backend.url} for {self.eject_seconds:.0f}s: {reason}")
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(backend) for backend in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    async def _check(self, backend: Backend):
+        """Poll /api/ps: proves the backend is up and tells us what it has loaded"""
+        try:
+            response = await self._client.get(f"{backend.url}/api/ps")
+            response.raise_for_status()
+            models = response.json().get("models") or []
+        except Exception as e:
+            if backend.healthy:
+                print(f"Ollama backend {backend.url} failed health check: {e!r}")
+            backend.healthy = False
+            return
+
+        if not backend.healthy:
+            print(f"Ollama backend {backend.url} is healthy again")
+        backend.healthy = True
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+        backend.loaded_models = {m.get("name") or m.get("model") for m in models if isinstance(m, dict)}
+        backend.loaded_models.discard(None)
+
+    def stats(self) -> List[dict]:
+        return [backend.stats() for backend in self.backends]
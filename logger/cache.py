@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import asyncpg
+
+# Request fields that don't change what the model generates
+NON_SEMANTIC_FIELDS = {"stream", "keep_alive"}
+
+# Endpoints whose answers can be cached
+CACHEABLE_PATHS = {"api/chat", "api/generate"}
+
+
+def is_deterministic(body_json: dict) -> bool:
+    """True when the request asks for reproducible output (temperature 0 or a fixed seed)"""
+    options = body_json.get("options") or {}
+    if not isinstance(options, dict):
+        return False
+    temperature = options.get("temperature", body_json.get("temperature"))
+    seed = options.get("seed", body_json.get("seed"))
+    return temperature == 0 or seed is not None
+
+
+def request_key(path: str, body_json: dict) -> str:
+    """Canonical hash of everything in a request that affects the generated answer"""
+    semantic = {k: v for k, v in body_json.items() if k not in NON_SEMANTIC_FIELDS}
+    canonical = json.dumps([path, semantic], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    """A cached completion: the answer text plus the Ollama metrics it was generated with"""
+
+    __slots__ = ("content", "metrics", "expires_at", "size")
+
+    def __init__(self, content: str, metrics: dict, expires_at: float):
+        self.content = content
+        self.metrics = metrics
+        self.expires_at = expires_at
+        self.size = sys.getsizeof(content) + 256
+
+
+class ResponseCache:
+    """In-memory LRU response cache with a TTL and a memory budget
+
+    An optional PostgreSQL tier (PostgresCacheTier) is consulted on a memory
+    miss and written behind on every store, so cached answers survive
+    restarts and are shared between logger processes.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_bytes: int = 64 * 1024 * 1024,
+                 max_entry_bytes: int = 1024 * 1024, backend: Optional["PostgresCacheTier"] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.backend = backend
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """Look up a key in memory, then in the PostgreSQL tier"""
+        entry = self._get_local(key)
+        if entry is None and self.backend is not None:
+            entry = await self.backend.get(key)
+            if entry is not None:
+                self._put_local(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, model: str, content: str, metrics: dict):
+        """Store a completed answer"""
+        entry = CacheEntry(content, metrics, time.time() + self.ttl_seconds)
+        if entry.size > self.max_entry_bytes:
+            return
+        self._put_local(key, entry)
+        if self.backend is not None:
+            self.backend.put(key, model, entry)
+
+    def _get_local(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key: str, entry: CacheEntry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class PostgresCacheTier:
+    """Shared second cache tier stored in the response_cache table"""
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self._pending = set()
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow('''
+                    SELECT content, metrics, EXTRACT(EPOCH FROM expires_at) AS expires_at
+                    FROM response_cache
+                    WHERE cache_key = $1 AND expires_at > NOW()
+                ''', key)
+        except Exception as e:
+            print(f"Response cache lookup failed: {e}")
+            return None
+        if row is None:
+            return None
+        return CacheEntry(row["content"], json.loads(row["metrics"] or "{}"), float(row["expires_at"]))
+
+    def put(self, key: str, model: str, entry: CacheEntry):
+        """Write behind in a background task; the response never waits on it"""
+        task = asyncio.create_task(self._write(key, model, entry))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _write(self, key: str, model: str, entry: CacheEntry):
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO response_cache (cache_key, model, content, metrics, expires_at)
+                    VALUES ($1, $2, $3, $4, TO_TIMESTAMP($5))
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET content = EXCLUDED.content,
+                        metrics = EXCLUDED.metrics,
+                        expires_at = EXCLUDED.expires_at
+                ''', key, model, entry.content, json.dumps(entry.metrics), entry.expires_at)
+        except Exception as e:
+            print(f"Response cache write failed: {e}")
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from backends import BackendPool
+from upstream import UpstreamClient
+
+
+def model_created(model: dict) -> int:
+    """Unix time from Ollama's modified_at (0 if missing), so the list is stable between calls"""
+    value = model.get("modified_at")
+    if not value:
+        return 0
+    try:
+        # Ollama reports nanoseconds; fromisoformat takes at most microseconds
+        head, dot, rest = value.partition(".")
+        if dot:
+            digits = "".join(c for c in rest if c.isdigit())
+            value = f"{head}.{digits[:6]}{rest[len(digits):]}"
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return 0
+
+
+class ModelCatalog:
+    """In-memory model list, refreshed from the backends in the background
+
+    Every `interval` seconds each available backend is asked for /api/tags
+    (installed models) and /api/ps (loaded models); the union is rendered
+    once as an OpenAI model list with an ETag. GET /v1/models is then
+    answered from memory, with 304 when the client's copy is current, instead
+    of going to Ollama each time. If every backend fails, the last good list
+    is kept.
+    """
+
+    def __init__(self, backend_pool: BackendPool, client: UpstreamClient, interval: float = 30.0):
+        self.backend_pool = backend_pool
+        self.client = client
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.models: List[dict] = []
+        self.loaded: Set[str] = set()
+        self.updated_at: Optional[float] = None
+
+        self.refreshes = 0
+        self.failures = 0
+        self.served = 0
+        self.not_modified = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.body is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def _get(self, url: str) -> dict:
+        response = await self.client.request("GET", url, {}, None)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+        return response.json()
+
+    async def refresh(self):
+        """Rebuild the list from every available backend"""
+        now = time.monotonic()
+        backends = [b for b in self.backend_pool.backends if b.available(now)] or self.backend_pool.backends
+        results = await asyncio.gather(
+            *(self._get(f"{backend.url}/api/tags") for backend in backends),
+            *(self._get(f"{backend.url}/api/ps") for backend in backends),
+            return_exceptions=True
+        )
+        tags, ps = results[:len(backends)], results[len(backends):]
+
+        models: Dict[str, dict] = {}
+        ok = False
+        for result in tags:
+            if isinstance(result, BaseException):
+                continue
+            ok = True
+            for model in result.get("models") or []:
+                name = model.get("name") or model.get("model")
+                if name and name not in models:
+                    models[name] = model
+        if not ok:
+            self.failures += 1
+            print(f"Model catalog refresh failed: {next(r for r in tags if isinstance(r, BaseException))}")
+            return
+
+        loaded = set()
+        for result in ps:
+            if not isinstance(result, BaseException):
+                loaded.update(m.get("name") or m.get("model") for m in result.get("models") or [])
+        loaded.discard(None)
+
+        self.models = [models[name] for name in sorted(models)]
+        self.loaded = loaded
+        self.refreshes += 1
+        self.updated_at = time.time()
+
+        body = json.dumps({
+            "object": "list",
+            "data": [
+                {
+                    "id": name,
+                    "object": "model",
+                    "created": model_created(models[name]),
+                    "owned_by": "ollama",
+                    "loaded": name in loaded
+                }
+                for name in sorted(models)
+            ]
+        }).encode()
+        if body != self.body:
+            self.body = body
+            self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """True if an If-None-Match header names the current list"""
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return self.etag in tags or "*" in tags
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self.models),
+            "loaded": sorted(self.loaded),
+            "etag": self.etag,
+            "age_seconds": round(time.time() - self.updated_at, 1) if self.updated_at else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "served": self.served,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class Flight:
+    """One upstream generation whose chunks can be read by several clients
+
+    The producer publishes items (parsed Ollama chunks, or raw bytes for
+    upstream errors) in order. Every subscriber reads the full sequence from
+    the start, so a client that joins late still receives the whole answer.
+
+    Each client that joins holds a reference and must release() it. When the
+    last client lets go before the flight is done, the producer task is
+    cancelled, which closes the upstream stream and frees its slot.
+    """
+
+    def __init__(self, key: Optional[str] = None):
+        self.key = key
+        self.items: List[Any] = []
+        self.status: Optional[int] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.clients = 0
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        self._started = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def start(self, status: int):
+        """Record the upstream status once response headers are in"""
+        self.status = status
+        self._started.set()
+
+    async def wait_started(self):
+        """Wait until the upstream response has started or the flight has failed"""
+        await self._started.wait()
+
+    def publish(self, item):
+        self.items.append(item)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._started.set()
+        self._wake()
+
+    def release(self):
+        """Drop one client's interest; cancels the generation when nobody is left"""
+        self.clients -= 1
+        if self.clients <= 0 and not self.done and self.task is not None:
+            self.cancelled = True
+            self.task.cancel()
+
+    def _wake(self):
+        # Wake everyone waiting on the current event and start a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """Yield every published item, waiting for new ones until the flight ends"""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+
+
+class SingleFlight:
+    """Share one upstream call between identical concurrent requests
+
+    stream() runs a producer in a background task and hands every caller with
+    the same key the same Flight. call() does the same for non-streaming
+    requests by sharing one awaited result. A key of None never coalesces.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def stream(self, key: Optional[str], producer: Callable[[Flight], Awaitable[None]]) -> Tuple[Flight, bool]:
+        """Join the in-flight generation for key, or start one; returns (flight, coalesced)"""
+        if key is not None:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.cancelled:
+                flight.clients += 1
+                self.coalesced += 1
+                return flight, True
+
+        self.leaders += 1
+        flight = Flight(key)
+        flight.clients = 1
+        if key is not None:
+            self._flights[key] = flight
+        flight.task = asyncio.create_task(self._run(flight, producer))
+        return flight, False
+
+    async def _run(self, flight: Flight, producer: Callable[[Flight], Awaitable[None]]):
+        try:
+            await producer(flight)
+            flight.finish()
+        except asyncio.CancelledError as e:
+            flight.finish(e)
+            raise
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            if flight.key is not None and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    async def call(self, key: Optional[str], fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Await fn() once per key and share the result; returns (result, coalesced)"""
+        if key is None:
+            self.leaders += 1
+            return await fn(), False
+
+        future = self._calls.get(key)
+        coalesced = future is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            self._waiters[key] = 0
+            future.add_done_callback(lambda _: self._forget(key, future))
+
+        # Shielded so one caller disconnecting doesn't cancel the call for the
+        # others; it is cancelled only when every caller has gone
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(future), coalesced
+        except asyncio.CancelledError:
+            if not future.done() and self._calls.get(key) is future:
+                self._waiters[key] -= 1
+                if self._waiters[key] <= 0:
+                    future.cancel()
+            raise
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+            del self._waiters[key]
+
+    def in_flight(self) -> int:
+        return len(self._flights) + len(self._calls)
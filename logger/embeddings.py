@@ -0,0 +1,262 @@
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Request fields forwarded to Ollama's /api/embed alongside the inputs;
+# requests only share a batch when all of these match
+EMBED_PARAMS = ("model", "truncate", "options", "keep_alive", "dimensions")
+
+# (params, texts, api_key) -> (vectors, prompt_tokens, upstream_seconds)
+SendBatch = Callable[[dict, List[str], str], Awaitable[Tuple[List[List[float]], int, float]]]
+
+
+class EmbeddingError(Exception):
+    """Ollama rejected an embedding batch; status is the upstream HTTP status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_inputs(value) -> Optional[List[str]]:
+    """OpenAI `input` as a list of strings, or None for unsupported forms (token arrays)"""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return None
+
+
+def encode_vector(vector: Sequence[float], encoding_format: str):
+    """OpenAI embedding payload: a float list, or little-endian float32 base64"""
+    if encoding_format == "base64":
+        packed = array("f", vector)
+        if sys.byteorder != "little":
+            packed.byteswap()
+        return base64.b64encode(packed.tobytes()).decode("ascii")
+    return list(vector)
+
+
+class Embedding:
+    """One input's vector plus its share of the batch it was computed in"""
+
+    __slots__ = ("vector", "tokens", "seconds", "cached")
+
+    def __init__(self, vector: Sequence[float], tokens: float, seconds: float, cached: bool = False):
+        self.vector = vector
+        self.tokens = tokens
+        self.seconds = seconds
+        self.cached = cached
+
+
+class VectorCache:
+    """LRU cache of embedding vectors keyed by a hash of (params, text)
+
+    Vectors are stored as float32 arrays (what Ollama computes anyway), about
+    a quarter of the memory of a list of Python floats.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[array, float]]" = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(group: str, text: str) -> str:
+        return hashlib.sha256(f"{group}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, group: str, text: str) -> Optional[Embedding]:
+        entry = self._entries.get(self.key(group, text))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(self.key(group, text))
+        vector, tokens = entry
+        return Embedding(vector.tolist(), tokens, 0.0, cached=True)
+
+    def put(self, group: str, text: str, embedding: Embedding):
+        key = self.key(group, text)
+        if key in self._entries:
+            return
+        vector = array("f", embedding.vector)
+        self._entries[key] = (vector, embedding.tokens)
+        self.bytes += self._size(vector)
+        while self.bytes > self.max_bytes and self._entries:
+            _, (oldest, _) = self._entries.popitem(last=False)
+            self.bytes -= self._size(oldest)
+            self.evictions += 1
+
+    @staticmethod
+    def _size(vector: array) -> int:
+        return vector.itemsize * len(vector) + 200
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class _Pending:
+    __slots__ = ("text", "future", "api_key")
+
+    def __init__(self, text: str, future: asyncio.Future, api_key: str):
+        self.text = text
+        self.future = future
+        self.api_key = api_key
+
+
+class EmbeddingBatcher:
+    """Turns many embedding inputs into few /api/embed calls
+
+    Inputs with the same parameters and API key are queued together. A queue
+    is sent as one micro-batch when it reaches max_batch inputs or window
+    seconds after its first input arrived, whichever comes first - so a large
+    array becomes several batches sent concurrently, and small requests of
+    one client that arrive within the window share a batch. The send callback
+    takes a scheduler slot per batch in that key's fair share, which keeps
+    concurrency within the upstream limit. Each input's token count and
+    upstream time are its character-weighted share of its batch.
+
+    A batch Ollama rejects as a bad request (4xx) is retried in halves, so
+    one bad input fails only its own request.
+    """
+
+    def __init__(self, send: SendBatch, max_batch: int = 32, window: float = 0.005,
+                 cache: Optional[VectorCache] = None):
+        self.send = send
+        self.max_batch = max_batch
+        self.window = window
+        self.cache = cache
+        # Queues are keyed by (group_key(params), api_key)
+        self._pending: Dict[Tuple[str, str], List[_Pending]] = {}
+        self._params: Dict[Tuple[str, str], dict] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._tasks = set()
+
+        self.batches = 0
+        self.inputs = 0
+        self.splits = 0
+
+    @staticmethod
+    def group_key(params: dict) -> str:
+        return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+    async def embed(self, params: dict, texts: List[str], api_key: str = "") -> List[Embedding]:
+        """Embed texts in order, from the cache where possible"""
+        group = self.group_key(params)
+        results: List[Optional[Embedding]] = [None] * len(texts)
+        futures: Dict[str, asyncio.Future] = {}
+        waiting: List[Tuple[int, asyncio.Future]] = []
+
+        for index, text in enumerate(texts):
+            if self.cache is not None:
+                cached = self.cache.get(group, text)
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            # Repeated inputs within one request are embedded once
+            future = futures.get(text)
+            if future is None:
+                future = futures[text] = self._enqueue(group, params, text, api_key)
+            waiting.append((index, future))
+
+        if futures:
+            # Wait for every batch so no failure goes unretrieved, then report the first one
+            outcomes = await asyncio.gather(*futures.values(), return_exceptions=True)
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    raise outcome
+        seen = set()
+        for index, future in waiting:
+            embedding = future.result()
+            if id(future) in seen:
+                # Duplicate input: same vector, but its cost was already counted
+                embedding = Embedding(embedding.vector, 0.0, 0.0, cached=True)
+            seen.add(id(future))
+            results[index] = embedding
+        return results
+
+    def _enqueue(self, group: str, params: dict, text: str, api_key: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = (group, api_key)
+        pending = self._pending.setdefault(queue, [])
+        self._params[queue] = params
+        pending.append(_Pending(text, future, api_key))
+        if len(pending) >= self.max_batch:
+            self._flush(queue)
+        elif queue not in self._timers:
+            self._timers[queue] = loop.call_later(self.window, self._flush, queue)
+        return future
+
+    def _flush(self, queue: Tuple[str, str]):
+        timer = self._timers.pop(queue, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(queue, None)
+        if not items:
+            return
+        self.inputs += len(items)
+        task = asyncio.create_task(self._run(queue[0], self._params.pop(queue), items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: str, params: dict, items: List[_Pending]):
+        """Send one batch; if Ollama rejects its inputs, retry in halves so only the bad ones fail"""
+        self.batches += 1
+        try:
+            vectors, prompt_tokens, seconds = await self.send(params, [item.text for item in items], items[0].api_key)
+            if len(vectors) != len(items):
+                raise EmbeddingError(502, f"Ollama returned {len(vectors)} embeddings for {len(items)} inputs")
+        except EmbeddingError as e:
+            if len(items) > 1 and 400 <= e.status < 500:
+                self.splits += 1
+                middle = len(items) // 2
+                await self._run(group, params, items[:middle])
+                await self._run(group, params, items[middle:])
+                return
+            self._fail(items, e)
+            return
+        except Exception as e:
+            self._fail(items, e)
+            return
+
+        total_chars = sum(max(1, len(item.text)) for item in items)
+        for item, vector in zip(items, vectors):
+            share = max(1, len(item.text)) / total_chars
+            embedding = Embedding(vector, prompt_tokens * share, seconds * share)
+            if self.cache is not None:
+                self.cache.put(group, item.text, embedding)
+            if not item.future.done():
+                item.future.set_result(embedding)
+
+    @staticmethod
+    def _fail(items: List[_Pending], error: Exception):
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "splits": self.splits,
+            "cache": self.cache.stats() if self.cache else None,
+        }
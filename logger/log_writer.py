@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections import deque
+from typing import Optional, Sequence, Tuple
+
+import asyncpg
+
+# Errors caused by the rows' values (too long, wrong type, bad encoding) rather than by the database
+ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, TypeError, ValueError)
+
+
+class LogWriter:
+    """Buffered request log writer that flushes batches with COPY
+
+    Request handlers call submit() which never blocks and never touches the
+    database. A background task drains the buffer and writes rows with
+    copy_records_to_table whenever a batch fills up or the flush interval
+    elapses, whichever comes first.
+
+    With a body_table, each row can carry (hash, text) bodies that are
+    inserted into that table in the same transaction, once per distinct
+    hash in the batch. Every batch sends all of its hashes, even ones
+    written before: prune_request_bodies() can delete a body at any time
+    once nothing references it, and the conflict check is one index probe.
+    With a
+    notify_channel, every flush also sends NOTIFY on it (delivered at commit)
+    with the number of rows written, so listeners such as the dashboard's
+    live feed don't have to poll.
+
+    A batch the database rejects because of a row's values is retried in
+    halves, so one bad row doesn't take other requests' rows with it.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        table: str,
+        columns: Sequence[str],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        body_table: Optional[str] = None,
+        notify_channel: Optional[str] = None,
+    ):
+        self.pool = pool
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.body_table = body_table
+        self.notify_channel = notify_channel
+
+        # Counters exposed through stats()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.bodies_written = 0
+        self.bodies_skipped = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting rows, flush everything still buffered and exit"""
+        self._stopping = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def check_schema(self):
+        """Raise RuntimeError if the tables lack columns this writer copies into
+
+        init.sql only runs on an empty volume, so a database created by an
+        older release keeps its old request_logs; without this check every
+        COPY would fail with UndefinedColumn and logging would quietly stop.
+        """
+        expected = {self.table: self.columns}
+        if self.body_table:
+            expected[self.body_table] = ["hash", "body"]
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT table_name, column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = ANY($1::TEXT[])",
+                list(expected)
+            )
+        present = {(row["table_name"], row["column_name"]) for row in rows}
+        missing = [
+            f"{table}.{column}"
+            for table, columns in expected.items()
+            for column in columns
+            if (table, column) not in present
+        ]
+        if missing:
+            raise RuntimeError(
+                f"Database schema is out of date (missing {', '.join(missing)}); "
+                "run migrate.sql, see 'Upgrading the Database' in SETUP.md"
+            )
+
+    def submit(self, record: tuple, bodies: Sequence[Tuple[str, str]] = ()) -> bool:
+        """Queue one row (and its (hash, text) bodies) for writing, dropping it if the buffer is full"""
+        if self._stopping:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((record, bodies))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"Log buffer full - dropped {self.dropped} rows so far")
+            return False
+        self.submitted += 1
+        return True
+
+    def stats(self) -> dict:
+        """Current buffer depth and lifetime counters"""
+        return {
+            "buffered": self.queue.qsize(),
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "bodies_written": self.bodies_written,
+            "bodies_skipped": self.bodies_skipped,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+    async def _next_batch(self) -> list:
+        """Wait for up to batch_size rows or until the flush interval expires"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Grab whatever is already buffered without yielding
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if len(batch) >= self.batch_size or self._stopping:
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while not (self._stopping and self.queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        start = time.monotonic()
+        await self._write(batch)
+        self.last_flush_seconds = time.monotonic() - start
+
+    async def _write(self, batch: list):
+        """COPY a batch; if its rows are rejected, retry in halves so only the bad rows are lost"""
+        try:
+            await self._copy(batch)
+        except ROW_ERRORS as e:
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                await self._write(batch[:middle])
+                await self._write(batch[middle:])
+                return
+            self.failed += 1
+            print(f"Error writing log row to database: {e}")
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Error writing {len(batch)} log rows to database: {e}")
+
+    async def _copy(self, batch: list):
+        records = [record for record, _ in batch]
+        bodies = {}
+        skipped = 0
+        for _, row_bodies in batch:
+            for body_hash, text in row_bodies:
+                if body_hash in bodies:
+                    # Same text as another row in this batch
+                    skipped += 1
+                else:
+                    bodies[body_hash] = text
+        async with self.pool.acquire() as conn, conn.transaction():
+            if bodies:
+                # Sorted so concurrent writers take the same order and can't deadlock
+                hashes = sorted(bodies)
+                await conn.execute(
+                    f"INSERT INTO {self.body_table} (hash, body) "
+                    "SELECT * FROM unnest($1::TEXT[], $2::TEXT[]) ON CONFLICT (hash) DO NOTHING",
+                    hashes, [bodies[body_hash] for body_hash in hashes]
+                )
+            await conn.copy_records_to_table(
+                self.table,
+                records=records,
+                columns=self.columns
+            )
+            if self.notify_channel:
+                await conn.execute("SELECT pg_notify($1, $2)", self.notify_channel, str(len(records)))
+        self.written += len(batch)
+        self.batches += 1
+        self.bodies_written += len(bodies)
+        self.bodies_skipped += skipped
+
+
+class MemoryLogWriter(LogWriter):
+    """LogWriter that keeps the most recent rows in memory instead of PostgreSQL
+
+    Rows still go through submit(), the buffer and batching, so benchmarks
+    measure the logger's own logging cost without a database. Only the last
+    `keep` rows are retained.
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], keep: int = 1000, **kwargs):
+        super().__init__(None, table, columns, **kwargs)
+        self.rows: deque = deque(maxlen=keep)
+
+    async def _flush(self, batch: list):
+        start = time.monotonic()
+        for record, bodies in batch:
+            self.rows.append(record)
+            self.bodies_written += len(bodies)
+        self.written += len(batch)
+        self.batches += 1
+        self.last_flush_seconds = time.monotonic() - start
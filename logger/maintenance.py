@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import asyncpg
+
+# A SQL statement run with fetchval, or a coroutine function given a connection
+Job = Union[str, Callable[[asyncpg.Connection], Awaitable[object]]]
+
+
+class MaintenanceLoop:
+    """Runs periodic housekeeping statements against PostgreSQL
+
+    Each job is a (name, SQL or coroutine function) pair executed in order
+    at startup and then every `interval` seconds. A failing job is reported
+    and retried on the next round; it never stops the others. Jobs must be
+    safe to run from several logger processes at once (the rollup and
+    partition jobs take advisory locks).
+    """
+
+    def __init__(self, pool: asyncpg.Pool, jobs: List[Tuple[str, Job]], interval: float = 30.0):
+        self.pool = pool
+        self.jobs = jobs
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.failures = 0
+        self.last_results: Dict[str, object] = {}
+        self.last_seconds: Dict[str, float] = {}
+
+    def start(self):
+        if self.jobs and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        self.runs += 1
+        for name, job in self.jobs:
+            started = time.perf_counter()
+            try:
+                async with self.pool.acquire() as conn:
+                    if isinstance(job, str):
+                        self.last_results[name] = await conn.fetchval(job)
+                    else:
+                        self.last_results[name] = await job(conn)
+            except Exception as e:
+                self.failures += 1
+                print(f"Maintenance job {name} failed: {e}")
+            self.last_seconds[name] = time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_results": {name: str(value) for name, value in self.last_results.items()},
+            "last_seconds": self.last_seconds,
+        }
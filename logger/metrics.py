@@ -0,0 +1,364 @@
+import asyncio
+import bisect
+import json
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from workers import pid_alive
+
+# Latency buckets in seconds, from a fast cached token to a cold model load
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self) -> list:
+        raise NotImplementedError
+
+    def merged(self, snapshots: List[list]) -> "_Metric":
+        """A copy holding the combined values of several workers' snapshots"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally read from a callback at scrape time"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        if self.callback is not None:
+            lines.append(f"{self.name} {_format_value(self.callback())}")
+            return lines
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self) -> list:
+        if self.callback is not None:
+            return [[[], self.callback()]]
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def merged(self, snapshots: List[list]) -> "Counter":
+        merged = Counter(self.name, self.help_text, self.label_names)
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                merged.inc(value, **dict(zip(self.label_names, key)))
+        return merged
+
+
+# How a gauge reported by several workers is combined into one value
+GAUGE_AGGREGATES = {
+    "sum": sum,
+    "min": min,
+    "max": max,
+    "mean": lambda values: sum(values) / len(values),
+}
+
+
+class Gauge(Counter):
+    """Value that can go up and down, optionally read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None, aggregate: str = "sum"):
+        if aggregate not in GAUGE_AGGREGATES:
+            raise ValueError(f"Unknown gauge aggregate: {aggregate}")
+        super().__init__(name, help_text, labels, callback)
+        self.aggregate = aggregate
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def merged(self, snapshots: List[list]) -> "Gauge":
+        merged = Gauge(self.name, self.help_text, self.label_names, aggregate=self.aggregate)
+        collected: Dict[Tuple[str, ...], List[float]] = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                collected.setdefault(tuple(key), []).append(value)
+        combine = GAUGE_AGGREGATES[self.aggregate]
+        merged.values = {key: combine(values) for key, values in collected.items()}
+        return merged
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed distribution in the Prometheus exposition format"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key in sorted(self.counts):
+            counts = self.counts[key]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self.sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def snapshot(self) -> list:
+        return [[list(key), counts, self.sums[key]] for key, counts in self.counts.items()]
+
+    def merged(self, snapshots: List[list]) -> "Histogram":
+        merged = Histogram(self.name, self.help_text, self.label_names, self.buckets)
+        for snapshot in snapshots:
+            for key, counts, total in snapshot:
+                key = tuple(key)
+                if key not in merged.counts:
+                    merged.counts[key] = [0] * (len(self.buckets) + 1)
+                    merged.sums[key] = 0.0
+                merged.counts[key] = [a + b for a, b in zip(merged.counts[key], counts)]
+                merged.sums[key] += total
+        return merged
+
+
+class Registry:
+    """Collection of metrics rendered together by the /metrics endpoint"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = (),
+                callback: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, help_text, labels, callback))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], float]] = None, aggregate: str = "sum") -> Gauge:
+        return self.register(Gauge(name, help_text, labels, callback, aggregate))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, list]:
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render_merged(self, live: List[dict], exited: List[dict]) -> str:
+        """Render snapshots of several workers as one registry
+
+        Gauges describe the present, so only running workers count; counters
+        and histograms also include workers that have exited, so totals never
+        go backwards when a worker is replaced.
+        """
+        lines = []
+        for metric in self.metrics:
+            sources = live if isinstance(metric, Gauge) else live + exited
+            lines.extend(metric.merged([s[metric.name] for s in sources if metric.name in s]).render())
+        return "\n".join(lines) + "\n"
+
+
+class SharedMetrics:
+    """Aggregates a registry across the worker processes of one logger
+
+    Each worker writes its registry as JSON to
+    `<directory>/<server pid>-<worker pid>.json` every `interval` seconds and
+    whenever it is scraped; /metrics on any worker merges the snapshots of
+    every worker of the same server. Files left behind by earlier servers are
+    removed at startup. A tmpfs directory such as /dev/shm keeps this off the
+    disk.
+    """
+
+    def __init__(self, registry: Registry, directory: str, interval: float = 5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.server = os.getppid()
+        self.path = os.path.join(directory, f"{self.server}-{os.getpid()}.json")
+        self.workers = 1
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            server, _, rest = name.partition("-")
+            if rest.endswith(".json") and server.isdigit() and not pid_alive(int(server)):
+                os.remove(os.path.join(self.directory, name))
+        self.write()
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Final counts stay behind for the workers that are still running
+        self.write()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        partial = self.path + ".part"
+        with open(partial, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(partial, self.path)
+
+    def render(self) -> str:
+        prefix = f"{self.server}-"
+        pids = {
+            name: int(name[len(prefix):-len(".json")])
+            for name in os.listdir(self.directory)
+            if name.startswith(prefix) and name.endswith(".json")
+        }
+        alive = {name: pid_alive(pid) for name, pid in pids.items()}
+        self.workers = sum(alive.values()) or 1
+        self.write()
+        live, exited = [], []
+        for name in pids:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            (live if alive[name] else exited).append(snapshot)
+        return self.registry.render_merged(live, exited)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class RequestTimer:
+    """Timing phases of one proxied request, measured at the logger
+
+    connect: until the request headers start going out on an upstream
+             connection (pool wait + TCP connect, ~0 for a reused connection)
+    first byte: until the upstream response headers arrive
+    first token: until the first chunk carrying generated content
+    inter-token gaps: time between consecutive content chunks
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connected: Optional[float] = None
+        self.first_byte: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self._last_token: Optional[float] = None
+        self.token_gaps: List[float] = []
+
+    async def trace(self, event_name: str, info: dict):
+        """httpx "trace" extension hook, called by httpcore for connection events"""
+        if self.connected is None and event_name.endswith("send_request_headers.started"):
+            self.connected = time.perf_counter()
+        elif self.first_byte is None and event_name.endswith("receive_response_headers.complete"):
+            self.first_byte = time.perf_counter()
+
+    def reset_upstream(self):
+        """Forget connection marks from a failed attempt before retrying on another backend"""
+        self.connected = None
+        self.first_byte = None
+
+    def mark_token(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            self.token_gaps.append(now - self._last_token)
+        self._last_token = now
+
+    def _since_start_ms(self, mark: Optional[float]) -> Optional[float]:
+        return (mark - self.start) * 1000 if mark is not None else None
+
+    def phases(self) -> dict:
+        """Phase timings in milliseconds, None for phases that never happened"""
+        gaps = sorted(self.token_gaps)
+        p50 = percentile(gaps, 0.50)
+        p99 = percentile(gaps, 0.99)
+        return {
+            "upstream_connect_ms": self._since_start_ms(self.connected),
+            "first_byte_ms": self._since_start_ms(self.first_byte),
+            "first_token_ms": self._since_start_ms(self.first_token),
+            "inter_token_p50_ms": p50 * 1000 if p50 is not None else None,
+            "inter_token_p99_ms": p99 * 1000 if p99 is not None else None,
+        }
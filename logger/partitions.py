@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import os
+import time
+from typing import List, Optional
+
+import asyncpg
+
+# Session advisory lock shared by every logger process, so only one of them
+# creates, exports or drops partitions at a time
+PARTITION_LOCK = "request_log_partitions"
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class PartitionMaintenance:
+    """Keeps request_logs' monthly partitions ahead of time and ages them out
+
+    Each run creates the partitions for the current month and the next
+    `months_ahead` months. With retention enabled, partitions that ended more
+    than `retention_months` months ago are exported to `archive_dir` as
+    gzipped JSON lines (when set), detached, and dropped unless `action` is
+    "detach" - which leaves them as standalone tables for manual archiving.
+    After a drop, request bodies no remaining row references are pruned.
+    Dropping a whole partition replaces per-row DELETEs, so retention costs no
+    vacuum and no index churn however much history has accumulated.
+    """
+
+    def __init__(self, months_ahead: int = 2, retention_months: int = 0, action: str = "drop",
+                 archive_dir: str = "", export_batch: int = 1000):
+        if action not in ("drop", "detach"):
+            raise ValueError(f"Unknown partition retention action: {action}")
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.action = action
+        self.archive_dir = archive_dir
+        self.export_batch = export_batch
+
+        self.created = 0
+        self.exported: List[str] = []
+        self.removed: List[str] = []
+
+    async def __call__(self, conn: asyncpg.Connection) -> Optional[str]:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", PARTITION_LOCK):
+            return None
+        try:
+            created = await conn.fetchval("SELECT create_request_log_partitions($1)", self.months_ahead)
+            self.created += created
+            removed = []
+            if self.retention_months > 0:
+                expired = await conn.fetch(
+                    "SELECT partition_name FROM expired_request_log_partitions($1)", self.retention_months
+                )
+                for row in expired:
+                    if await self._retire(conn, row["partition_name"]):
+                        removed.append(row["partition_name"])
+                if removed and self.action == "drop":
+                    pruned = await conn.fetchval("SELECT prune_request_bodies()")
+                    print(f"Pruned {pruned} unreferenced request bodies")
+            return f"created {created}, {self.action} {len(removed)}"
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", PARTITION_LOCK)
+
+    async def _retire(self, conn: asyncpg.Connection, name: str) -> bool:
+        table = quote_ident(name)
+        pending = await conn.fetchval(f'''
+            SELECT EXISTS (
+                SELECT 1 FROM {table}
+                WHERE id > (SELECT last_id FROM rollup_state WHERE name = 'request_logs')
+            )
+        ''')
+        if pending:
+            # Its rows would vanish from the dashboard totals; wait for the rollup job
+            print(f"Partition {name} is not fully rolled up yet; keeping it")
+            return False
+        if self.archive_dir:
+            await self.export(conn, name)
+            self.exported.append(name)
+        await conn.execute(f"ALTER TABLE request_logs DETACH PARTITION {table}")
+        if self.action == "drop":
+            await conn.execute(f"DROP TABLE {table}")
+        print(f"Retired partition {name} ({self.action})")
+        self.removed.append(name)
+        return True
+
+    async def export(self, conn: asyncpg.Connection, name: str) -> str:
+        """Write one partition to archive_dir/<name>.jsonl.gz and return the path
+
+        The file is written under a temporary name and renamed when complete,
+        so a partial export is never mistaken for an archive.
+        """
+        table = quote_ident(name)
+        path = os.path.join(self.archive_dir, f"{name}.jsonl.gz")
+        partial = path + ".part"
+        started = time.perf_counter()
+        rows = 0
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive = await asyncio.to_thread(gzip.open, partial, "wt", encoding="utf-8")
+        try:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                lines = []
+                # Each line is self-contained: the row plus its prompt and response bodies
+                query = f'''
+                    SELECT (to_jsonb(t) || jsonb_build_object('prompt', p.body, 'response', r.body))::TEXT
+                    FROM {table} t
+                    LEFT JOIN request_bodies p ON p.hash = t.prompt_hash
+                    LEFT JOIN request_bodies r ON r.hash = t.response_hash
+                    ORDER BY t.id
+                '''
+                async for record in conn.cursor(query, prefetch=self.export_batch):
+                    lines.append(record[0])
+                    if len(lines) >= self.export_batch:
+                        await asyncio.to_thread(archive.write, "\n".join(lines) + "\n")
+                        rows += len(lines)
+                        lines = []
+                if lines:
+                    await asyncio.to_thread(archive.write, "\n".join(lines) + "\n")
+                    rows += len(lines)
+        except BaseException:
+            archive.close()
+            os.remove(partial)
+            raise
+        await asyncio.to_thread(archive.close)
+        os.replace(partial, path)
+        print(f"Archived {rows} rows of {name} to {path} in {time.perf_counter() - started:.1f}s")
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "months_ahead": self.months_ahead,
+            "retention_months": self.retention_months,
+            "action": self.action,
+            "archive_dir": self.archive_dir or None,
+            "created": self.created,
+            "exported": self.exported,
+            "removed": self.removed,
+        }
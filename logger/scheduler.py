@@ -0,0 +1,188 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+
+class QueueFull(Exception):
+    """Raised when a request can't be admitted; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("future", "enqueued", "model", "skips")
+
+    def __init__(self, future: asyncio.Future, model: str = ""):
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.model = model
+        self.skips = 0
+
+
+class FairScheduler:
+    """Admission control for a fixed number of upstream slots
+
+    At most `capacity` requests run upstream at once. Requests beyond that
+    wait in per-key FIFO queues (one per API key), and freed slots are handed
+    out by deficit round robin: every visit adds the key's weight to its
+    deficit, and each admitted request costs 1. A key with weight 2 gets
+    twice the slots of a key with weight 1 while both are backlogged, and a
+    single busy key can't starve the others.
+
+    With an is_warm(model) callback the scheduler also batches by model:
+    within a key's queue, requests for an already loaded model go first, and
+    a key whose queued requests all need a model swap is passed over while
+    other keys have warm requests waiting - at most max_affinity_skips times
+    per request, so cold requests are delayed but never starved.
+    """
+
+    def __init__(self, capacity: int, max_queue: int = 64, max_queue_per_key: int = 0,
+                 queue_timeout: float = 120.0, weights: Optional[Dict[str, float]] = None,
+                 default_weight: float = 1.0, is_warm: Optional[Callable[[str], bool]] = None,
+                 max_affinity_skips: int = 4):
+        # A weight of 0 or less never earns a slot, and _dispatch would spin on it forever
+        for key, weight in [("default", default_weight), *(weights or {}).items()]:
+            if not weight > 0:
+                raise ValueError(f"Scheduler weight for {key!r} must be positive, got {weight}")
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_queue_per_key = max_queue_per_key
+        self.queue_timeout = queue_timeout
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.is_warm = is_warm
+        self.max_affinity_skips = max_affinity_skips
+
+        self.active = 0
+        self.waiting = 0
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._deficit: Dict[str, float] = {}
+        self._order: Deque[str] = deque()
+
+        # Smoothed slot hold time, used for Retry-After estimates
+        self._avg_service_seconds = 5.0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.last_wait_seconds = 0.0
+
+    def weight(self, key: str) -> float:
+        return self.weights.get(key, self.default_weight)
+
+    async def acquire(self, key: str, model: str = "") -> float:
+        """Wait for a slot; returns the seconds spent queued or raises QueueFull"""
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            self.admitted += 1
+            self.last_wait_seconds = 0.0
+            return 0.0
+
+        queue = self._queues.get(key)
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull("Upstream queue is full", self.retry_after())
+        if self.max_queue_per_key and queue is not None and len(queue) >= self.max_queue_per_key:
+            self.rejected += 1
+            raise QueueFull("Too many queued requests for this API key", self.retry_after())
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), model)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._deficit[key] = 0.0
+            self._order.append(key)
+        queue.append(waiter)
+        self.waiting += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(key, waiter)
+            self.rejected += 1
+            raise QueueFull("Timed out waiting for an upstream slot", self.retry_after())
+        except asyncio.CancelledError:
+            self._abandon(key, waiter)
+            raise
+
+        self.last_wait_seconds = time.monotonic() - waiter.enqueued
+        return self.last_wait_seconds
+
+    def release(self, held_seconds: Optional[float] = None):
+        """Return a slot and hand it to the next waiter"""
+        self.active -= 1
+        if held_seconds is not None:
+            self._avg_service_seconds += 0.1 * (held_seconds - self._avg_service_seconds)
+        self._dispatch()
+
+    def retry_after(self) -> int:
+        """Rough seconds until a new request could be admitted"""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self._avg_service_seconds * backlog / max(1, self.capacity)))
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {key: len(queue) for key, queue in self._queues.items()}
+
+    def _abandon(self, key: str, waiter: _Waiter):
+        if waiter.future.done() and not waiter.future.cancelled():
+            # The slot was granted just as the caller gave up - pass it on
+            self.release()
+            return
+        waiter.future.cancel()
+        queue = self._queues.get(key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                self._drop_key(key)
+
+    def _drop_key(self, key: str):
+        del self._queues[key]
+        del self._deficit[key]
+        self._order.remove(key)
+
+    def _dispatch(self):
+        while self.active < self.capacity and self.waiting:
+            key = self._order[0]
+            queue = self._queues[key]
+
+            if self._deficit[key] < 1:
+                self._deficit[key] += self.weight(key)
+                if self._deficit[key] < 1:
+                    # Fractional weight - let the others go first this round
+                    self._order.rotate(-1)
+                    continue
+
+            waiter = self._next_waiter(queue)
+            if waiter is None:
+                self._order.rotate(-1)
+                continue
+            queue.remove(waiter)
+            self.waiting -= 1
+            self._deficit[key] -= 1
+            self.active += 1
+            self.admitted += 1
+            waiter.future.set_result(None)
+
+            if not queue:
+                self._drop_key(key)
+            elif self._deficit[key] < 1:
+                self._order.rotate(-1)
+
+    def _next_waiter(self, queue: Deque[_Waiter]) -> Optional[_Waiter]:
+        """The waiter to admit from queue, or None to serve another key's warm request first"""
+        if self.is_warm is None:
+            return queue[0]
+        for waiter in queue:
+            if self.is_warm(waiter.model):
+                return waiter
+        head = queue[0]
+        if head.skips >= self.max_affinity_skips or not self._warm_waiting():
+            return head
+        head.skips += 1
+        return None
+
+    def _warm_waiting(self) -> bool:
+        return any(self.is_warm(waiter.model) for queue in self._queues.values() for waiter in queue)
@@ -0,0 +1,172 @@
+import json
+import re
+import time
+import uuid
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - fall back to the stdlib encoder
+    orjson = None
+
+
+def dumps_bytes(value) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# Splits text into word-sized pieces (each keeps its leading whitespace)
+_REPLAY_PIECE = re.compile(r"\s*\S+|\s+")
+
+
+class NDJSONFramer:
+    """Incremental newline-delimited JSON framer
+
+    Upstream chunks can end anywhere: in the middle of a JSON object or in
+    the middle of a multi-byte UTF-8 character. The framer keeps the
+    unterminated tail as raw bytes and only returns complete lines, so
+    callers never decode or parse a partial record. Splitting on b"\\n" is
+    safe for UTF-8 because the newline byte never occurs inside a
+    multi-byte sequence.
+    """
+
+    def __init__(self, max_line_bytes: int = 16 * 1024 * 1024):
+        self.max_line_bytes = max_line_bytes
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add a chunk and return every line it completes"""
+        if b"\n" not in chunk:
+            self._buffer += chunk
+            if len(self._buffer) > self.max_line_bytes:
+                raise ValueError(f"NDJSON line exceeds {self.max_line_bytes} bytes")
+            return []
+
+        self._buffer += chunk
+        *lines, tail = self._buffer.split(b"\n")
+        self._buffer = bytearray(tail)
+        return [bytes(line) for line in lines if line.strip()]
+
+    def flush(self) -> List[bytes]:
+        """Return the final unterminated line, if any, and reset"""
+        tail = bytes(self._buffer)
+        self._buffer.clear()
+        return [tail] if tail.strip() else []
+
+
+async def aiter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """Parse an async byte stream of NDJSON into dicts, one per complete line"""
+    framer = NDJSONFramer()
+    async for chunk in chunks:
+        for line in framer.feed(chunk):
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                print(f"Skipping malformed NDJSON line ({len(line)} bytes): {e}")
+    for line in framer.flush():
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            print(f"Skipping malformed NDJSON line ({len(line)} bytes): {e}")
+
+
+class OpenAIStreamTransformer:
+    """Per-response Ollama -> OpenAI chunk transformer
+
+    The completion id, created timestamp and model are fixed for a whole
+    response, so the JSON envelope around each delta is serialized once up
+    front. Each chunk then only needs its content string escaped and a few
+    byte strings joined.
+    """
+
+    def __init__(self, model: str, completion_id: Optional[str] = None, created: Optional[int] = None):
+        self.model = model
+        self.completion_id = completion_id or f"chatcmpl-{uuid.uuid4().hex[:8]}"
+        self.created = created if created is not None else int(time.time())
+
+        envelope = dumps_bytes({
+            "id": self.completion_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": model,
+        })
+        # Drop the closing brace so choices can be appended
+        self._prefix = envelope[:-1] + b',"choices":[{"index":0,"delta":'
+
+    def transform(self, ollama_chunk: dict, usage: Optional[dict] = None) -> bytes:
+        """Convert one Ollama chunk into one OpenAI chunk line (newline terminated)
+
+        When usage is given (on the final chunk) it is attached as the
+        OpenAI "usage" block.
+        """
+        content = ""
+        if "message" in ollama_chunk:
+            content = ollama_chunk["message"].get("content", "")
+        elif "response" in ollama_chunk:
+            content = ollama_chunk.get("response", "")
+
+        delta = b'{"content":' + dumps_bytes(content) + b"}" if content else b"{}"
+        finish_reason = b'"stop"' if ollama_chunk.get("done", False) else b"null"
+        if usage is None:
+            return b"".join((self._prefix, delta, b',"finish_reason":', finish_reason, b"}]}\n"))
+        return b"".join((
+            self._prefix, delta, b',"finish_reason":', finish_reason,
+            b'}],"usage":', dumps_bytes(usage), b"}\n"
+        ))
+
+
+class ResponseCollector:
+    """Accumulate streamed response text for logging without O(n²) copies
+
+    Fragments are appended to a list and joined once at the end. At most
+    max_chars characters are kept (0 keeps everything); anything beyond the
+    cap is counted but discarded and the collector is marked truncated.
+    """
+
+    def __init__(self, max_chars: int = 0):
+        self.max_chars = max_chars
+        self._parts: List[str] = []
+        self._kept = 0
+        self.total_chars = 0
+        self.truncated = False
+
+    def append(self, text: str):
+        """Add one fragment of response text"""
+        if not text:
+            return
+        self.total_chars += len(text)
+        if self.max_chars:
+            room = self.max_chars - self._kept
+            if room <= 0:
+                self.truncated = True
+                return
+            if len(text) > room:
+                text = text[:room]
+                self.truncated = True
+        self._parts.append(text)
+        self._kept += len(text)
+
+    def text(self) -> str:
+        """Return the kept text as one string"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+
+def replay_chunks(content: str, chat: bool) -> List[dict]:
+    """Rebuild a stored answer as a sequence of Ollama stream chunks
+
+    Used to answer stream=true requests from the response cache. The text is
+    split into word-sized pieces so clients see an ordinary token stream; the
+    final chunk has done=true and no content.
+    """
+    chunks = []
+    for piece in _REPLAY_PIECE.findall(content):
+        if chat:
+            chunks.append({"message": {"role": "assistant", "content": piece}, "done": False})
+        else:
+            chunks.append({"response": piece, "done": False})
+    chunks.append({"message": {"role": "assistant", "content": ""}, "done": True} if chat
+                  else {"response": "", "done": True})
+    return chunks
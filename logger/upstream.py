@@ -0,0 +1,183 @@
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import Counter, Histogram, RequestTimer
+
+# Connection-scoped headers that must not be forwarded (RFC 9110 section 7.6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "proxy-connection", "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+# Request headers the upstream client sets itself. Authorization is still
+# forwarded, as it always was, for Ollama instances behind their own auth proxy
+DROPPED_REQUEST_HEADERS = HOP_BY_HOP_HEADERS | {"host", "content-length"}
+
+# Response headers that no longer describe the body once httpx has decoded it
+DROPPED_RESPONSE_HEADERS = HOP_BY_HOP_HEADERS | {"content-length", "content-encoding"}
+
+
+def filter_request_headers(headers) -> Dict[str, str]:
+    """Client request headers that are safe to forward to Ollama"""
+    connection_tokens = {token.strip().lower() for token in headers.get("connection", "").split(",")}
+    return {
+        name: value for name, value in headers.items()
+        if name.lower() not in DROPPED_REQUEST_HEADERS and name.lower() not in connection_tokens
+    }
+
+
+def filter_response_headers(headers) -> Dict[str, str]:
+    """Upstream response headers that are safe to pass back to the client"""
+    return {name: value for name, value in headers.items() if name.lower() not in DROPPED_RESPONSE_HEADERS}
+
+
+def classify_error(error: Exception) -> tuple[int, str]:
+    """Map an upstream exception to (HTTP status, short kind) so pool and connection problems
+    don't look like a slow model"""
+    if isinstance(error, httpx.PoolTimeout):
+        return 503, "pool_timeout"
+    if isinstance(error, httpx.ConnectTimeout):
+        return 504, "connect_timeout"
+    if isinstance(error, httpx.ConnectError):
+        return 502, "connect_error"
+    if isinstance(error, httpx.ReadTimeout):
+        return 504, "read_timeout"
+    if isinstance(error, httpx.WriteTimeout):
+        return 504, "write_timeout"
+    if isinstance(error, (httpx.RemoteProtocolError, httpx.ReadError)):
+        return 502, "connection_lost"
+    return 500, "internal"
+
+
+class _CallTrace:
+    """httpcore trace hook for one upstream call
+
+    Tracks whether the call opened a new connection and how long it waited
+    for one from the pool, then forwards every event to the request's timer.
+    """
+
+    def __init__(self, client: "UpstreamClient", timer: Optional[RequestTimer]):
+        self.client = client
+        self.timer = timer
+        self.started = time.perf_counter()
+        self.connect_started: Optional[float] = None
+        self.connect_seconds = 0.0
+        self.reported = False
+
+    async def __call__(self, event_name: str, info: dict):
+        now = time.perf_counter()
+        if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            self.connect_started = now
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if self.connect_started is not None:
+                self.connect_seconds += now - self.connect_started
+        elif event_name.endswith("send_request_headers.started") and not self.reported:
+            self.reported = True
+            self.client.record_connection(
+                reused=self.connect_started is None,
+                pool_wait=max(0.0, now - self.started - self.connect_seconds)
+            )
+
+        if self.timer is not None:
+            await self.timer.trace(event_name, info)
+
+
+class UpstreamClient:
+    """Pooled HTTP client for Ollama with explicit limits, timeouts and pool metrics
+
+    By default one connection pool is shared by every backend origin. With
+    pool_per_backend=True each origin gets its own client, so one slow or
+    stuck backend can't use up connections meant for the others.
+    """
+
+    def __init__(self, max_connections: int = 32, max_keepalive: int = 16, keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 5.0, read_timeout: float = 300.0, write_timeout: float = 30.0,
+                 pool_timeout: float = 10.0, http2: bool = False, pool_per_backend: bool = False,
+                 pool_wait: Optional[Histogram] = None, connections: Optional[Counter] = None):
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("UPSTREAM_HTTP2 requested but the h2 package is not installed - using HTTP/1.1")
+                http2 = False
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout
+        )
+        self.http2 = http2
+        self.pool_per_backend = pool_per_backend
+        self.pool_wait = pool_wait
+        self.connections = connections
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def _client_for(self, url: str) -> httpx.AsyncClient:
+        origin = ""
+        if self.pool_per_backend:
+            parts = urlsplit(url)
+            origin = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(origin)
+        if client is None:
+            client = self._clients[origin] = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2
+            )
+        return client
+
+    def record_connection(self, reused: bool, pool_wait: float):
+        if reused:
+            self.reused_connections += 1
+        else:
+            self.new_connections += 1
+        if self.connections is not None:
+            self.connections.inc(state="reused" if reused else "new")
+        if self.pool_wait is not None:
+            self.pool_wait.observe(pool_wait)
+
+    def reuse_rate(self) -> float:
+        total = self.new_connections + self.reused_connections
+        return self.reused_connections / total if total else 0.0
+
+    async def request(self, method: str, url: str, headers: dict, content: bytes,
+                      timer: Optional[RequestTimer] = None) -> httpx.Response:
+        """Send a request and read the whole response"""
+        return await self._client_for(url).request(
+            method=method,
+            url=url,
+            headers=headers,
+            content=content,
+            extensions={"trace": _CallTrace(self, timer)}
+        )
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, headers: dict, content: bytes,
+                     timer: Optional[RequestTimer] = None) -> AsyncIterator[httpx.Response]:
+        """Send a request and stream the response body"""
+        async with self._client_for(url).stream(
+            method=method,
+            url=url,
+            headers=headers,
+            content=content,
+            extensions={"trace": _CallTrace(self, timer)}
+        ) as response:
+            yield response
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from backends import Backend, BackendPool
+from upstream import UpstreamClient
+
+# Called after every preload or keep-alive ping that had to load the model:
+# (backend, model, http_status, load_seconds, error_message, load_duration_ms)
+# load_seconds is the ping's wall-clock time; load_duration_ms is Ollama's own
+# load_duration (reported in nanoseconds) or None if the response had none.
+LoadCallback = Callable[[Backend, str, int, float, Optional[str], Optional[float]], Awaitable[None]]
+
+
+def plan_placement(backends: List[Backend], models: List[str], max_loaded_models: int) -> Dict[str, List[str]]:
+    """Decide which configured models each backend should keep loaded
+
+    If every model fits on one backend, every backend gets all of them.
+    Otherwise models are dealt out round robin, at most max_loaded_models per
+    backend, so a pool of N single-model backends can pin N different models.
+    """
+    if not backends or not models:
+        return {}
+    if len(models) <= max_loaded_models:
+        return {backend.url: list(models) for backend in backends}
+    placement: Dict[str, List[str]] = {backend.url: [] for backend in backends}
+    for index, model in enumerate(models):
+        backend = backends[index % len(backends)]
+        if len(placement[backend.url]) < max_loaded_models:
+            placement[backend.url].append(model)
+    return placement
+
+
+class ModelWarmer:
+    """Preloads configured models and keeps them resident
+
+    At startup each backend loads its planned models with an empty
+    /api/generate call (Ollama's documented preload request). Afterwards a
+    keep-alive ping refreshes every planned model that is still loaded. A
+    model that was swapped out by other traffic is loaded again only when its
+    backend is idle, so the warmer never fights live requests for the GPU.
+    """
+
+    def __init__(self, backend_pool: BackendPool, client: UpstreamClient, models: List[str],
+                 keep_alive: str = "30m", interval: float = 240.0, max_loaded_models: int = 1,
+                 on_load: Optional[LoadCallback] = None):
+        self.backend_pool = backend_pool
+        self.client = client
+        self.models = models
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.on_load = on_load
+        self.placement = plan_placement(backend_pool.backends, models, max_loaded_models)
+        self._task: Optional[asyncio.Task] = None
+
+        self.loads = 0
+        self.pings = 0
+        self.failures = 0
+
+    def start(self):
+        if self.models:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Preload in parallel across backends, one model at a time per backend
+        await asyncio.gather(*(self._preload(backend) for backend in self.backend_pool.backends))
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(*(self._refresh(backend) for backend in self.backend_pool.backends))
+
+    async def _preload(self, backend: Backend):
+        for model in self.placement.get(backend.url, []):
+            await self._load(backend, model)
+
+    async def _refresh(self, backend: Backend):
+        if not backend.available(time.monotonic()):
+            return
+        for model in self.placement.get(backend.url, []):
+            # A model swapped out by other traffic is only brought back while the backend is idle
+            if model in backend.loaded_models or backend.outstanding == 0:
+                await self._load(backend, model)
+
+    async def _load(self, backend: Backend, model: str):
+        """Load model (or just extend its keep_alive if it is already resident)"""
+        was_loaded = model in backend.loaded_models
+        started = time.perf_counter()
+        status, error, load_duration_ms = 0, None, None
+        try:
+            response = await self.client.request(
+                "POST",
+                f"{backend.url}/api/generate",
+                {"Content-Type": "application/json"},
+                json.dumps({"model": model, "keep_alive": self.keep_alive}).encode()
+            )
+            status = response.status_code
+            if status == 400 and "generate" in response.text:
+                # Embedding models don't support /api/generate; embedding one
+                # character loads them instead (an empty input isn't a documented preload)
+                response = await self.client.request(
+                    "POST",
+                    f"{backend.url}/api/embed",
+                    {"Content-Type": "application/json"},
+                    json.dumps({"model": model, "input": "a", "keep_alive": self.keep_alive}).encode()
+                )
+                status = response.status_code
+            if status >= 400:
+                error = response.text[:500]
+            else:
+                try:
+                    payload = response.json()
+                except ValueError:
+                    payload = None
+                if isinstance(payload, dict):
+                    load_ns = payload.get("load_duration")
+                    if isinstance(load_ns, (int, float)):
+                        load_duration_ms = load_ns / 1e6
+                else:
+                    # Not Ollama's answer (a proxy error page, a truncated body): the load failed
+                    status, error = 502, f"Invalid response from Ollama: {response.text[:200]}"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+
+        if error is None:
+            backend.note_model(model)
+            self.pings += 1
+        else:
+            self.failures += 1
+            print(f"Warm-up of {model} on {backend.url} failed: {error}")
+
+        if not was_loaded or error is not None:
+            self.loads += 1
+            if error is None:
+                print(f"Loaded {model} on {backend.url} in {seconds:.1f}s")
+            if self.on_load is not None:
+                await self.on_load(backend, model, status, seconds, error, load_duration_ms)
+
+    def stats(self) -> dict:
+        return {
+            "models": self.models,
+            "placement": self.placement,
+            "loads": self.loads,
+            "pings": self.pings,
+            "failures": self.failures,
+        }
@@ -0,0 +1,67 @@
+import fcntl
+import math
+import os
+from typing import Optional, Union
+
+Number = Union[int, float]
+
+
+def worker_share(total: Number, workers: int) -> Number:
+    """One worker's part of a limit configured for the whole logger
+
+    Integer limits are rounded up so every worker keeps at least one slot;
+    0 and negative values keep their "off"/"unlimited" meaning.
+    """
+    if workers <= 1 or total <= 0:
+        return total
+    if isinstance(total, int):
+        return max(1, math.ceil(total / workers))
+    return total / workers
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LeaderLock:
+    """Exclusive lock on a file shared by the workers of one logger
+
+    Exactly one worker holds it and runs the singleton jobs (model warm-up,
+    maintenance). The kernel releases a flock when its process exits, so the
+    worker uvicorn or gunicorn starts in place of a dead leader takes over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
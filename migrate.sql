@@ -0,0 +1,133 @@
+-- Upgrade a database created by an earlier init.sql to the current schema.
+-- init.sql only runs when the postgres volume is empty, so existing
+-- deployments have to run this once (see "Upgrading the Database" in
+-- SETUP.md). Every step checks what is already there, so it is safe to run
+-- again, including after a failed attempt.
+
+\c ollama_logs
+
+-- 1. The first releases stored request_logs as a plain table with the full
+-- prompt and response inline. Move it aside so init.sql can create the
+-- partitioned table under the same name; its rows are copied over in step 3.
+-- The names of its primary key, sequence and indexes are freed too.
+DO $$
+DECLARE
+    seq TEXT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('request_logs') AND relkind = 'r') THEN
+        seq := pg_get_serial_sequence('request_logs', 'id');
+        ALTER TABLE request_logs RENAME TO request_logs_unpartitioned;
+        IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'request_logs_pkey'
+                   AND conrelid = 'request_logs_unpartitioned'::regclass) THEN
+            ALTER TABLE request_logs_unpartitioned RENAME CONSTRAINT request_logs_pkey TO request_logs_unpartitioned_pkey;
+        END IF;
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s RENAME TO request_logs_unpartitioned_id_seq', seq);
+        END IF;
+        DROP INDEX IF EXISTS idx_timestamp, idx_api_key, idx_model, idx_created_at,
+            idx_request_logs_ok_recent, idx_request_logs_prompt_hash, idx_request_logs_response_hash;
+        RAISE NOTICE 'Renamed the unpartitioned request_logs to request_logs_unpartitioned';
+    END IF;
+END $$;
+
+-- 2. Create whatever is missing: the partitioned request_logs, request_bodies,
+-- rollups and functions. Its ALTER TABLE ... ADD COLUMN IF NOT EXISTS adds
+-- columns a partitioned request_logs from an earlier release lacks.
+\ir init.sql
+
+-- 3. Copy rows of the old table into the partitioned one, with their prompts
+-- and responses moved to request_bodies. Ids are kept, so the rollup
+-- watermark stays valid and rows already copied are skipped on a rerun.
+DO $$
+DECLARE
+    month_start DATE;
+    shared_columns TEXT;
+    copied BIGINT;
+BEGIN
+    IF to_regclass('request_logs_unpartitioned') IS NULL THEN
+        RETURN;
+    END IF;
+
+    -- Monthly partitions for every month the old rows cover, so they don't
+    -- all land in the default partition
+    FOR month_start IN
+        SELECT generate_series(DATE_TRUNC('month', MIN(timestamp)), DATE_TRUNC('month', LOCALTIMESTAMP),
+                               INTERVAL '1 month')::DATE
+        FROM request_logs_unpartitioned
+    LOOP
+        IF to_regclass('request_logs_' || TO_CHAR(month_start, 'YYYY_MM')) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF request_logs FOR VALUES FROM (%L) TO (%L)',
+                'request_logs_' || TO_CHAR(month_start, 'YYYY_MM'), month_start, month_start + INTERVAL '1 month'
+            );
+        END IF;
+    END LOOP;
+
+    INSERT INTO request_bodies (hash, body)
+    SELECT encode(sha256(convert_to(body, 'UTF8')), 'hex'), body
+    FROM (
+        SELECT prompt AS body FROM request_logs_unpartitioned
+        UNION
+        SELECT response FROM request_logs_unpartitioned
+    ) bodies
+    WHERE body <> ''
+    ON CONFLICT (hash) DO NOTHING;
+
+    -- Columns both tables have; the old table may come from any release
+    -- between the first one and partitioning
+    SELECT string_agg(quote_ident(old_column.column_name), ', ' ORDER BY old_column.ordinal_position)
+    INTO shared_columns
+    FROM information_schema.columns old_column
+    JOIN information_schema.columns new_column
+      ON new_column.table_schema = old_column.table_schema AND new_column.table_name = 'request_logs'
+     AND new_column.column_name = old_column.column_name
+    WHERE old_column.table_schema = current_schema() AND old_column.table_name = 'request_logs_unpartitioned'
+      AND old_column.column_name NOT IN ('prompt_hash', 'response_hash', 'prompt_preview', 'response_preview');
+
+    EXECUTE format(
+        'INSERT INTO request_logs (%1$s, prompt_hash, response_hash, prompt_preview, response_preview)
+         SELECT %1$s,
+                encode(sha256(convert_to(NULLIF(prompt, %2$L), %3$L)), %4$L),
+                encode(sha256(convert_to(NULLIF(response, %2$L), %3$L)), %4$L),
+                LEFT(prompt, 100), LEFT(response, 100)
+         FROM request_logs_unpartitioned
+         ON CONFLICT DO NOTHING',
+        shared_columns, '', 'UTF8', 'hex'
+    );
+    GET DIAGNOSTICS copied = ROW_COUNT;
+
+    -- New rows continue after the copied ids
+    PERFORM setval(pg_get_serial_sequence('request_logs', 'id'),
+                   GREATEST((SELECT MAX(id) FROM request_logs), 1));
+    RAISE NOTICE 'Copied % rows from request_logs_unpartitioned; drop it once the dashboard shows them', copied;
+END $$;
+
+-- 4. A request_logs partitioned by an earlier release may still hold the
+-- prompt and response inline. Move them to request_bodies; the columns are
+-- left in place (the logger no longer writes them) and can be dropped later.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'request_logs' AND column_name = 'prompt'
+    ) THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO request_bodies (hash, body)
+    SELECT encode(sha256(convert_to(body, 'UTF8')), 'hex'), body
+    FROM (
+        SELECT prompt AS body FROM request_logs WHERE prompt_hash IS NULL
+        UNION
+        SELECT response FROM request_logs WHERE response_hash IS NULL
+    ) bodies
+    WHERE body <> ''
+    ON CONFLICT (hash) DO NOTHING;
+
+    UPDATE request_logs SET
+        prompt_hash = encode(sha256(convert_to(NULLIF(prompt, ''), 'UTF8')), 'hex'),
+        response_hash = encode(sha256(convert_to(NULLIF(response, ''), 'UTF8')), 'hex'),
+        prompt_preview = LEFT(prompt, 100),
+        response_preview = LEFT(response, 100)
+    WHERE (prompt_hash IS NULL AND prompt <> '') OR (response_hash IS NULL AND response <> '');
+END $$;
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The logger and dashboard are flat-module apps run from their own directories
+sys.path.insert(0, os.path.join(ROOT_DIR, "logger"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "dashboard"))
+sys.path.insert(0, ROOT_DIR)
+
+MODEL = "llama3.1:8b"
+CHAT = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}], "stream": False,
+        "options": {"num_predict": 8}}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake(**env) -> tuple:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fake_ollama:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "critical"],
+        cwd=ROOT_DIR, env=dict(os.environ, FAKE_MODELS=MODEL, **env)
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/api/version", timeout=1).status_code == 200:
+                return url, process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake_ollama did not start")
+
+
+def run_logger(monkeypatch, tmp_path, urls, scenario, warm=None, eject_seconds=30.0, **settings):
+    """Run the logger in-process in front of `urls`; `warm` backends start with MODEL loaded
+
+    `settings` override app globals. Returns the MemoryLogWriter, drained, so
+    tests can check the logged rows.
+    """
+    import app as logger_app
+
+    for name, value in dict({
+        "OLLAMA_URLS": urls,
+        "LOG_SINK": "memory",
+        "LOGGER_SHARED_DIR": str(tmp_path),
+        "WEB_CONCURRENCY": 1,
+        "BACKEND_HEALTH_INTERVAL": 0,
+        "BACKEND_EJECT_AFTER": 2,
+        "BACKEND_EJECT_SECONDS": eject_seconds,
+        "UPSTREAM_RETRIES": 2,
+        "UPSTREAM_CONCURRENCY": 0,
+        "RESPONSE_CACHE_ENABLED": False,
+        "COALESCE_MODE": "off",
+        "WARMUP_MODELS": [],
+        "MODEL_CATALOG_INTERVAL": 0,
+    }, **settings).items():
+        monkeypatch.setattr(logger_app, name, value)
+
+    async def main():
+        await logger_app.startup()
+        writer = logger_app.log_writer
+        try:
+            pool = logger_app.backend_pool
+            for url in warm or ():
+                # Model affinity makes the router try this backend first
+                next(b for b in pool.backends if b.url == url).loaded_models.add(MODEL)
+            transport = httpx.ASGITransport(app=logger_app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://logger", timeout=30) as client:
+                await scenario(client, {b.url: b for b in pool.backends}, pool)
+        finally:
+            await logger_app.shutdown()
+        return writer
+
+    return asyncio.run(main())
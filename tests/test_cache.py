@@ -0,0 +1,116 @@
+"""Response cache keys, expiry, and replay through the logger against fake_ollama.py"""
+
+import asyncio
+import json
+
+import pytest
+
+import cache as cache_module
+from cache import ResponseCache, is_deterministic, request_key
+from conftest import CHAT, MODEL, run_logger, start_fake
+
+
+@pytest.fixture(scope="module")
+def backend():
+    url, process = start_fake()
+    yield url
+    process.terminate()
+    process.wait(timeout=10)
+
+
+def test_key_ignores_json_key_order_and_transport_fields():
+    first = {"model": MODEL, "messages": [{"role": "user", "content": "hi"}],
+             "options": {"temperature": 0, "num_predict": 8}, "stream": False}
+    reordered = {"options": {"num_predict": 8, "temperature": 0}, "stream": True, "keep_alive": "5m",
+                 "messages": [{"content": "hi", "role": "user"}], "model": MODEL}
+    assert request_key("api/chat", first) == request_key("api/chat", reordered)
+
+
+def test_key_depends_on_path_and_semantic_fields():
+    body = {"model": MODEL, "prompt": "hi", "options": {"temperature": 0}}
+    key = request_key("api/generate", body)
+    assert request_key("api/chat", body) != key
+    assert request_key("api/generate", dict(body, prompt="hi!")) != key
+    assert request_key("api/generate", dict(body, options={"temperature": 0, "num_predict": 8})) != key
+
+
+@pytest.mark.parametrize("body, expected", [
+    ({"options": {"temperature": 0}}, True),
+    ({"temperature": 0}, True),
+    ({"options": {"temperature": 0.7, "seed": 42}}, True),
+    ({"seed": 0}, True),
+    ({}, False),
+    ({"options": {"temperature": 0.7}}, False),
+    ({"options": {"top_k": 1}}, False),
+    ({"options": "temperature=0"}, False),
+])
+def test_only_reproducible_requests_are_cacheable(body, expected):
+    assert is_deterministic(dict(body, model=MODEL, prompt="hi")) is expected
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put("key", MODEL, "answer", {})
+
+    async def lookup():
+        return await cache.get("key")
+
+    now[0] += 59
+    assert asyncio.run(lookup()).content == "answer"
+    now[0] += 2
+    assert asyncio.run(lookup()) is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses, cache.bytes) == (1, 1, 0)
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_bytes=3 * 400)
+    for key in ("a", "b", "c"):
+        cache.put(key, MODEL, key * 10, {})
+    assert asyncio.run(cache.get("a")) is not None
+    cache.put("d", MODEL, "d" * 10, {})
+    assert asyncio.run(cache.get("b")) is None
+    assert asyncio.run(cache.get("a")) is not None
+    assert cache.evictions == 1
+
+
+def streamed_content(body: bytes) -> tuple:
+    """(text, usage) of an OpenAI chunk stream with one JSON chunk per line"""
+    chunks = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+    text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+    return text, chunks[-1].get("usage")
+
+
+def test_deterministic_requests_are_replayed_from_cache(monkeypatch, tmp_path, backend):
+    deterministic = dict(CHAT, options={"num_predict": 8, "temperature": 0})
+    sampled = dict(CHAT, options={"num_predict": 8, "temperature": 0.7})
+
+    async def scenario(client, by_url, pool):
+        upstream = by_url[backend]
+        first = await client.post("/api/chat", json=deterministic)
+        assert first.status_code == 200
+        content = first.json()["choices"][0]["message"]["content"]
+        assert content and upstream.requests == 1
+
+        # Same request with its keys in another order: answered without inference
+        again = await client.post("/api/chat", json=dict(reversed(list(deterministic.items()))))
+        assert again.json()["choices"][0]["message"]["content"] == content
+
+        # stream=true gets the cached answer as a stream
+        streamed = await client.post("/api/chat", json=dict(deterministic, stream=True))
+        assert streamed.status_code == 200
+        text, usage = streamed_content(streamed.content)
+        assert text == content
+        assert usage["completion_tokens"] > 0
+        assert upstream.requests == 1
+
+        # Sampled requests always go upstream
+        for _ in range(2):
+            assert (await client.post("/api/chat", json=sampled)).status_code == 200
+        assert upstream.requests == 3
+
+    writer = run_logger(monkeypatch, tmp_path, [backend], scenario, RESPONSE_CACHE_ENABLED=True)
+    cache_hit = list(writer.columns).index("cache_hit")
+    assert [row[cache_hit] for row in writer.rows] == [False, True, True, False, False]
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+async def collect(flight) -> list:
+    return [item async for item in flight.subscribe()]
+
+
+def producer(items, gate: asyncio.Event, error: Exception = None):
+    """Publishes items, waiting on gate after the first so followers can join mid-flight"""
+    async def produce(flight):
+        flight.start(200)
+        for index, item in enumerate(items):
+            flight.publish(item)
+            if index == 0:
+                await gate.wait()
+        if error is not None:
+            raise error
+    return produce
+
+
+def test_followers_attach_to_the_leader_and_see_every_item():
+    async def run():
+        single = SingleFlight()
+        gate = asyncio.Event()
+        leader, leader_coalesced = single.stream("key", producer(["a", "b", "c"], gate))
+        leader_read = asyncio.ensure_future(collect(leader))
+        await asyncio.sleep(0)
+        # Joins after "a" was published
+        follower, follower_coalesced = single.stream("key", producer(["x"], gate))
+        other, other_coalesced = single.stream("other key", producer(["z"], asyncio.Event()))
+        gate.set()
+
+        assert follower is leader and other is not leader
+        assert (leader_coalesced, follower_coalesced, other_coalesced) == (False, True, False)
+        assert await asyncio.gather(leader_read, collect(follower)) == [["a", "b", "c"], ["a", "b", "c"]]
+        assert (single.leaders, single.coalesced) == (2, 1)
+        other.task.cancel()
+
+    asyncio.run(run())
+
+
+def test_leader_error_reaches_every_follower():
+    async def run():
+        single = SingleFlight()
+        gate = asyncio.Event()
+        flight, _ = single.stream("key", producer(["a"], gate, error=ConnectionError("upstream reset")))
+        follower, _ = single.stream("key", producer([], gate))
+        reads = [asyncio.ensure_future(collect(flight)), asyncio.ensure_future(collect(follower))]
+        gate.set()
+        return await asyncio.gather(*reads, return_exceptions=True), single
+
+    results, single = asyncio.run(run())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    # The next request starts a fresh generation
+    assert single.in_flight() == 0
+
+
+def test_leader_disconnect_does_not_cancel_followers():
+    async def run():
+        single = SingleFlight()
+        gate = asyncio.Event()
+        flight, _ = single.stream("key", producer(["a", "b"], gate))
+        single.stream("key", producer([], gate))
+        leader_read = asyncio.ensure_future(collect(flight))
+        await asyncio.sleep(0)
+        # The leader's client goes away
+        leader_read.cancel()
+        flight.release()
+        gate.set()
+        return flight, await collect(flight)
+
+    flight, items = asyncio.run(run())
+    assert items == ["a", "b"]
+    assert not flight.cancelled and flight.error is None
+
+
+def test_generation_is_cancelled_when_every_client_leaves():
+    async def run():
+        single = SingleFlight()
+        flight, _ = single.stream("key", producer(["a", "b"], asyncio.Event()))
+        single.stream("key", producer([], asyncio.Event()))
+        await asyncio.sleep(0)
+        flight.release()
+        flight.release()
+        await asyncio.gather(flight.task, return_exceptions=True)
+        return flight, single
+
+    flight, single = asyncio.run(run())
+    assert flight.cancelled and flight.task.cancelled()
+    assert single.in_flight() == 0
+
+
+def test_call_shares_one_result():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": 42}
+
+    async def run():
+        single = SingleFlight()
+        return await asyncio.gather(*(single.call("key", fetch) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [coalesced for _, coalesced in results] == [False, True, True]
+    assert all(result == {"answer": 42} for result, _ in results)
+
+
+def test_call_error_reaches_every_caller():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("upstream reset")
+
+    async def run():
+        single = SingleFlight()
+        return await asyncio.gather(*(single.call("key", fetch) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(run()))
+
+
+def test_cancelled_leader_call_does_not_cancel_followers():
+    started = []
+
+    async def fetch():
+        started.append(1)
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def run():
+        single = SingleFlight()
+        leader = asyncio.ensure_future(single.call("key", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single.call("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ("answer", True)
+    assert len(started) == 1
@@ -0,0 +1,76 @@
+"""A client leaving mid-stream stops the upstream generation, against fake_ollama.py"""
+
+import asyncio
+import json
+
+import pytest
+
+import app as logger_app
+from conftest import CHAT, run_logger, start_fake
+
+
+@pytest.fixture(scope="module")
+def backend():
+    url, process = start_fake()
+    yield url
+    process.terminate()
+    process.wait(timeout=10)
+
+
+async def stream_then_disconnect(path: str, body: dict, headers: dict, after_chunks: int) -> list:
+    """Call the logger's ASGI app directly and disconnect after `after_chunks` body chunks"""
+    raw = json.dumps(body).encode()
+    request_sent = False
+    disconnected = asyncio.Event()
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": raw, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            if len(chunks) >= after_chunks:
+                disconnected.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 40000), "server": ("logger", 80),
+    }
+    await asyncio.wait_for(logger_app.app(scope, receive, send), 10)
+    return chunks
+
+
+def test_disconnect_mid_stream_cancels_upstream_and_logs_once(monkeypatch, tmp_path, backend):
+    # 400 tokens at 20 tokens/s: the generation would run for 20 seconds
+    body = dict(CHAT, stream=True, options={"num_predict": 400})
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer sk-test",
+               "X-Fake-Tokens-Per-Second": "20"}
+
+    async def scenario(client, by_url, pool):
+        upstream = by_url[backend]
+        chunks = await stream_then_disconnect("/api/chat", body, headers, after_chunks=3)
+        assert len(chunks) >= 3
+        # The upstream response is closed and the backend slot handed back
+        for _ in range(50):
+            if upstream.outstanding == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert upstream.outstanding == 0
+        assert upstream.requests == 1
+
+    writer = run_logger(monkeypatch, tmp_path, [backend], scenario)
+    rows = [dict(zip(writer.columns, row)) for row in writer.rows]
+    assert len(rows) == 1
+    row = rows[0]
+    assert (row["http_status"], row["cancelled"], row["api_key"]) == (499, True, "sk-test")
+    assert row["error_message"] == "client disconnected"
+    # The partial answer the client received is logged
+    assert 0 < row["response_chars"] < 400 * 3
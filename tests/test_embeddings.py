@@ -0,0 +1,151 @@
+import asyncio
+import base64
+from array import array
+
+import pytest
+
+from embeddings import Embedding, EmbeddingBatcher, EmbeddingError, VectorCache, encode_vector
+
+PARAMS = {"model": "nomic-embed-text"}
+
+
+class FakeUpstream:
+    """Records every batch and embeds a text as [len(text)]; texts containing "bad" make Ollama return 400"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, params, texts, api_key):
+        self.calls.append((api_key, list(texts)))
+        await asyncio.sleep(0)
+        if any("bad" in text for text in texts):
+            raise EmbeddingError(400, "input length exceeds the context length")
+        return [[float(len(text))] for text in texts], 10 * len(texts), 0.01
+
+
+def test_concurrent_requests_of_one_key_share_a_batch():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=32, window=0.01)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.embed(PARAMS, ["a", "bb"], "key-1"),
+            batcher.embed(PARAMS, ["ccc"], "key-1"),
+        )
+
+    first, second = asyncio.run(run())
+    assert upstream.calls == [("key-1", ["a", "bb", "ccc"])]
+    assert [e.vector for e in first] == [[1.0], [2.0]]
+    assert [e.vector for e in second] == [[3.0]]
+    # Character-weighted share of the batch's 30 tokens
+    assert [e.tokens for e in first + second] == pytest.approx([5.0, 10.0, 15.0])
+
+
+def test_keys_and_params_are_batched_separately():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=32, window=0.01)
+
+    async def run():
+        await asyncio.gather(
+            batcher.embed(PARAMS, ["a"], "key-1"),
+            batcher.embed(PARAMS, ["b"], "key-2"),
+            batcher.embed({"model": "other"}, ["c"], "key-1"),
+        )
+
+    asyncio.run(run())
+    assert sorted(upstream.calls) == [("key-1", ["a"]), ("key-1", ["c"]), ("key-2", ["b"])]
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=2, window=60)
+
+    async def run():
+        return await asyncio.wait_for(batcher.embed(PARAMS, ["a", "b", "c", "d"], "key-1"), 5)
+
+    results = asyncio.run(run())
+    assert upstream.calls == [("key-1", ["a", "b"]), ("key-1", ["c", "d"])]
+    assert [e.vector for e in results] == [[1.0]] * 4
+
+
+def test_partial_batch_is_sent_after_the_window():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=32, window=0.02)
+
+    async def run():
+        task = asyncio.ensure_future(batcher.embed(PARAMS, ["a"], "key-1"))
+        await asyncio.sleep(0.005)
+        assert upstream.calls == []
+        return await asyncio.wait_for(task, 5)
+
+    assert [e.vector for e in asyncio.run(run())] == [[1.0]]
+    assert upstream.calls == [("key-1", ["a"])]
+
+
+def test_bad_input_fails_only_its_own_request():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=32, window=0.01)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.embed(PARAMS, ["a", "bb"], "key-1"),
+            batcher.embed(PARAMS, ["bad"], "key-1"),
+            batcher.embed(PARAMS, ["cccc"], "key-1"),
+            return_exceptions=True,
+        )
+
+    good, bad, other = asyncio.run(run())
+    assert [e.vector for e in good] == [[1.0], [2.0]]
+    assert [e.vector for e in other] == [[4.0]]
+    assert isinstance(bad, EmbeddingError) and bad.status == 400
+    assert upstream.calls[0] == ("key-1", ["a", "bb", "bad", "cccc"])
+    assert batcher.splits > 0
+
+
+def test_upstream_errors_are_not_split():
+    calls = []
+
+    async def unavailable(params, texts, api_key):
+        calls.append(texts)
+        raise EmbeddingError(503, "model is loading")
+
+    batcher = EmbeddingBatcher(unavailable, max_batch=32, window=0.01)
+    with pytest.raises(EmbeddingError):
+        asyncio.run(batcher.embed(PARAMS, ["a", "b", "c"], "key-1"))
+    assert calls == [["a", "b", "c"]]
+
+
+def test_cached_inputs_skip_the_upstream():
+    upstream = FakeUpstream()
+    batcher = EmbeddingBatcher(upstream, max_batch=32, window=0.01, cache=VectorCache())
+
+    async def run():
+        await batcher.embed(PARAMS, ["a", "bb"], "key-1")
+        return await batcher.embed(PARAMS, ["bb", "ccc"], "key-2")
+
+    results = asyncio.run(run())
+    assert upstream.calls == [("key-1", ["a", "bb"]), ("key-2", ["ccc"])]
+    assert [(e.vector, e.cached) for e in results] == [([2.0], True), ([3.0], False)]
+
+
+def test_vector_cache_evicts_least_recently_used():
+    cache = VectorCache(max_bytes=2 * (4 * 4 + 200))
+    for text in ("a", "b"):
+        cache.put("group", text, Embedding([1.0, 2.0, 3.0, 4.0], 1, 0.0))
+    assert cache.get("group", "a") is not None
+    cache.put("group", "c", Embedding([5.0, 6.0, 7.0, 8.0], 1, 0.0))
+    assert cache.get("group", "b") is None
+    assert cache.get("group", "a").vector == [1.0, 2.0, 3.0, 4.0]
+    assert cache.get("other group", "a") is None
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_encode_vector():
+    vector = [0.5, -1.25, 3.0]
+    assert encode_vector(vector, "float") == vector
+    decoded = array("f")
+    decoded.frombytes(base64.b64decode(encode_vector(vector, "base64")))
+    assert decoded.tolist() == vector
+    # Little-endian float32, as OpenAI clients decode it
+    assert base64.b64decode(encode_vector([1.0], "base64")) == b"\x00\x00\x80\x3f"
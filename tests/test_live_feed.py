@@ -0,0 +1,139 @@
+import asyncio
+import json
+from datetime import datetime
+
+import api as dashboard
+
+
+def log_row(row_id: int, http_status: int = 200) -> dict:
+    return {
+        "id": row_id, "timestamp": datetime(2025, 1, 1, 12, 0, row_id % 60), "ip_address": "127.0.0.1",
+        "api_key": "sk-test", "model": "llama3.1:8b", "prompt_preview": f"prompt {row_id}",
+        "response_preview": "", "prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2,
+        "duration_seconds": 0.5, "power_wh": 0.01, "cost_dollars": 0.0001,
+        "http_status": http_status, "error_message": None,
+    }
+
+
+class FakeTable:
+    """request_logs as seen by the tail query: committed rows only"""
+
+    def __init__(self):
+        self.committed = {}
+
+    def commit(self, *rows):
+        self.committed.update((row["id"], row) for row in rows)
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def fetchval(self, query):
+        return max(self.committed, default=0)
+
+    async def fetch(self, query, last_id, gaps, limit):
+        ids = sorted(i for i in self.committed if i > last_id or i in gaps)
+        return [self.committed[i] for i in ids[:limit]]
+
+
+def pushed_ids(queue: asyncio.Queue) -> list:
+    ids = []
+    while not queue.empty():
+        event = queue.get_nowait().decode()
+        ids += [log["id"] for log in json.loads(event.split("data: ", 1)[1])["logs"]]
+    return sorted(ids)
+
+
+def test_late_commit_below_last_id_is_pushed(monkeypatch):
+    table = FakeTable()
+
+    async def get_db_pool():
+        return table
+
+    monkeypatch.setattr(dashboard, "get_db_pool", get_db_pool)
+
+    async def run():
+        feed = dashboard.LiveFeed()
+        queue: asyncio.Queue = asyncio.Queue()
+        feed.subscribers.add(queue)
+        table.commit(log_row(10))
+        await feed._publish()
+
+        # Two loggers COPY 11-12 and 13-14; the second batch commits first
+        table.commit(log_row(13), log_row(14, http_status=500))
+        await feed._publish()
+        assert pushed_ids(queue) == [13]
+        assert feed.stats()["pending_gaps"] == 2
+
+        table.commit(log_row(11), log_row(12))
+        await feed._publish()
+        assert pushed_ids(queue) == [11, 12]
+        assert feed.stats()["late_rows"] == 2
+        assert feed.stats()["pending_gaps"] == 0
+
+        await feed._publish()
+        assert pushed_ids(queue) == []
+
+    asyncio.run(run())
+
+
+def test_gaps_expire_after_settle_seconds(monkeypatch):
+    table = FakeTable()
+
+    async def get_db_pool():
+        return table
+
+    monkeypatch.setattr(dashboard, "get_db_pool", get_db_pool)
+
+    async def run():
+        feed = dashboard.LiveFeed(settle_seconds=0)
+        feed.subscribers.add(asyncio.Queue())
+        await feed._publish()
+        table.commit(log_row(5))
+        await feed._publish()
+        assert feed.stats()["pending_gaps"] == 4
+        await asyncio.sleep(0.01)
+        await feed._publish()
+        assert feed.stats()["pending_gaps"] == 0
+
+    asyncio.run(run())
+
+
+def test_task_stops_with_last_subscriber(monkeypatch):
+    started, closed = [], []
+
+    class Listener:
+        async def add_listener(self, channel, callback):
+            started.append(channel)
+
+        async def close(self):
+            closed.append(True)
+
+    async def connect(**kwargs):
+        return Listener()
+
+    async def get_db_pool():
+        return FakeTable()
+
+    monkeypatch.setattr(dashboard.asyncpg, "connect", connect)
+    monkeypatch.setattr(dashboard, "get_db_pool", get_db_pool)
+
+    async def run():
+        feed = dashboard.LiveFeed(poll_interval=0.01, min_interval=0)
+        first, second = feed.subscribe(), feed.subscribe()
+        task = feed._task
+        await asyncio.sleep(0.05)
+        feed.unsubscribe(first)
+        assert feed._task is task
+        feed.unsubscribe(second)
+        assert feed._task is None
+        await asyncio.sleep(0.05)
+        assert task.done()
+        assert started == [dashboard.LIVE_CHANNEL] and closed == [True]
+
+    asyncio.run(run())
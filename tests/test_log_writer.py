@@ -0,0 +1,144 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from log_writer import LogWriter
+
+
+class FakeConnection:
+    """Accepts COPY batches unless they contain a row whose first value is "bad" """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def transaction(self):
+        return self.pool.acquire()
+
+    async def execute(self, *args):
+        return None
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.pool.copies += 1
+        if any(record[0] == "bad" for record in records):
+            raise asyncpg.StringDataRightTruncationError("value too long for type character varying(255)")
+        self.pool.rows.extend(records)
+
+
+class FakePool:
+    def __init__(self, broken: bool = False):
+        self.rows = []
+        self.copies = 0
+        self.broken = broken
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        if self.broken:
+            raise ConnectionRefusedError("database is down")
+        return FakeConnection(self)
+
+    async def __aexit__(self, *args):
+        return False
+
+
+def write(pool, records):
+    writer = LogWriter(pool, "request_logs", ["api_key"], batch_size=len(records))
+    asyncio.run(writer._flush([((value,), ()) for value in records]))
+    return writer
+
+
+def test_bad_row_fails_alone():
+    pool = FakePool()
+    records = [f"key-{i}" for i in range(10)]
+    records[6] = "bad"
+    writer = write(pool, records)
+    assert writer.failed == 1
+    assert writer.written == 9
+    assert sorted(row[0] for row in pool.rows) == sorted(r for r in records if r != "bad")
+
+
+def test_good_batch_is_one_copy():
+    pool = FakePool()
+    writer = write(pool, [f"key-{i}" for i in range(10)])
+    assert (writer.written, writer.failed, pool.copies) == (10, 0, 1)
+
+
+def test_database_errors_are_not_split():
+    writer = write(FakePool(broken=True), [f"key-{i}" for i in range(10)])
+    assert (writer.written, writer.failed) == (0, 10)
+
+
+class BodyRecordingPool(FakePool):
+    """Keeps request_bodies as a dict, so tests can prune it between batches"""
+
+    def __init__(self):
+        super().__init__()
+        self.bodies = {}
+
+    async def __aenter__(self):
+        pool = self
+
+        class Connection(FakeConnection):
+            async def execute(self, query, *args):
+                if "INSERT INTO request_bodies" in query:
+                    for body_hash, text in zip(*args):
+                        pool.bodies.setdefault(body_hash, text)
+
+        return Connection(self)
+
+
+def test_pruned_body_is_written_again():
+    pool = BodyRecordingPool()
+    writer = LogWriter(pool, "request_logs", ["api_key"], body_table="request_bodies")
+
+    async def run():
+        await writer._flush([(("key-1",), [("h1", "same prompt")]), (("key-2",), [("h1", "same prompt")])])
+        assert pool.bodies == {"h1": "same prompt"}
+        assert (writer.bodies_written, writer.bodies_skipped) == (1, 1)
+        # prune_request_bodies() removes it once no row references it
+        pool.bodies.clear()
+        await writer._flush([(("key-3",), [("h1", "same prompt")])])
+
+    asyncio.run(run())
+    assert pool.bodies == {"h1": "same prompt"}
+
+
+class SchemaPool(FakePool):
+    """information_schema.columns answers from a {table: [columns]} dict"""
+
+    def __init__(self, tables):
+        super().__init__()
+        self.tables = tables
+
+    async def __aenter__(self):
+        pool = self
+
+        class Connection(FakeConnection):
+            async def fetch(self, query, tables):
+                return [
+                    {"table_name": table, "column_name": column}
+                    for table in tables
+                    for column in pool.tables.get(table, [])
+                ]
+
+        return Connection(self)
+
+
+def test_check_schema_accepts_current_tables():
+    pool = SchemaPool({"request_logs": ["id", "api_key", "prompt_hash"], "request_bodies": ["hash", "body"]})
+    writer = LogWriter(pool, "request_logs", ["api_key", "prompt_hash"], body_table="request_bodies")
+    asyncio.run(writer.check_schema())
+
+
+def test_check_schema_rejects_old_request_logs():
+    # The first release's table: prompt/response inline and no request_bodies
+    pool = SchemaPool({"request_logs": ["id", "api_key", "prompt", "response"]})
+    writer = LogWriter(pool, "request_logs", ["api_key", "prompt_hash"], body_table="request_bodies")
+    with pytest.raises(RuntimeError) as error:
+        asyncio.run(writer.check_schema())
+    message = str(error.value)
+    assert "request_logs.prompt_hash" in message
+    assert "request_bodies.hash" in message
+    assert "migrate.sql" in message
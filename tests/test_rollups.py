@@ -0,0 +1,79 @@
+import random
+import re
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import api as dashboard
+
+
+def bucket(ts: datetime, size: str) -> datetime:
+    if size == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if size == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def sql_time(ts: datetime) -> str:
+    # Fixed-width text, so SQLite's string comparison orders it like a timestamp
+    return ts.isoformat(" ", "microseconds")
+
+
+def count(rows: list, start: datetime, watermark: int) -> int:
+    """Requests counted by the real ROLLUP_SOURCES text, run in SQLite over (id, timestamp, http_status) rows
+
+    The rollup tables hold what rollup_request_logs() would have folded in
+    up to the watermark.
+    """
+    db = sqlite3.connect(":memory:")
+    db.execute("""CREATE TABLE request_logs (id INTEGER, timestamp TEXT, total_tokens INTEGER,
+                  duration_seconds REAL, power_wh REAL, cost_dollars REAL, http_status INTEGER, error_message TEXT)""")
+    db.executemany("INSERT INTO request_logs VALUES (?, ?, 1, 0, 0, 0, ?, NULL)",
+                   [(row_id, sql_time(ts), status) for row_id, ts, status in rows])
+    for size in ("minute", "hour", "day"):
+        db.execute(f"""CREATE TABLE request_rollup_{size} (bucket TEXT, http_status INTEGER, requests INTEGER,
+                       total_tokens INTEGER, duration_seconds REAL, power_wh REAL, cost_dollars REAL, errors INTEGER)""")
+        buckets = Counter((bucket(ts, size), status) for row_id, ts, status in rows if row_id <= watermark)
+        db.executemany(f"INSERT INTO request_rollup_{size} VALUES (?, ?, ?, 0, 0, 0, 0, 0)",
+                       [(sql_time(b), status, n) for (b, status), n in buckets.items()])
+
+    # PostgreSQL's $n placeholders are SQLite's ?n
+    sources = re.sub(r"\$(\d)", r"?\1", dashboard.ROLLUP_SOURCES)
+    params = [sql_time(bound) for bound in dashboard.rollup_bounds(start)] + [watermark, sql_time(start)]
+    return db.execute(f"SELECT COALESCE(SUM(requests), 0) FROM ({sources}) sources", params).fetchone()[0]
+
+
+@pytest.mark.parametrize("age", [
+    timedelta(minutes=5, seconds=17), timedelta(hours=3, minutes=23, seconds=5),
+    timedelta(days=2, hours=5, minutes=37), timedelta(days=30, hours=1, minutes=37, seconds=12),
+    timedelta(days=400, minutes=1),
+])
+def test_totals_are_exact_from_any_start(age):
+    now = datetime.utcnow()
+    rng = random.Random(age.total_seconds())
+    # Rows over the last 401 days, denser near the start of the range
+    timestamps = sorted(now - timedelta(seconds=rng.uniform(0, 401 * 86400)) for _ in range(3000))
+    start = now - age
+    timestamps += sorted(start + timedelta(seconds=rng.uniform(-7200, 7200)) for _ in range(500))
+    rows = [(row_id, ts, 500 if row_id % 17 == 0 else 200) for row_id, ts in enumerate(sorted(timestamps), 1)]
+    watermark = len(rows) - 50
+
+    expected = sum(1 for _, ts, status in rows if ts >= start and status == 200)
+    assert count(rows, start, watermark) == expected
+
+
+def test_bounds_are_whole_buckets_at_or_after_start():
+    start = datetime.utcnow() - timedelta(days=1, minutes=7, seconds=3)
+    minute, hour, day = dashboard.rollup_bounds(start)
+    assert start <= minute <= hour <= day
+    assert minute - start < timedelta(minutes=1)
+    assert (minute.second, hour.minute, day.hour) == (0, 0, 0)
+
+
+def test_old_starts_skip_minute_rollups():
+    start = datetime.utcnow() - timedelta(days=30, minutes=23)
+    minute, hour, _ = dashboard.rollup_bounds(start)
+    assert minute == hour
@@ -0,0 +1,102 @@
+"""Backend routing, retries and ejection against fake_ollama.py servers"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import CHAT, MODEL, free_port, run_logger, start_fake
+
+
+@pytest.fixture(scope="module")
+def backends():
+    started = {
+        "healthy": start_fake(),
+        "other": start_fake(),
+        "unavailable": start_fake(FAKE_FAIL_STATUS="503"),
+        "dropping": start_fake(FAKE_DROP_AFTER_CHUNKS="2"),
+    }
+    urls = {name: url for name, (url, _) in started.items()}
+    # Nothing listens here: connections are refused
+    urls["refused"] = f"http://127.0.0.1:{free_port()}"
+    yield urls
+    for _, process in started.values():
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.mark.parametrize("failing", ["refused", "unavailable"])
+def test_retry_before_first_byte_then_eject(monkeypatch, tmp_path, backends, failing):
+    bad, good = backends[failing], backends["healthy"]
+
+    async def scenario(client, by_url, pool):
+        for attempt in range(4):
+            response = await client.post("/api/chat", json=CHAT)
+            assert response.status_code == 200, response.text
+            assert response.json()["choices"][0]["message"]["content"]
+        # Tried (warm) and retried twice, then skipped once ejected
+        assert by_url[bad].failures == 2
+        assert by_url[bad].ejections == 1
+        assert by_url[bad].stats()["ejected"]
+        assert by_url[good].requests == 4
+        assert pool.retries == 2
+
+    run_logger(monkeypatch, tmp_path, [bad, good], scenario, warm=[bad])
+
+
+def test_ejected_backend_is_readmitted_after_cooldown(monkeypatch, tmp_path, backends):
+    bad, good = backends["refused"], backends["healthy"]
+
+    async def scenario(client, by_url, pool):
+        for _ in range(3):
+            assert (await client.post("/api/chat", json=CHAT)).status_code == 200
+        assert by_url[bad].ejections == 1
+        requests_while_ejected = by_url[bad].requests
+
+        await asyncio.sleep(0.6)
+        assert not by_url[bad].stats()["ejected"]
+        # Back in rotation: tried again, fails again, ejected again; the client still gets its answer
+        by_url[bad].loaded_models.add(MODEL)
+        assert (await client.post("/api/chat", json=CHAT)).status_code == 200
+        assert by_url[bad].requests == requests_while_ejected + 1
+        assert by_url[bad].ejections == 2
+
+    run_logger(monkeypatch, tmp_path, [bad, good], scenario, warm=[bad], eject_seconds=0.5)
+
+
+def test_no_retry_after_first_byte(monkeypatch, tmp_path, backends):
+    bad, good = backends["dropping"], backends["healthy"]
+
+    async def scenario(client, by_url, pool):
+        # Headers and two chunks were already sent, so the rest can't come from
+        # another backend: the client's stream breaks off instead
+        with pytest.raises(httpx.RemoteProtocolError):
+            await client.post("/api/chat", json=dict(CHAT, stream=True))
+        assert by_url[bad].requests == 1
+        assert by_url[bad].failures == 1
+        assert by_url[good].requests == 0
+        assert pool.retries == 0
+
+    run_logger(monkeypatch, tmp_path, [bad, good], scenario, warm=[bad])
+
+
+def test_last_backend_error_is_passed_through(monkeypatch, tmp_path, backends):
+    async def scenario(client, by_url, pool):
+        response = await client.post("/api/chat", json=CHAT)
+        assert response.status_code == 503
+        assert sum(b.requests for b in by_url.values()) == 1
+
+    run_logger(monkeypatch, tmp_path, [backends["unavailable"]], scenario)
+
+
+def test_model_affinity(monkeypatch, tmp_path, backends):
+    first, second = backends["healthy"], backends["other"]
+
+    async def scenario(client, by_url, pool):
+        for _ in range(5):
+            assert (await client.post("/api/chat", json=CHAT)).status_code == 200
+        assert by_url[second].requests == 5
+        assert by_url[first].requests == 0
+        assert MODEL in by_url[second].loaded_models
+
+    run_logger(monkeypatch, tmp_path, [first, second], scenario, warm=[second])
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler
+
+
+@pytest.mark.parametrize("weight", [0, -1, float("nan")])
+def test_non_positive_weights_are_rejected(weight):
+    with pytest.raises(ValueError):
+        FairScheduler(capacity=1, weights={"k": weight})
+    with pytest.raises(ValueError):
+        FairScheduler(capacity=1, default_weight=weight)
+
+
+def test_parse_key_weights_rejects_zero():
+    from app import parse_key_weights
+
+    assert parse_key_weights("sk-a:2, sk-b:0.5") == {"sk-a": 2.0, "sk-b": 0.5}
+    with pytest.raises(ValueError, match="k"):
+        parse_key_weights("sk-a:2,k:0")
+
+
+def test_weighted_share_while_backlogged():
+    async def run():
+        scheduler = FairScheduler(capacity=1, weights={"heavy": 2, "light": 0.5})
+        await scheduler.acquire("first")
+        order = []
+
+        async def request(key):
+            await scheduler.acquire(key)
+            order.append(key)
+            scheduler.release()
+
+        tasks = [asyncio.create_task(request(key)) for key in ["heavy"] * 8 + ["light"] * 2]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return order
+
+    order = asyncio.run(run())
+    # Weight 2 against 0.5: four heavy requests per light one
+    assert order[:5].count("heavy") == 4
+    assert sorted(order) == ["heavy"] * 8 + ["light"] * 2
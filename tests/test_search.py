@@ -0,0 +1,24 @@
+from api import search_query
+
+
+def test_every_word_is_a_prefix_match():
+    assert search_query("Hel wor") == "hel:* & wor:*"
+
+
+def test_punctuation_separates_words():
+    assert search_query("don't stop-me, now.") == "don:* & t:* & stop:* & me:* & now:*"
+    assert search_query("snake_case") == "snake:* & case:*"
+
+
+def test_tsquery_operators_are_not_passed_through():
+    assert search_query("foo & bar | !baz <-> (qux):* 'x'") == "foo:* & bar:* & baz:* & qux:* & x:*"
+
+
+def test_empty_queries():
+    assert search_query("") is None
+    assert search_query("   ") is None
+    assert search_query("&|!():*<->'") is None
+
+
+def test_non_ascii_words():
+    assert search_query("Café naïve 東京") == "café:* & naïve:* & 東京:*"
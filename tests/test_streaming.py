@@ -0,0 +1,88 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from streaming import NDJSONFramer, OpenAIStreamTransformer, ResponseCollector, aiter_ndjson
+
+RECORDS = [
+    {"message": {"role": "assistant", "content": text}, "done": False}
+    for text in ("Hello", " wörld", " 你好", " 🦙🦙", "", ' "quoted"\\n', " done")
+] + [{"done": True, "eval_count": 7}]
+PAYLOAD = b"".join(json.dumps(record, ensure_ascii=False).encode() + b"\n" for record in RECORDS)
+
+
+def random_splits(data: bytes, rng: random.Random) -> list:
+    """Cut `data` at random byte offsets, including inside multi-byte characters"""
+    cuts = sorted(rng.sample(range(1, len(data)), rng.randint(1, min(40, len(data) - 1))))
+    return [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+
+def frame(chunks: list) -> list:
+    framer = NDJSONFramer()
+    lines = [line for chunk in chunks for line in framer.feed(chunk)]
+    return lines + framer.flush()
+
+
+async def parse(chunks: list) -> list:
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    return [record async for record in aiter_ndjson(source())]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_split_points(seed):
+    chunks = random_splits(PAYLOAD, random.Random(seed))
+    assert [json.loads(line) for line in frame(chunks)] == RECORDS
+    assert asyncio.run(parse(chunks)) == RECORDS
+
+
+def test_byte_at_a_time():
+    assert asyncio.run(parse([PAYLOAD[i:i + 1] for i in range(len(PAYLOAD))])) == RECORDS
+
+
+def test_multibyte_character_split_across_chunks():
+    line = json.dumps({"response": "🦙"}, ensure_ascii=False).encode() + b"\n"
+    llama = line.index("🦙".encode())
+    chunks = [line[:llama + 1], line[llama + 1:llama + 3], line[llama + 3:]]
+    assert asyncio.run(parse(chunks)) == [{"response": "🦙"}]
+
+
+def test_trailing_line_without_newline():
+    chunks = [b'{"a": 1}\n{"b"', b": 2}"]
+    assert frame(chunks) == [b'{"a": 1}', b'{"b": 2}']
+    assert asyncio.run(parse(chunks)) == [{"a": 1}, {"b": 2}]
+
+
+def test_blank_lines_are_skipped():
+    chunks = [b'\n\n{"a": 1}\n', b"  \n\r\n", b'{"b": 2}\n\n', b"  "]
+    assert frame(chunks) == [b'{"a": 1}', b'{"b": 2}']
+
+
+def test_malformed_line_is_skipped():
+    assert asyncio.run(parse([b'{"a": 1}\n{not json\n{"b": 2}\n'])) == [{"a": 1}, {"b": 2}]
+
+
+def test_line_limit():
+    framer = NDJSONFramer(max_line_bytes=8)
+    with pytest.raises(ValueError):
+        framer.feed(b"0123456789")
+
+
+def test_openai_transformer_round_trip():
+    transformer = OpenAIStreamTransformer("llama3.1:8b", completion_id="chatcmpl-test", created=1)
+    chunk = json.loads(transformer.transform({"message": {"content": ' "hi"\n'}, "done": False}))
+    assert chunk["choices"][0]["delta"] == {"content": ' "hi"\n'}
+    final = json.loads(transformer.transform({"done": True}, usage={"total_tokens": 3}))
+    assert final["choices"][0]["finish_reason"] == "stop"
+    assert final["usage"] == {"total_tokens": 3}
+
+
+def test_response_collector_truncates():
+    collector = ResponseCollector(max_chars=5)
+    for piece in ("abc", "def", "ghi"):
+        collector.append(piece)
+    assert (collector.text(), collector.total_chars, collector.truncated) == ("abcde", 9, True)
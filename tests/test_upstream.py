@@ -0,0 +1,21 @@
+from starlette.datastructures import Headers
+
+from upstream import filter_request_headers, filter_response_headers
+
+
+def test_request_headers_keep_end_to_end_fields():
+    headers = {
+        "Host": "api.example.org", "Content-Length": "42", "Connection": "keep-alive, X-Trace",
+        "Keep-Alive": "timeout=5", "X-Trace": "abc", "Proxy-Authorization": "Basic xyz",
+        "Authorization": "Bearer sk-test", "Content-Type": "application/json", "X-Fake-Chunk-Tokens": "4",
+    }
+    # As the logger receives them from Starlette
+    assert filter_request_headers(Headers(headers)) == {
+        "authorization": "Bearer sk-test", "content-type": "application/json", "x-fake-chunk-tokens": "4",
+    }
+
+
+def test_response_headers_drop_encoding_of_the_decoded_body():
+    headers = {"Content-Encoding": "gzip", "Content-Length": "10", "Transfer-Encoding": "chunked",
+               "Content-Type": "application/x-ndjson"}
+    assert filter_response_headers(headers) == {"Content-Type": "application/x-ndjson"}
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import httpx
+
+from backends import BackendPool
+from warmup import ModelWarmer
+
+
+class StubClient:
+    """Answers every request with `responses` in turn (the last one repeats) and records the requests"""
+
+    def __init__(self, *responses: httpx.Response):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def request(self, method, url, headers, content):
+        self.requests.append((url, json.loads(content)))
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+def load(payload, status: int = 200, client: StubClient = None) -> list:
+    calls = []
+
+    async def on_load(*args):
+        calls.append(args)
+
+    async def run():
+        pool = BackendPool(["http://ollama:11434"])
+        stub = client or StubClient(httpx.Response(status, json=payload))
+        warmer = ModelWarmer(pool, stub, ["llama3.1:8b"], on_load=on_load)
+        await warmer._load(pool.backends[0], "llama3.1:8b")
+        assert ("llama3.1:8b" in pool.backends[0].loaded_models) == (calls[0][4] is None)
+
+    asyncio.run(run())
+    return calls
+
+
+def test_load_reports_ollamas_load_duration_in_ms():
+    [(backend, model, status, seconds, error, load_duration_ms)] = load(
+        {"model": "llama3.1:8b", "done": True, "done_reason": "load", "load_duration": 2_500_000_000}
+    )
+    assert (status, error, load_duration_ms) == (200, None, 2500.0)
+    assert seconds < 1
+
+
+def test_load_without_load_duration():
+    [call] = load({"model": "llama3.1:8b", "done": True})
+    assert call[5] is None
+
+
+def test_failed_load():
+    [call] = load({"error": "model not found"}, status=404)
+    assert call[2] == 404 and call[4] and call[5] is None
+
+
+def test_non_json_success_is_a_failed_load():
+    client = StubClient(httpx.Response(200, text="<html>Bad gateway</html>"))
+    [call] = load(None, client=client)
+    assert call[2] == 502 and "Bad gateway" in call[4]
+
+
+def test_embedding_model_is_loaded_with_a_one_character_input():
+    client = StubClient(
+        httpx.Response(400, json={"error": '"nomic-embed-text" does not support generate'}),
+        httpx.Response(200, json={"model": "nomic-embed-text", "embeddings": [[0.1]], "load_duration": 800_000_000}),
+    )
+    [call] = load(None, client=client)
+    assert (call[2], call[4], call[5]) == (200, None, 800.0)
+    url, body = client.requests[1]
+    assert url.endswith("/api/embed") and body["input"] == "a"